@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""Benchmark binary_dot against dense BLAS for Bernoulli layer inputs.
+
+For every (rows, input width, output width) shape and activity level the
+forward product H.dot(W) and the training pass (forward plus gradient
+with respect to W) are timed with the dense theano dot and with
+binary_dot. The shapes are either given explicitly or taken from the
+hidden layers of a model, with the activity levels measured on q-samples.
+"""
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+sys.setrecursionlimit(100000)
+
+import time
+import logging
+
+import numpy as np
+
+import theano
+import theano.tensor as tensor
+
+from argparse import ArgumentParser
+
+import helmholtz.datasets as datasets
+
+from helmholtz.checkpoints import load_brick
+from helmholtz.ops import binary_dot
+
+logger = logging.getLogger("bench-binary-dot.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+floatX = theano.config.floatX
+
+#-----------------------------------------------------------------------------
+
+
+def compile_pair(dot):
+    H = tensor.matrix('H')
+    W = theano.shared(np.zeros((1, 1), dtype=floatX), name='W')
+    out = dot(H, W)
+    do_forward = theano.function([H], out, allow_input_downcast=True)
+    do_train = theano.function([H], tensor.grad(out.sum(), W), allow_input_downcast=True)
+    return W, do_forward, do_train
+
+
+def best_time(f, *args, **kwargs):
+    n_repeat = kwargs.get('n_repeat', 5)
+    f(*args)
+    best = np.inf
+    for _ in xrange(n_repeat):
+        t0 = time.time()
+        f(*args)
+        best = min(best, time.time() - t0)
+    return best
+
+
+def model_shapes(fname, data, n_rows, n_samples=10):
+    """ (dim_in, dim_out, activity) for every hidden-input layer of a model """
+    brick = load_brick(fname)
+
+    x = tensor.matrix('features')
+    samples, _, _ = brick.sample_q(x, n_samples=n_samples)
+    do_sample = theano.function([x], samples, allow_input_downcast=True)
+
+    _, _, _, stream = datasets.get_streams(data, max(n_rows // n_samples, 1))
+    features = next(stream.get_epoch_iterator(as_dict=True))['features']
+    activity = [float(s.mean()) for s in do_sample(features)]
+
+    shapes = []
+    for l, layer in enumerate(brick.p_layers[:-1]):
+        shapes.append(("p%d" % l, layer.dim_Y, layer.dim_X, activity[l + 1]))
+    for l, layer in enumerate(brick.q_layers[1:]):
+        shapes.append(("q%d" % (l + 1), layer.dim_Y, layer.dim_X, activity[l + 1]))
+    return shapes
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Benchmark binary_dot against dense BLAS")
+    parser.add_argument("--rows", type=int, default=10000,
+            help="Number of rows (batch size x samples; default: 10000)")
+    parser.add_argument("--dims", type=str, default="200x200,500x500,1000x1000",
+            help="Comma separated list of <input>x<output> shapes")
+    parser.add_argument("--activity", type=str, default="0.01,0.05,0.1,0.3",
+            help="Comma separated list of fractions of active units")
+    parser.add_argument("--model", type=str, default=None,
+            help="Take shapes and activity levels from the hidden layers of this model")
+    parser.add_argument("--data", "-d", dest='data', choices=datasets.supported_datasets,
+                default='bmnist', help="Dataset for --model")
+    args = parser.parse_args()
+
+    if args.model is not None:
+        shapes = model_shapes(args.model, args.data, args.rows)
+    else:
+        shapes = []
+        for dims in args.dims.split(","):
+            dim_in, dim_out = [int(d) for d in dims.split("x")]
+            for activity in args.activity.split(","):
+                shapes.append(("%dx%d" % (dim_in, dim_out), dim_in, dim_out, float(activity)))
+
+    dense = compile_pair(tensor.dot)
+    binary = compile_pair(binary_dot)
+
+    print()
+    print("%-12s %8s  %10s %10s %7s  %10s %10s %7s" %
+          ("layer", "activity", "dense fwd", "binary fwd", "speedup", "dense trn", "binary trn", "speedup"))
+    for name, dim_in, dim_out, activity in shapes:
+        H = (np.random.uniform(size=(args.rows, dim_in)) < activity).astype(floatX)
+        W = np.random.normal(size=(dim_in, dim_out)).astype(floatX)
+
+        times = []
+        for W_shared, do_forward, do_train in (dense, binary):
+            W_shared.set_value(W)
+            times += [best_time(do_forward, H), best_time(do_train, H)]
+
+        print("%-12s %8.3f  %9.2fms %9.2fms %6.2fx  %9.2fms %9.2fms %6.2fx" %
+              (name, activity,
+               1000 * times[0], 1000 * times[2], times[0] / times[2],
+               1000 * times[1], 1000 * times[3], times[1] / times[3]))
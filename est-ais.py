@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+sys.setrecursionlimit(100000)
+
+import time
+import logging
+
+import numpy as np
+import cPickle as pickle
+
+import theano
+import theano.tensor as tensor
+
+from argparse import ArgumentParser
+from progressbar import ProgressBar
+from scipy import stats
+from scipy.misc import logsumexp
+
+from blocks.main_loop import MainLoop
+
+import helmholtz.datasets as datasets
+
+from helmholtz.ais import sigmoid_schedule, linear_schedule, run_ais
+from helmholtz.ais import ais_nll_init, ais_nll_step, ais_z_init, ais_z_step
+from helmholtz.bihm import BiHM
+from helmholtz.evaluation import log_px_standard_error
+from helmholtz.gmm import GMM
+from helmholtz.rws import ReweightedWakeSleep
+
+logger = logging.getLogger("est-ais.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Estimate log p(x) and BiHM 2 log z with annealed importance sampling")
+    parser.add_argument("--data", "-d", dest='data', choices=datasets.supported_datasets,
+                default='bmnist', help="Dataset to use")
+    parser.add_argument("--max-batch", type=int,
+            default="10000", help="Maximum number of parallel chains (default: 10000)")
+    parser.add_argument("--steps", type=int, default=1000,
+            help="Number of annealing steps (default: 1000)")
+    parser.add_argument("--schedule", choices=['sigmoid', 'linear'], default='sigmoid',
+            help="Annealing schedule (default: sigmoid)")
+    parser.add_argument("--chains", type=int, default=100,
+            help="AIS chains per test example for log p(x) (default: 100)")
+    parser.add_argument("--zchains", type=int, default=10000,
+            help="Total number of AIS chains for 2 log z (default: 10000)")
+    parser.add_argument("--no-z-est", "-noz", action="store_true", default=False,
+            help="Do not estimate log Z for BiHM models")
+    parser.add_argument("--no-nll", action="store_true", default=False,
+            help="Do not estimate log p(x) on the test set")
+    parser.add_argument("experiment", help="Experiment to load")
+    args = parser.parse_args()
+
+    logger.info("Loading model %s..." % args.experiment)
+    with open(args.experiment, "rb") as f:
+        m = pickle.load(f)
+
+    if isinstance(m, MainLoop):
+        m = m.model
+
+    brick = m.get_top_bricks()[0]
+    while len(brick.parents) > 0:
+        brick = brick.parents[0]
+
+    assert isinstance(brick, (ReweightedWakeSleep, BiHM, GMM))
+
+    if args.schedule == 'sigmoid':
+        betas = sigmoid_schedule(args.steps)
+    else:
+        betas = linear_schedule(args.steps)
+
+    n_layers = len(brick.p_layers)
+    beta_prev = tensor.scalar('beta_prev')
+    beta = tensor.scalar('beta')
+
+    #----------------------------------------------------------------------
+    estimate_z = not args.no_z_est and isinstance(brick, (BiHM, GMM))
+    if estimate_z:
+        logger.info("Compiling AIS step for 2 log z...")
+
+        n_chains = tensor.iscalar('n_chains')
+        do_z_init = theano.function([n_chains], sum(ais_z_init(brick, n_chains), []),
+                                    name="do_z_init", allow_input_downcast=True)
+
+        h = [tensor.matrix('h%d' % l) for l in xrange(n_layers)]
+        h2 = [tensor.matrix('h2_%d' % l) for l in xrange(n_layers)]
+        h_new, h2_new, log_w = ais_z_step(brick, h, h2, beta_prev, beta)
+        do_z_step = theano.function([beta_prev, beta] + h + h2, h_new + h2_new + [log_w],
+                                    name="do_z_step", allow_input_downcast=True)
+
+        logger.info("Running %d AIS chains with %d steps..." % (args.zchains, args.steps))
+        t0 = time.time()
+        log_w = []
+        for k in ProgressBar()(xrange(0, args.zchains, args.max_batch)):
+            states = do_z_init(min(args.max_batch, args.zchains - k))
+            log_w.append(run_ais(do_z_step, states, betas)[0])
+        log_w = np.concatenate(log_w).astype(np.float64)
+
+        log_z2 = logsumexp(log_w) - np.log(len(log_w))
+        log_z2_se = log_px_standard_error(logsumexp(log_w), logsumexp(2 * log_w), len(log_w))
+        logger.info("Done in %.1fs" % (time.time() - t0))
+        print("2 log z ~= %5.3f +- %5.3f  (%d chains, %d steps)" % (log_z2, log_z2_se, len(log_w), args.steps))
+
+    #----------------------------------------------------------------------
+    if not args.no_nll:
+        logger.info("Compiling AIS step for log p(x)...")
+
+        x = tensor.matrix('features')
+        n_chains = tensor.iscalar('n_chains')
+        do_nll_init = theano.function([x, n_chains], ais_nll_init(brick, x, n_chains),
+                                      name="do_nll_init", allow_input_downcast=True)
+
+        h = [tensor.matrix('h%d' % l) for l in xrange(n_layers)]
+        h_new, log_w = ais_nll_step(brick, h, beta_prev, beta, n_chains)
+        do_nll_step = theano.function([beta_prev, beta, n_chains] + h, h_new + [log_w],
+                                      name="do_nll_step", allow_input_downcast=True)
+
+        K = args.chains
+        batch_size = max(args.max_batch // K, 1)
+        x_dim, _, _, stream = datasets.get_streams(args.data, batch_size)
+
+        logger.info("Running %d AIS chains per example with %d steps..." % (K, args.steps))
+        t0 = time.time()
+        log_p = []
+        for batch in ProgressBar()(stream.get_epoch_iterator(as_dict=True)):
+            features = batch['features']
+            do_step = lambda beta_prev, beta, *h: do_nll_step(beta_prev, beta, K, *h)
+            log_w, _ = run_ais(do_step, do_nll_init(features, K), betas)
+            log_w = log_w.reshape((features.shape[0], K)).astype(np.float64)
+            log_p.append(logsumexp(log_w, axis=1) - np.log(K))
+        log_p = np.concatenate(log_p)
+        logger.info("Done in %.1fs" % (time.time() - t0))
+
+        print("log p [AIS, %d chains, %d steps]:  %5.2f+-%4.2f" %
+            (K, args.steps, np.mean(log_p), stats.sem(log_p)))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+sys.setrecursionlimit(100000)
+
+import os
+import logging
+
+import numpy as np
+import cPickle as pickle
+
+import theano
+import theano.tensor as tensor
+
+from argparse import ArgumentParser
+from progressbar import ProgressBar
+from scipy import stats
+from scipy.misc import logsumexp
+
+from blocks.main_loop import MainLoop
+
+import helmholtz.datasets as datasets
+
+from helmholtz import unflatten_values
+from helmholtz.bihm import BiHM
+from helmholtz.evaluation import estimate_all
+from helmholtz.gmm import GMM
+from helmholtz.rws import ReweightedWakeSleep
+from helmholtz.sample_store import SampleStore
+from helmholtz.vae import VAE
+
+logger = logging.getLogger("est-all.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Estimate log p(x), log p*(x), KL and ESS from one sampling pass")
+    parser.add_argument("--data", "-d", dest='data', choices=datasets.supported_datasets,
+                default='bmnist', help="Dataset to use")
+    parser.add_argument("--max-batch", type=int,
+            default="10000", help="Maximum internal batch size (default: 10000)")
+    parser.add_argument("--nsamples", "--samples", "-s", type=int,
+            default=10000, help="no. of samples per datapoint")
+    parser.add_argument("--no-z-est", "-noz", action="store_true", default=False,
+            help="Do not estimate log Z for BiHM models")
+    parser.add_argument("--zsamples", type=int, default=1000000,
+            help="Estimate Z using this number of samples")
+    parser.add_argument("--output", "-o", type=str, default=None,
+            help="Results file (default: <experiment>-eval.npz)")
+    parser.add_argument("--store", type=str, default=None,
+            help="Also write all per-sample log p/log q values to this sample store directory")
+    parser.add_argument("--store-samples", action="store_true", default=False,
+            help="Also write the (bit-packed) latent samples to the sample store")
+    parser.add_argument("experiment", help="Experiment to load")
+    args = parser.parse_args()
+
+    logger.info("Loading model %s..." % args.experiment)
+    with open(args.experiment, "rb") as f:
+        m = pickle.load(f)
+
+    if isinstance(m, MainLoop):
+        m = m.model
+
+    brick = m.get_top_bricks()[0]
+    while len(brick.parents) > 0:
+        brick = brick.parents[0]
+
+    assert isinstance(brick, (ReweightedWakeSleep, BiHM, GMM, VAE))
+    has_ps = isinstance(brick, (BiHM, GMM))
+
+    if args.output is None:
+        args.output = os.path.splitext(args.experiment)[0] + "-eval.npz"
+
+    #----------------------------------------------------------------------
+    logger.info("Compiling functions...")
+
+    n_samples = tensor.iscalar('n_samples')
+    x = tensor.matrix('features')
+    batch_size = x.shape[0]
+
+    samples, log_p, log_q = brick.sample_q(x, n_samples=n_samples)
+
+    log_p = unflatten_values(log_p, batch_size, n_samples)
+    log_q = unflatten_values(log_q, batch_size, n_samples)
+
+    outputs = log_p + log_q
+    if args.store_samples:
+        # samples[0] are the features (one row per example)
+        outputs += unflatten_values(samples[1:], batch_size, n_samples)
+
+    do_sample = theano.function(
+                        [x, n_samples],
+                        outputs,
+                        name="do_sample", allow_input_downcast=True)
+
+    estimate_z = has_ps and not args.no_z_est
+    if estimate_z:
+        bs = tensor.iscalar('bs')
+        log_z2 = brick.estimate_log_z2(bs)
+
+        do_z = theano.function(
+            [bs],
+            log_z2,
+            name="do_z", allow_input_downcast=True)
+
+    #----------------------------------------------------------------------
+    log_z2 = np.nan
+    if estimate_z:
+        logger.info("Estimating log z...")
+
+        seq = []
+        for _ in ProgressBar()(xrange(0, args.zsamples, args.max_batch)):
+            seq.append(float(do_z(args.max_batch)))
+        log_z2 = logsumexp(seq) - np.log(len(seq) * args.max_batch)
+
+    #----------------------------------------------------------------------
+    logger.info("Sampling test set with %d samples per datapoint..." % args.nsamples)
+
+    K = args.nsamples
+    batch_size = max(args.max_batch // K, 1)
+    # In dataset order: row i of the results and of the store is test example i
+    x_dim, _, _, stream = datasets.get_streams(args.data, batch_size, shuffle=False)
+
+    store = None
+    if args.store is not None:
+        assert not isinstance(brick, VAE)
+        _, _, _, data_test = datasets.get_data(args.data)
+        layer_dims = [layer.dim_X for layer in brick.p_layers]
+        store = SampleStore.create(args.store, data_test.num_examples, K, layer_dims,
+                                   store_samples=args.store_samples,
+                                   experiment=args.experiment, data=args.data)
+
+    n_layers = len(log_p)
+    n_done = 0
+    results = []
+    for batch in ProgressBar()(stream.get_epoch_iterator(as_dict=True)):
+        ret = do_sample(batch['features'], K)
+        log_p, log_q, samples = ret[:n_layers], ret[n_layers:2*n_layers], ret[2*n_layers:]
+        results.append(estimate_all(log_p, log_q))
+
+        if store is not None:
+            store.write(n_done, log_p, log_q, [None] + samples if samples else None)
+        n_done += batch['features'].shape[0]
+
+    results = {key: np.concatenate([r[key] for r in results], axis=-1) for key in results[0]}
+    results['log_z2'] = log_z2
+    results['n_samples'] = K
+    results['log_ps'] = results['log_psx'] - log_z2
+
+    np.savez(args.output, **results)
+    logger.info("Saved results to %s" % args.output)
+
+    if store is not None:
+        store.meta['log_z2'] = log_z2
+        store.save_meta()
+        store.flush()
+        logger.info("Saved sample store to %s" % args.store)
+
+    #----------------------------------------------------------------------
+    def summary(name, values):
+        print("%-10s: %f +-%f (std: %f)" % (name, values.mean(), stats.sem(values), np.std(values)))
+
+    print()
+    summary("log p(x)", results['log_px'])
+    if has_ps:
+        summary("log p~(x)", results['log_psx'])
+        if estimate_z:
+            print("2 log z   : %f" % log_z2)
+            summary("log p*(x)", results['log_ps'])
+    summary("KL(q|p)", results['kl'])
+    for l, kl in enumerate(results['layer_kl']):
+        summary("KL%d(q|p)" % l, kl)
+    summary("ESS p", 100 * results['ess_p'])
+    if has_ps:
+        summary("ESS p*", 100 * results['ess_ps'])
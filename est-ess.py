@@ -23,7 +23,7 @@ from blocks.main_loop import MainLoop
 
 import helmholtz.datasets as datasets
 
-from helmholtz import flatten_values, unflatten_values, replicate_batch, logsumexp
+from helmholtz import flatten_values, unflatten_values, logsumexp
 from helmholtz.bihm import BiHM
 from helmholtz.gmm import GMM
 from helmholtz.rws import ReweightedWakeSleep
@@ -67,11 +67,9 @@ if __name__ == "__main__":
     n_samples = tensor.iscalar('n_samples')
     x = tensor.matrix('features')
 
-    x_ = replicate_batch(x, n_samples)
-    samples, log_p, log_q = brick.sample_q(x_)
+    samples, log_p, log_q = brick.sample_q(x, n_samples=n_samples)
 
     # Reshape and sum
-    samples = unflatten_values(samples, batch_size, n_samples)
     log_p = unflatten_values(log_p, batch_size, n_samples)
     log_q = unflatten_values(log_q, batch_size, n_samples)
 
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+sys.setrecursionlimit(100000)
+
+import time
+import logging
+
+import numpy as np
+import cPickle as pickle
+
+import theano
+import theano.tensor as tensor
+
+from argparse import ArgumentParser
+from scipy import stats
+
+from blocks.main_loop import MainLoop
+
+import helmholtz.datasets as datasets
+
+from helmholtz.bihm import BiHM
+from helmholtz.exact import ExactEnumeration
+from helmholtz.gmm import GMM
+from helmholtz.rws import ReweightedWakeSleep
+
+logger = logging.getLogger("est-exact.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Compute exact log p(x) and 2 log Z by enumeration")
+    parser.add_argument("--data", "-d", dest='data', choices=datasets.supported_datasets,
+                default='bars', help="Dataset to use")
+    parser.add_argument("--chunk-size", type=int, default=4096,
+            help="Configurations enumerated at once (default: 4096)")
+    parser.add_argument("--nsamples", "--samples", "-s", type=str, default=None,
+            help="Comma seperated list of #samples to compare the importance sampling estimates against")
+    parser.add_argument("--max-batch", type=int,
+            default="10000", help="Maximum internal batch size (default: 10000)")
+    parser.add_argument("experiment", help="Experiment to load")
+    args = parser.parse_args()
+
+    logger.info("Loading model %s..." % args.experiment)
+    with open(args.experiment, "rb") as f:
+        m = pickle.load(f)
+
+    if isinstance(m, MainLoop):
+        m = m.model
+
+    brick = m.get_top_bricks()[0]
+    while len(brick.parents) > 0:
+        brick = brick.parents[0]
+
+    assert isinstance(brick, (ReweightedWakeSleep, BiHM, GMM))
+    has_ps = isinstance(brick, (BiHM, GMM))
+
+    exact = ExactEnumeration(brick, chunk_size=args.chunk_size)
+
+    #----------------------------------------------------------------------
+    logger.info("Loading dataset...")
+
+    x_dim, _, _, stream = datasets.get_streams(args.data, args.chunk_size)
+    features = np.concatenate([batch['features'] for batch in stream.get_epoch_iterator(as_dict=True)])
+
+    def summary(name, values):
+        print("%-18s: %f +-%f (std: %f)" % (name, values.mean(), stats.sem(values), np.std(values)))
+
+    logger.info("Enumerating log p(x) for %d examples..." % features.shape[0])
+    t0 = time.time()
+    log_px = exact.log_px(features)
+    logger.info("Done in %.2fs" % (time.time() - t0))
+
+    if has_ps:
+        logger.info("Enumerating 2 log z over all %d data vectors..." % 2 ** x_dim)
+        t0 = time.time()
+        log_z2 = exact.log_z2()
+        log_ps = exact.log_psx(features) - log_z2
+        logger.info("Done in %.2fs" % (time.time() - t0))
+
+    print()
+    summary("log p(x) (exact)", log_px)
+    if has_ps:
+        print("2 log z (exact)   : %f" % log_z2)
+        summary("log p*(x) (exact)", log_ps)
+
+    #----------------------------------------------------------------------
+    if args.nsamples is not None:
+        n_samples = tensor.iscalar('n_samples')
+        x = tensor.matrix('features')
+
+        log_p, log_psx = brick.log_likelihood(x, n_samples)
+        do_nll = theano.function(
+                            [x, n_samples],
+                            [log_p, log_psx],
+                            name="do_nll", allow_input_downcast=True)
+
+        print()
+        for K in (int(s) for s in args.nsamples.split(",")):
+            batch_size = max(args.max_batch // K, 1)
+
+            t0 = time.time()
+            est = np.concatenate([do_nll(features[i:i+batch_size], K)[0]
+                                  for i in xrange(0, features.shape[0], batch_size)])
+            dt = time.time() - t0
+
+            bias = est - log_px
+            print("IS bias [%6d spls]: %f +-%f  (%.2fs)" % (K, bias.mean(), stats.sem(bias), dt))
@@ -26,7 +26,8 @@ from blocks.main_loop import MainLoop
 
 import helmholtz.datasets as datasets
 
-from helmholtz import flatten_values, unflatten_values, replicate_batch, logsumexp
+from helmholtz import flatten_values, unflatten_values, logsumexp
+from helmholtz.autotune import autotune_batch_size, probe_features
 from helmholtz.bihm import BiHM
 from helmholtz.gmm import GMM
 from helmholtz.rws import ReweightedWakeSleep
@@ -46,6 +47,8 @@ if __name__ == "__main__":
                 default='bmnist', help="Dataset to use")
     parser.add_argument("--nsamples", "--samples", "-s", type=int, 
             default=10000, help="no. of samples")
+    parser.add_argument("--mem-budget", type=str, default=None,
+            help="Autotune the batch size for this memory budget (e.g. 2G)")
     parser.add_argument("experiment", help="Experiment to load")
     args = parser.parse_args()
 
@@ -70,11 +73,9 @@ if __name__ == "__main__":
     x = tensor.matrix('features')
     batch_size = x.shape[0]
 
-    x_ = replicate_batch(x, n_samples)
-    samples, log_p, log_q = brick.sample_q(x_)
+    samples, log_p, log_q = brick.sample_q(x, n_samples=n_samples)
 
     # Reshape and sum
-    samples = unflatten_values(samples, batch_size, n_samples)
     log_p = unflatten_values(log_p, batch_size, n_samples)
     log_q = unflatten_values(log_q, batch_size, n_samples)
 
@@ -100,7 +101,12 @@ if __name__ == "__main__":
     logger.info("Loading dataset...")
 
     n_samples = args.nsamples
-    batch_size = max(1, 10000 // args.nsamples)
+    if args.mem_budget is None:
+        batch_size = max(1, 10000 // args.nsamples)
+    else:
+        probe = probe_features(args.data)
+        batch_size = autotune_batch_size(lambda bs: do_kl(probe[:bs], n_samples), brick, n_samples,
+                                         args.mem_budget, "est-kl", max_batch=len(probe))
     
     x_dim, stream_train, stream_valid, stream_test = datasets.get_streams(args.data, batch_size)
     stream = stream_test
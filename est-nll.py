@@ -13,6 +13,7 @@ import numpy as np
 import cPickle as pickle
 
 import theano
+import theano.sparse
 import theano.tensor as tensor
 
 from PIL import Image
@@ -29,7 +30,14 @@ from blocks.main_loop import MainLoop
 
 import helmholtz.datasets as datasets
 
-from helmholtz import replicate_batch
+from helmholtz import unflatten_values, hidden_input_layers
+from helmholtz.autotune import autotune_batch_size, probe_features
+from helmholtz.batch_normalization import batch_normalizations
+from helmholtz.distributions import sampling_modes
+from helmholtz.estimators import smc_log_likelihood, rao_blackwellized_log_likelihood
+from helmholtz.evaluation import log_px_standard_error
+from helmholtz.prob_layers import BernoulliLayer
+from helmholtz.psis import pareto_smooth
 from helmholtz.gmm import GMM
 from helmholtz.bihm import BiHM
 from helmholtz.rws import ReweightedWakeSleep
@@ -49,12 +57,42 @@ if __name__ == "__main__":
                 default='bmnist', help="Dataset to use")
     parser.add_argument("--max-batch", type=int, 
             default="10000", help="Maximum internal batch size (default: 10000)")
+    parser.add_argument("--mem-budget", type=str, default=None,
+            help="Autotune the batch size for this memory budget (e.g. 2G) instead of using --max-batch")
     parser.add_argument("--nsamples", "--samples", "-s", type=str, 
             default="1,10,100,1000,10000", help="Comma seperated list of #samples")
     parser.add_argument("--no-z-est", "-noz", action="store_true", default=False,
             help="Do not estimate log Z for BiHM models")
     parser.add_argument("--zsamples", type=int, default=1000000,
             help="Estimate Z using this number of samples")
+    parser.add_argument("--sampling", choices=sampling_modes, default=None,
+            help="Override how the proposal samples per example are drawn (RWS and BiHM models)")
+    parser.add_argument("--smc", action="store_true", default=False,
+            help="Use sequential importance resampling between layers (RWS and BiHM models)")
+    parser.add_argument("--ess-threshold", type=float, default=0.5,
+            help="SMC: resample when the ESS drops below this fraction of the samples (default: 0.5)")
+    parser.add_argument("--rao-blackwell", "--rb", action="store_true", default=False,
+            help="Sum out the top layer by exact enumeration instead of sampling it")
+    parser.add_argument("--rb-max-width", type=int, default=10,
+            help="Maximum top layer width for --rao-blackwell; wider top layers are sampled (default: 10)")
+    parser.add_argument("--psis", action="store_true", default=False,
+            help="Pareto smooth the importance weights and report the tail shape k_hat (smooths from 21 samples up)")
+    parser.add_argument("--dedup", action="store_true", default=False,
+            help="Evaluate every distinct latent configuration only once per layer")
+    parser.add_argument("--scan-layers", action="store_true", default=False,
+            help="Process equal-width stretches of layers with theano.scan (RWS and BiHM models)")
+    parser.add_argument("--binary-dot", action="store_true", default=False,
+            help="Multiply binary hidden samples as sums of selected weight rows (RWS and BiHM models)")
+    parser.add_argument("--sparse", action="store_true", default=False,
+            help="Feed the features as sparse CSR batches (RWS and BiHM models; rcv1, web, nips)")
+    parser.add_argument("--bn-population", action="store_true", default=False,
+            help="Batch normalize with the population statistics instead of the batch statistics")
+    parser.add_argument("--adaptive-se", type=float, default=None,
+            help="Add samples per example until the standard error of its log p(x) falls below this value")
+    parser.add_argument("--chunk", type=int, default=100,
+            help="Adaptive mode: number of samples added per example and step (default: 100)")
+    parser.add_argument("--max-samples", type=int, default=100000,
+            help="Adaptive mode: maximum number of samples per example (default: 100000)")
     parser.add_argument("experiment", help="Experiment to load")
     args = parser.parse_args()
 
@@ -71,6 +109,33 @@ if __name__ == "__main__":
 
     assert isinstance(brick, (ReweightedWakeSleep, GMM, BiHM, VAE))
 
+    if args.sampling is not None:
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        brick.sampling = args.sampling
+
+    if args.scan_layers:
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        brick.scan_layers = True
+
+    if args.binary_dot:
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        for layer in hidden_input_layers(brick):
+            layer.binary_input = True
+
+    if args.sparse:
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        assert not (args.smc or args.rao_blackwell)
+
+    if args.dedup:
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        for layer in brick.p_layers + brick.q_layers:
+            if isinstance(layer, BernoulliLayer):
+                layer.dedup = True
+
+    if args.bn_population:
+        for bn in batch_normalizations(brick):
+            bn.use_population = True
+
     #----------------------------------------------------------------------
     estimate_z = not args.no_z_est and isinstance(brick, (BiHM, GMM))
     if estimate_z:
@@ -96,18 +161,123 @@ if __name__ == "__main__":
                 
         logger.info("2 log z ~= %5.3f" % log_z2)
 
+    #----------------------------------------------------------------------
+    if args.adaptive_se is not None:
+        logger.info("Compiling function...")
+
+        n_samples = tensor.iscalar('n_samples')
+        x = theano.sparse.csr_matrix('features') if args.sparse else tensor.matrix('features')
+        batch_size = x.shape[0]
+
+        if isinstance(brick, (ReweightedWakeSleep, BiHM)):
+            samples, log_p, log_q = brick.sample_q(x, brick.proposal_noise(batch_size, n_samples), n_samples)
+        else:
+            samples, log_p, log_q = brick.sample_q(x, n_samples=n_samples)
+        log_w = unflatten_values(sum(log_p) - sum(log_q), batch_size, n_samples)
+
+        do_log_w = theano.function(
+                            [x, n_samples],
+                            log_w,
+                            name="do_log_w", allow_input_downcast=True)
+
+        #------------------------------------------------------------------
+        logger.info("Adaptive sampling until SE(log p(x)) < %f (max. %d samples per example)" %
+                    (args.adaptive_se, args.max_samples))
+
+        K = args.chunk
+        batch_size = max(args.max_batch // K, 1)
+        x_dim, _, _, stream = datasets.get_streams(args.data, batch_size, sparse=args.sparse)
+
+        log_p, log_ps, log_p_se, n_used = [], [], [], []
+        for batch in ProgressBar()(stream.get_epoch_iterator(as_dict=True)):
+            features = batch['features']
+            n_examples = features.shape[0]
+
+            # Running log sum(w), log sum(w^2) and log sum(sqrt(w)) per example
+            log_sum_w = np.full(n_examples, -np.inf)
+            log_sum_w2 = np.full(n_examples, -np.inf)
+            log_sum_sw = np.full(n_examples, -np.inf)
+            n = np.zeros(n_examples, dtype=np.int64)
+
+            active = np.arange(n_examples)
+            while len(active) > 0:
+                log_w = do_log_w(features[active], K).astype(np.float64)
+
+                log_sum_w[active] = np.logaddexp(log_sum_w[active], logsumexp(log_w, axis=1))
+                log_sum_w2[active] = np.logaddexp(log_sum_w2[active], logsumexp(2 * log_w, axis=1))
+                log_sum_sw[active] = np.logaddexp(log_sum_sw[active], logsumexp(log_w / 2, axis=1))
+                n[active] += K
+
+                se = log_px_standard_error(log_sum_w, log_sum_w2, n)
+                active = np.where((se > args.adaptive_se) & (n + K <= args.max_samples))[0]
+
+            log_p.append(log_sum_w - np.log(n))
+            log_ps.append(2 * (log_sum_sw - np.log(n)))
+            log_p_se.append(se)
+            n_used.append(n)
+
+        log_p = np.concatenate(log_p)
+        log_ps = np.concatenate(log_ps)
+        log_p_se = np.concatenate(log_p_se)
+        n_used = np.concatenate(n_used)
+
+        # Monte Carlo error of the dataset average from the per-example SEs
+        mc_se = np.sqrt(np.sum(log_p_se ** 2)) / len(log_p_se)
+
+        print("samples per example: %.1f avg. / %d min. / %d max. (%d total)" %
+            (n_used.mean(), n_used.min(), n_used.max(), n_used.sum()))
+        print("examples reaching the target SE: %d / %d" %
+            (np.sum(log_p_se <= args.adaptive_se), len(log_p_se)))
+        print("MC standard error of the average log p: %6.4f" % mc_se)
+        if estimate_z:
+            print("log p / log p~ / log p* [adaptive]:  %5.2f+-%4.2f  /  %5.2f+-%4.2f  /  %5.2f" %
+                (np.mean(log_p), stats.sem(log_p), np.mean(log_ps), stats.sem(log_ps), np.mean(log_ps)-log_z2))
+        else:
+            print("log p / log p~ [adaptive]:  %5.2f+-%4.2f  /  %5.2f+-%4.2f" %
+                (np.mean(log_p), stats.sem(log_p), np.mean(log_ps), stats.sem(log_ps)))
+        sys.exit(0)
+
     #----------------------------------------------------------------------
     logger.info("Compiling function...")
 
     n_samples = tensor.iscalar('n_samples')
-    x = tensor.matrix('features')
-
-    log_p, log_ps = brick.log_likelihood(x, n_samples)
+    x = theano.sparse.csr_matrix('features') if args.sparse else tensor.matrix('features')
+
+    if args.smc:
+        # The second output counts the resampling steps per example
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        log_p, log_ps = smc_log_likelihood(brick, x, n_samples, args.ess_threshold)
+    elif args.rao_blackwell:
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        log_p, log_ps = rao_blackwellized_log_likelihood(brick, x, n_samples, args.rb_max_width)
+    elif args.psis:
+        batch_size = x.shape[0]
+        if isinstance(brick, (ReweightedWakeSleep, BiHM)):
+            samples, log_p, log_q = brick.sample_q(x, brick.proposal_noise(batch_size, n_samples), n_samples)
+        else:
+            samples, log_p, log_q = brick.sample_q(x, n_samples=n_samples)
+        log_w = unflatten_values(sum(log_p) - sum(log_q), batch_size, n_samples)
+    else:
+        log_p, log_ps = brick.log_likelihood(x, n_samples)
     
-    do_nll = theano.function(
-                        [x, n_samples], 
-                        [log_p, log_ps],
-                        name="do_nll", allow_input_downcast=True)
+    if args.psis:
+        do_log_w = theano.function(
+                            [x, n_samples],
+                            log_w,
+                            name="do_log_w", allow_input_downcast=True)
+
+        k_hats = []
+        def do_nll(features, K):
+            log_w = do_log_w(features, K).astype(np.float64)
+            log_w_p, k_hat = pareto_smooth(log_w)
+            log_w_ps, _ = pareto_smooth(log_w / 2)
+            k_hats.append(k_hat)
+            return logsumexp(log_w_p, axis=1) - np.log(K), 2 * (logsumexp(log_w_ps, axis=1) - np.log(K))
+    else:
+        do_nll = theano.function(
+                            [x, n_samples], 
+                            [log_p, log_ps],
+                            name="do_nll", allow_input_downcast=True)
 
     #----------------------------------------------------------------------
     logger.info("Loading dataset...")
@@ -120,9 +290,33 @@ if __name__ == "__main__":
     dict_p = {}
     dict_ps = {}
     
+    if args.mem_budget is not None:
+        probe = probe_features(args.data, sparse=args.sparse)
+
+        # Batch sizes tuned for one estimation mode do not carry over to another
+        modes = [name for name in ('smc', 'rao_blackwell', 'psis', 'sparse', 'dedup',
+                                   'scan_layers', 'binary_dot', 'bn_population')
+                 if getattr(args, name)]
+        if args.sampling is not None:
+            modes.append(args.sampling)
+        autotune_tag = "-".join(["est-nll"] + modes)
+
+        # log_cond, log_q_top, log_p_top and their mean: (rows, 2**top_dim) each
+        row_width = 0
+        if args.rao_blackwell and brick.p_layers[-1].dim_X <= args.rb_max_width:
+            row_width = 4 * 2 ** brick.p_layers[-1].dim_X
+
     for K in n_samples:
-        batch_size = max(args.max_batch // K, 1)
-        x_dim, _, _, stream = datasets.get_streams(args.data, batch_size)
+        if args.mem_budget is None:
+            batch_size = max(args.max_batch // K, 1)
+        else:
+            batch_size = autotune_batch_size(lambda bs: do_nll(probe[:bs], K), brick, K,
+                                             args.mem_budget, autotune_tag, max_batch=probe.shape[0],
+                                             row_width=row_width)
+            if args.psis:
+                # Drop the tail shapes of the probe batches
+                del k_hats[:]
+        x_dim, _, _, stream = datasets.get_streams(args.data, batch_size, sparse=args.sparse)
 
         log_p = np.asarray([])
         log_ps = np.asarray([])
@@ -139,8 +333,17 @@ if __name__ == "__main__":
 
         dict_p[K] = log_p
         dict_ps[K] = log_ps
+
+        if args.psis:
+            k_hat = np.concatenate(k_hats)
+            del k_hats[:]
+            print("PSIS k_hat [%6d spls]:  median %4.2f, %5.1f%% of examples > 0.7" %
+                (K, np.median(k_hat), 100. * np.mean(k_hat > 0.7)))
     
-        if estimate_z:
+        if args.smc:
+            print("log p [%6d spls, SMC]:  %5.2f+-%4.2f  (%4.2f resampling steps per example)" %
+                (K, log_p, log_p_, log_ps))
+        elif estimate_z:
             print("log p / log p~ / log p* [%6d spls]:  %5.2f+-%4.2f  /  %5.2f+-%4.2f  /  %5.2f" % 
                 (K, log_p, log_p_, log_ps, log_ps_, log_ps-log_z2))
         else:
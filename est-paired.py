@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""Compare log p(x) of two models with common random numbers.
+
+Both models are evaluated on the same test examples with the same uniform
+noise: the noise for every (example, layer, sample, unit) is produced by a
+counter-based generator, independent of the model and the batching. The
+Monte Carlo errors of both estimates are therefore strongly correlated and
+the paired per-example differences resolve small improvements with far
+fewer samples than two independent runs.
+"""
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+sys.setrecursionlimit(100000)
+
+import logging
+
+import numpy as np
+
+import theano
+import theano.tensor as tensor
+
+from argparse import ArgumentParser
+from progressbar import ProgressBar
+from scipy import stats
+
+import helmholtz.datasets as datasets
+
+from helmholtz.bihm import BiHM
+from helmholtz.checkpoints import load_brick
+from helmholtz.distributions import counter_uniform
+from helmholtz.rws import ReweightedWakeSleep
+
+logger = logging.getLogger("est-paired.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+
+def compile_nll(brick):
+    """ Compile do_nll(features, n_samples, *noise) with one noise matrix per q-layer """
+    n_samples = tensor.iscalar('n_samples')
+    x = tensor.matrix('features')
+    noise = [tensor.matrix('noise%d' % l) for l in xrange(len(brick.q_layers))]
+
+    log_p, log_ps = brick.log_likelihood(x, n_samples, noise)
+
+    return theano.function(
+                        [x, n_samples] + noise,
+                        [log_p, log_ps],
+                        name="do_nll", allow_input_downcast=True)
+
+
+def layer_noise(brick, example_ids, n_samples, seed):
+    return [counter_uniform(example_ids, l, n_samples, layer.dim_X, seed)
+            for l, layer in enumerate(brick.q_layers)]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Paired comparison of log p(x) for two models using common random numbers")
+    parser.add_argument("--data", "-d", dest='data', choices=datasets.supported_datasets,
+                default='bmnist', help="Dataset to use")
+    parser.add_argument("--max-batch", type=int,
+            default="10000", help="Maximum internal batch size (default: 10000)")
+    parser.add_argument("--nsamples", "--samples", "-s", type=str,
+            default="10,100,1000", help="Comma seperated list of #samples")
+    parser.add_argument("--seed", type=int, default=0,
+            help="Seed of the counter-based noise generator")
+    parser.add_argument("--independent", action="store_true", default=False,
+            help="Use independent noise for the two models (for comparison)")
+    parser.add_argument("experiment_a", help="First model")
+    parser.add_argument("experiment_b", help="Second model")
+    args = parser.parse_args()
+
+    bricks = []
+    for fname in (args.experiment_a, args.experiment_b):
+        logger.info("Loading model %s..." % fname)
+        brick = load_brick(fname)
+        assert isinstance(brick, (ReweightedWakeSleep, BiHM))
+        bricks.append(brick)
+
+    seeds = [args.seed, args.seed + 1] if args.independent else [args.seed, args.seed]
+
+    logger.info("Compiling functions...")
+    do_nlls = [compile_nll(brick) for brick in bricks]
+
+    #----------------------------------------------------------------------
+    n_samples = [int(s) for s in args.nsamples.split(",")]
+
+    print()
+    print("log p(x) differences %s - %s (%s noise)" %
+          (args.experiment_a, args.experiment_b, "independent" if args.independent else "common"))
+    for K in n_samples:
+        batch_size = max(args.max_batch // K, 1)
+        x_dim, _, _, stream = datasets.get_streams(args.data, batch_size)
+
+        n_done = 0
+        log_p = [[], []]
+        log_ps = [[], []]
+        for batch in ProgressBar()(stream.get_epoch_iterator(as_dict=True)):
+            features = batch['features']
+            example_ids = np.arange(n_done, n_done + features.shape[0])
+            for i, (brick, do_nll, seed) in enumerate(zip(bricks, do_nlls, seeds)):
+                log_p_, log_ps_ = do_nll(features, K, *layer_noise(brick, example_ids, K, seed))
+                log_p[i].append(log_p_)
+                log_ps[i].append(log_ps_)
+            n_done += features.shape[0]
+
+        log_p = [np.concatenate(l) for l in log_p]
+        log_ps = [np.concatenate(l) for l in log_ps]
+
+        diff = log_p[0] - log_p[1]
+        unpaired_se = np.sqrt(stats.sem(log_p[0]) ** 2 + stats.sem(log_p[1]) ** 2)
+        print("log p  [%6d spls]:  %7.3f - %7.3f = %7.3f +-%6.4f  (unpaired SE %6.4f)" %
+              (K, np.mean(log_p[0]), np.mean(log_p[1]), np.mean(diff), stats.sem(diff), unpaired_se))
+
+        if all(isinstance(brick, BiHM) for brick in bricks):
+            diff = log_ps[0] - log_ps[1]
+            print("log p~ [%6d spls]:  %7.3f - %7.3f = %7.3f +-%6.4f" %
+                  (K, np.mean(log_ps[0]), np.mean(log_ps[1]), np.mean(diff), stats.sem(diff)))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+
+import logging
+
+import numpy as np
+
+from argparse import ArgumentParser
+from scipy import stats
+
+from helmholtz.sample_store import SampleStore
+
+logger = logging.getLogger("est-store.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Offline analysis of a sample store written by est-all.py --store")
+    parser.add_argument("--nsamples", "--samples", "-s", type=str, default=None,
+            help="Comma separated list of K values to estimate log p(x) for (default: all samples)")
+    parser.add_argument("--histogram", type=str, default=None,
+            help="Save a histogram of the normalized log weights to this .npz file")
+    parser.add_argument("store", help="Sample store directory")
+    args = parser.parse_args()
+
+    store = SampleStore(args.store)
+    logger.info("Opened %s: %d examples x %d samples, layers %s" %
+                (args.store, store.n_examples, store.n_samples, store.layer_dims))
+
+    if args.nsamples is None:
+        n_samples = [store.n_samples]
+    else:
+        n_samples = [int(s) for s in args.nsamples.split(",")]
+
+    def summary(name, values):
+        print("%-14s: %f +-%f (std: %f)" % (name, values.mean(), stats.sem(values), np.std(values)))
+
+    print()
+    for K in n_samples:
+        summary("log p(x) K=%d" % K, store.log_px(K))
+
+    log_z2 = store.meta.get('log_z2', np.nan)
+    if not np.isnan(log_z2):
+        for K in n_samples:
+            summary("log p*(x) K=%d" % K, store.log_psx(K) - log_z2)
+
+    summary("KL(q|p)", store.kl())
+    for l, kl in enumerate(store.layer_kl()):
+        summary("KL%d(q|p)" % l, kl)
+    summary("ESS p", 100 * store.ess())
+    summary("ESS p*", 100 * store.ess(sqrt_weights=True))
+
+    if args.histogram is not None:
+        counts, edges = store.weight_histogram()
+        np.savez(args.histogram, counts=counts, edges=edges)
+        logger.info("Saved weight histogram to %s" % args.histogram)
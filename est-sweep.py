@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""Evaluate all model checkpoints of a sweep and rank them by log p(x).
+
+Checkpoints are grouped by architecture: log_likelihood is compiled once
+for every distinct architecture and the parameters of every further
+checkpoint are assigned into the shared variables of the compiled group.
+A line is printed for every checkpoint as soon as it is evaluated; the
+final leaderboard is printed at the end.
+"""
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+sys.setrecursionlimit(100000)
+
+import os
+import glob
+import logging
+
+import numpy as np
+
+import theano
+import theano.tensor as tensor
+
+from argparse import ArgumentParser
+from scipy import stats
+
+import helmholtz.datasets as datasets
+
+from helmholtz.bihm import BiHM
+from helmholtz.checkpoints import load_brick, CompiledGroups
+from helmholtz.gmm import GMM
+from helmholtz.rws import ReweightedWakeSleep
+from helmholtz.vae import VAE
+
+logger = logging.getLogger("est-sweep.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+
+def compile_nll(brick):
+    n_samples = tensor.iscalar('n_samples')
+    x = tensor.matrix('features')
+    log_p, log_ps = brick.log_likelihood(x, n_samples)
+
+    return theano.function(
+                        [x, n_samples],
+                        [log_p, log_ps],
+                        name="do_nll", allow_input_downcast=True)
+
+
+def print_leaderboard(results, top=None):
+    results = sorted(results, key=lambda r: -r['log_p'])
+    if top is not None:
+        results = results[:top]
+
+    print()
+    print("%4s  %9s %6s  %9s %6s  %s" % ("rank", "log p", "+-", "log p~", "+-", "checkpoint"))
+    for rank, r in enumerate(results):
+        print("%4d  %9.3f %6.3f  %9.3f %6.3f  %s" %
+              (rank + 1, r['log_p'], r['log_p_se'], r['log_ps'], r['log_ps_se'], r['fname']))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Evaluate and rank all model checkpoints of a sweep")
+    parser.add_argument("--data", "-d", dest='data', choices=datasets.supported_datasets,
+                default='bmnist', help="Dataset to use")
+    parser.add_argument("--set", choices=['valid', 'test'], default='test',
+            help="Data set to evaluate on (default: test)")
+    parser.add_argument("--max-batch", type=int,
+            default="10000", help="Maximum internal batch size (default: 10000)")
+    parser.add_argument("--nsamples", "--samples", "-s", type=int,
+            default=1000, help="no. of samples per datapoint (default: 1000)")
+    parser.add_argument("--output", "-o", type=str, default=None,
+            help="Also append one tab separated line per checkpoint to this file")
+    parser.add_argument("--top", type=int, default=None,
+            help="Only print the best N checkpoints in the final leaderboard")
+    parser.add_argument("checkpoints", nargs="+",
+            help="Checkpoint files or directories (searched for *_model.pkl)")
+    args = parser.parse_args()
+
+    fnames = []
+    for path in args.checkpoints:
+        if os.path.isdir(path):
+            fnames += sorted(glob.glob(os.path.join(path, "*_model.pkl")))
+        else:
+            fnames.append(path)
+    logger.info("Evaluating %d checkpoints" % len(fnames))
+
+    K = args.nsamples
+    batch_size = max(args.max_batch // K, 1)
+    _, _, valid_stream, test_stream = datasets.get_streams(args.data, batch_size)
+    stream = valid_stream if args.set == 'valid' else test_stream
+
+    groups = CompiledGroups(compile_nll)
+
+    output = None
+    if args.output is not None:
+        output = open(args.output, "a")
+
+    results = []
+    for i, fname in enumerate(fnames):
+        try:
+            brick = load_brick(fname)
+        except Exception as e:
+            logger.warning("Skipping %s: %s" % (fname, e))
+            continue
+        assert isinstance(brick, (ReweightedWakeSleep, GMM, BiHM, VAE))
+
+        do_nll = groups.get(brick)
+
+        log_p, log_ps = [], []
+        for batch in stream.get_epoch_iterator(as_dict=True):
+            log_p_, log_ps_ = do_nll(batch['features'], K)
+            log_p.append(log_p_)
+            log_ps.append(log_ps_)
+        log_p = np.concatenate(log_p)
+        log_ps = np.concatenate(log_ps)
+
+        r = {
+            'fname': fname,
+            'log_p': np.mean(log_p), 'log_p_se': stats.sem(log_p),
+            'log_ps': np.mean(log_ps), 'log_ps_se': stats.sem(log_ps),
+        }
+        results.append(r)
+
+        rank = sum(other['log_p'] > r['log_p'] for other in results) + 1
+        print("[%d/%d] log p / log p~ [%d spls]:  %5.2f+-%4.2f  /  %5.2f+-%4.2f  (rank %d)  %s" %
+              (i + 1, len(fnames), K, r['log_p'], r['log_p_se'], r['log_ps'], r['log_ps_se'], rank, fname))
+        sys.stdout.flush()
+
+        if output is not None:
+            output.write("%s\t%d\t%f\t%f\t%f\t%f\n" %
+                         (fname, K, r['log_p'], r['log_p_se'], r['log_ps'], r['log_ps_se']))
+            output.flush()
+
+    if output is not None:
+        output.close()
+
+    logger.info("Compiled %d functions for %d checkpoints" % (len(groups), len(results)))
+    print_leaderboard(results, args.top)
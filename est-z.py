@@ -27,6 +27,7 @@ import scipy.misc as misc
 import helmholtz.datasets as datasets
 
 from helmholtz import logsumexp
+from helmholtz.autotune import autotune_batch_size
 from helmholtz.bihm import BiHM
 from helmholtz.gmm import GMM
 from helmholtz.rws import ReweightedWakeSleep
@@ -50,6 +51,8 @@ if __name__ == "__main__":
             default=10, help="no. of samples to draw")
     parser.add_argument("--batch-size", "-bs", type=int, 
             default=10000, help="no. of samples to draw")
+    parser.add_argument("--mem-budget", type=str, default=None,
+            help="Autotune the batch size for this memory budget (e.g. 2G) instead of using --batch-size")
     parser.add_argument("experiment", help="Experiment to load")
     args = parser.parse_args()
 
@@ -101,7 +104,11 @@ if __name__ == "__main__":
     #----------------------------------------------------------------------
     logger.info("Computing Z...")
 
-    batch_size = args.batch_size // args.ninner
+    if args.mem_budget is None:
+        batch_size = args.batch_size // args.ninner
+    else:
+        batch_size = autotune_batch_size(lambda bs: do_z(bs, args.ninner), brick, args.ninner,
+                                         args.mem_budget, "est-z")
 
     n_samples = []
     log_psxp  = []
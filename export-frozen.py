@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""Export a model with batch normalization folded into its Linear layers.
+
+Every BatchNormalizedMLP of the model is replaced by a plain MLP whose
+weights and biases absorb gamma, beta and the population statistics. The
+exported model therefore computes one affine transformation per layer and
+its outputs do not depend on the batch composition.
+"""
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+sys.setrecursionlimit(100000)
+
+import os
+import logging
+
+import numpy as np
+import cPickle as pickle
+
+import theano
+import theano.tensor as tensor
+
+from argparse import ArgumentParser
+
+from blocks.model import Model
+
+from helmholtz.batch_normalization import BatchNormalizedMLP, inference_mode, freeze_batch_normalization
+from helmholtz.checkpoints import load_brick
+
+logger = logging.getLogger("export-frozen.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+
+def bn_mlps(brick):
+    """ All BatchNormalizedMLPs below *brick* together with their parents """
+    found = []
+    for child in brick.children:
+        if isinstance(child, BatchNormalizedMLP):
+            found.append((brick, child))
+        else:
+            found += bn_mlps(child)
+    return found
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Fold batch normalization into the Linear layers of a model")
+    parser.add_argument("--output", "-o", type=str, default=None,
+            help="Output file (default: <experiment>-frozen_model.pkl)")
+    parser.add_argument("experiment", help="Experiment to load")
+    args = parser.parse_args()
+
+    logger.info("Loading model %s..." % args.experiment)
+    brick = load_brick(args.experiment)
+
+    if args.output is None:
+        base, _, _ = args.experiment.rpartition("_model.pkl")
+        args.output = (base or os.path.splitext(args.experiment)[0]) + "-frozen_model.pkl"
+
+    # Reference outputs of all normalized MLPs in inference mode
+    y = tensor.matrix('y')
+    probes = []
+    with inference_mode(brick):
+        for parent, mlp in bn_mlps(brick):
+            do_mlp = theano.function([y], mlp.apply(y), allow_input_downcast=True)
+            probe = np.random.normal(size=(100, mlp.input_dim))
+            probes.append((parent, mlp, probe, do_mlp(probe)))
+
+    n_folded = freeze_batch_normalization(brick)
+    logger.info("Folded %d batch normalized MLPs" % n_folded)
+
+    for parent, old_mlp, probe, expected in probes:
+        new_mlp = [c for c in parent.children if c.name == old_mlp.name][0]
+        do_mlp = theano.function([y], new_mlp.apply(y), allow_input_downcast=True)
+        logger.info("%s/%s: max. abs. difference %g" %
+                    (parent.name, new_mlp.name, np.max(np.abs(do_mlp(probe) - expected))))
+
+    # Save a Model like the checkpoints so all est-*.py scripts can load it
+    x = tensor.matrix('features')
+    log_px, _ = brick.log_likelihood(x, 1)
+
+    with open(args.output, "wb") as f:
+        pickle.dump(Model(log_px), f, protocol=pickle.HIGHEST_PROTOCOL)
+    logger.info("Saved frozen model to %s" % args.output)
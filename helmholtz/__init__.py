@@ -20,25 +20,104 @@ from blocks.initialization import Uniform, IsotropicGaussian, Constant, Sparse,
 from blocks.select import Selector
 from blocks.roles import PARAMETER
 
+from distributions import structured_uniform
 from initialization import RWSInitialization
 from prob_layers import BernoulliTopLayer, BernoulliLayer
+from ops import is_sparse, sparse_replicate_rows, logsumexp_op, logaddexp
 
 logger = logging.getLogger(__name__)
 floatX = theano.config.floatX
 
 
+def _logsumexp_rows(A, axis, normalize):
+    """ Apply ops.LogSumExp along *axis* of A, reshaped to a matrix if A.ndim > 2 """
+    ndim = A.ndim
+    axis = axis % ndim
+    if ndim <= 2:
+        return logsumexp_op(A, axis, normalize)
+
+    # The C implementation handles matrices: move axis last and flatten the rest
+    order = [d for d in xrange(ndim) if d != axis] + [axis]
+    A = A.dimshuffle(order)
+    shape = A.shape
+    lse = logsumexp_op(A.reshape((-1, shape[-1]), ndim=2), 1, normalize)
+    if not normalize:
+        return lse.reshape(shape[:-1], ndim=ndim-1)
+
+    lse, w = lse
+    w = w.reshape(shape, ndim=ndim).dimshuffle(list(numpy.argsort(order)))
+    return lse.reshape(shape[:-1], ndim=ndim-1), w
+
 def logsumexp(A, axis=None):
-    """Numerically stable log( sum( exp(A) ) ) """
-    A_max = tensor.max(A, axis=axis, keepdims=True)
-    B = tensor.log(tensor.sum(tensor.exp(A - A_max),
-                              axis=axis, keepdims=True)) + A_max
-    B = tensor.sum(B, axis=axis)
-    return B
+    """Numerically stable log( sum( exp(A) ) ) (see ops.LogSumExp) """
+    if axis is None:
+        A, axis = A.flatten(), 0
+    return _logsumexp_rows(A, axis, normalize=False)
+
+def logsumexp_weights(A, axis=-1):
+    """logsumexp(A, axis) and the normalized weights exp(A - logsumexp(A, axis)).
+
+    Both come out of the same sweep over A (see ops.LogSumExp).
+    """
+    return _logsumexp_rows(A, axis, normalize=True)
 
 def logplusexp(a, b):
     """ Numerically stable log(exp(a)+exp(b)) """
-    m = tensor.maximum(a, b)
-    return tensor.log(tensor.exp(a-m) + tensor.exp(b-m)) + m
+    return logaddexp(a, b)
+
+def leave_one_out_baseline(log_w):
+    """Per-sample leave-one-out (VIMCO-style) baseline for importance weights.
+
+    For each sample k, its log-weight is replaced by the mean of the other
+    K-1 log-weights and the normalized weight sample k would receive is
+    returned. The baseline for sample k thereby only depends on the other
+    samples drawn for the same example.
+
+    Parameters
+    ----------
+    log_w : T.tensor
+        Unnormalized log importance weights with shape (batch_size, n_samples)
+
+    Returns
+    -------
+    baseline : T.tensor
+        Baselines with shape (batch_size, n_samples)
+    """
+    n_samples = log_w.shape[1]
+    idx = tensor.arange(n_samples)
+    diag = tensor.eq(idx.dimshuffle(0, 'x'), idx.dimshuffle('x', 0))
+
+    log_w_mean = (log_w.sum(axis=1, keepdims=True) - log_w) / tensor.maximum(n_samples - 1, 1)
+    log_w_loo = tensor.switch(diag.dimshuffle('x', 0, 1),
+                              log_w_mean.dimshuffle(0, 1, 'x'),
+                              log_w.dimshuffle(0, 'x', 1))
+    baseline = tensor.exp(log_w_mean - logsumexp(log_w_loo, axis=2))
+    return baseline
+
+
+def weight_statistics(w):
+    """Degeneracy diagnostics for normalized importance weights.
+
+    Parameters
+    ----------
+    w : T.tensor
+        Normalized importance weights with shape (batch_size, n_samples)
+
+    Returns
+    -------
+    ess : T.vector
+        Effective sample size as a fraction of n_samples
+    max_weight : T.vector
+        Largest normalized weight
+    entropy : T.vector
+        Entropy -sum_k w_k log w_k of the weights (log n_samples if uniform)
+    """
+    n_samples = w.shape[1]
+    ess = 1. / (n_samples * tensor.sum(w ** 2, axis=1))
+    max_weight = tensor.max(w, axis=1)
+    entropy = -tensor.sum(tensor.switch(w > 0, w * tensor.log(w), 0.), axis=1)
+    return ess, max_weight, entropy
+
 
 def replicate_batch(A, repeat):
     """Extend the given 2d Tensor by repeating reach line *repeat* times.
@@ -55,11 +134,12 @@ def replicate_batch(A, repeat):
     Returns
     -------
     B : T.tensor
+        Sparse if *A* is sparse.
     """
-    A_ = A.dimshuffle((0, 'x', 1))
-    A_ = A_ + tensor.zeros((A.shape[0], repeat, A.shape[1]), dtype=floatX)
-    A_ = A_.reshape([A_.shape[0] * repeat, A.shape[1]])
-    return A_
+    if is_sparse(A):
+        return sparse_replicate_rows(A, repeat)
+    A = tensor.cast(A, theano.scalar.upcast(A.dtype, floatX))
+    return A.repeat(repeat, axis=0)
 
 
 def flatten_values(vals, size):
@@ -83,13 +163,15 @@ def flatten_values(vals, size):
     flattened_vals : list
         Reshaped version of each *vals* tensor.
     """
-    data_dim = vals[0].ndim - 2
-    assert all([v.ndim == data_dim + 2 for v in vals])
+    # Sparse features can not be reshaped and are always kept flat
+    dense = [v for v in vals if not is_sparse(v)]
+    data_dim = dense[0].ndim - 2
+    assert all([v.ndim == data_dim + 2 for v in dense])
 
     if data_dim == 0:
-        return [v.reshape([size]) for v in vals]
+        return [v if is_sparse(v) else v.reshape([size]) for v in vals]
     elif data_dim == 1:
-        return [v.reshape([size, v.shape[2]]) for v in vals]
+        return [v if is_sparse(v) else v.reshape([size, v.shape[2]]) for v in vals]
     raise
 
 
@@ -110,13 +192,15 @@ def unflatten_values(vals, batch_size, n_samples):
     reshaped_vals : list
         Reshaped version of each *vals* tensor.
     """
-    data_dim = vals[0].ndim - 1
-    assert all([v.ndim == data_dim + 1 for v in vals])
+    # Sparse features can not be reshaped and are always kept flat
+    dense = [v for v in vals if not is_sparse(v)]
+    data_dim = dense[0].ndim - 1
+    assert all([v.ndim == data_dim + 1 for v in dense])
 
     if data_dim == 0:
-        return [v.reshape([batch_size, n_samples]) for v in vals]
+        return [v if is_sparse(v) else v.reshape([batch_size, n_samples]) for v in vals]
     elif data_dim == 1:
-        return [v.reshape([batch_size, n_samples, v.shape[1]]) for v in vals]
+        return [v if is_sparse(v) else v.reshape([batch_size, n_samples, v.shape[1]]) for v in vals]
     raise
 
 
@@ -250,11 +334,33 @@ def create_layers(layer_spec, data_dim, deterministic_layers=0,
 
     return p_layers, q_layers
 
+
+def hidden_input_layers(brick):
+    """All BernoulliLayers of *brick* whose input is a binary hidden layer sample.
+
+    With *brick.scan_layers* the layers of scanned stretches are left out:
+    the scan multiplies with the stacked weights directly. Training and
+    estimation pass n_samples, so a stretch starting at the features loses
+    its bottom connection (see scan_layers.stretch_starts) and a stretch of
+    only two layers is not scanned at all.
+    """
+    from .scan_layers import stretch_starts
+
+    scanned = set()
+    if brick.scan_layers:
+        for start, stop in stretch_starts(brick, n_samples=True).items():
+            scanned.update(brick.p_layers[start:stop] + brick.q_layers[start:stop])
+
+    return [layer for layer in brick.p_layers[:-1] + brick.q_layers[1:]
+            if isinstance(layer, BernoulliLayer) and layer not in scanned]
+
 #-----------------------------------------------------------------------------
 
 
 class HelmholtzMachine(Initializable, Random):
     """ Base class for various Helmholtz machines """
+    sampling = 'iid'
+    scan_layers = False
 
     def __init__(self, p_layers, q_layers, **kwargs):
         super(HelmholtzMachine, self).__init__(**kwargs)
@@ -264,6 +370,16 @@ class HelmholtzMachine(Initializable, Random):
 
         self.children = p_layers + q_layers
 
+    def proposal_noise(self, batch_size, n_samples):
+        """Uniform noise for the q-layers according to self.sampling.
+
+        Returns None for i.i.d. sampling (the layers draw their own noise).
+        """
+        if self.sampling == 'iid':
+            return None
+        return [structured_uniform(batch_size, n_samples, layer.dim_X, self.sampling, rng=self.theano_rng)
+                for layer in self.q_layers]
+
 #-----------------------------------------------------------------------------
 
 
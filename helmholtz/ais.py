@@ -0,0 +1,218 @@
+
+from __future__ import division, print_function
+
+import logging
+
+import numpy
+import theano
+
+from theano import tensor
+
+from . import logplusexp
+
+logger = logging.getLogger(__name__)
+floatX = theano.config.floatX
+
+#-----------------------------------------------------------------------------
+# Annealed importance sampling (AIS)
+#
+# All chains are updated with Metropolis-Hastings transitions in even/odd
+# sweeps over the layers (the layers of one parity are conditionally
+# independent given the others). A new state for layer l is proposed from
+# the mixture 1/2 p(h_l | h_{l+1}) + 1/2 q(h_l | h_{l-1}), which does not
+# depend on the current h_l.
+#
+# Every annealed density is a product of per-layer factors
+#
+#   log f_beta = sum_l cp * log p(h_l | h_{l+1}) + cq * log q(h_l | h_{l-1})
+#
+# with coefficients (cp, cq) that depend on beta and on the chain.
+
+
+def sigmoid_schedule(n_steps, rad=4.):
+    """ Inverse temperatures 0 = beta_0 < ... < beta_n_steps = 1 with more steps near 0 and 1 """
+    t = numpy.linspace(-rad, rad, n_steps + 1)
+    s = 1. / (1. + numpy.exp(-t))
+    return (s - s[0]) / (s[-1] - s[0])
+
+
+def linear_schedule(n_steps):
+    return numpy.linspace(0., 1., n_steps + 1)
+
+
+def run_ais(do_step, states, betas):
+    """Run a compiled AIS step function along the schedule *betas*.
+
+    *do_step(beta_prev, beta, *states)* must return the new states followed
+    by the log-weight increments.
+
+    Returns
+    -------
+    log_w : ndarray
+        Final AIS log-weights of all chains
+    states : list
+    """
+    log_w = 0.
+    for beta_prev, beta in zip(betas[:-1], betas[1:]):
+        ret = do_step(beta_prev, beta, *states)
+        states, log_w = ret[:-1], log_w + ret[-1]
+    return log_w, states
+
+#-----------------------------------------------------------------------------
+
+
+def _bottom_kwargs(l, n_chains, per_example):
+    """ Arguments for a layer touching h[0] when h[0] has one row per example (see mh_layer) """
+    if l != 1 or n_chains is None:
+        return {}
+    if per_example == 'X':
+        return {'n_samples': n_chains, 'per_example': 'X'}
+    return {'n_samples': n_chains}
+
+
+def _local_log_f(brick, h, l, cp, cq, n_chains=None):
+    """ All factors of log f involving hidden layer l (l >= 1) """
+    p_layers = brick.p_layers
+    q_layers = brick.q_layers
+    top = len(p_layers) - 1
+
+    log_f = cp * p_layers[l - 1].log_prob(h[l - 1], h[l], **_bottom_kwargs(l, n_chains, 'X')) \
+        + cq * q_layers[l - 1].log_prob(h[l], h[l - 1], **_bottom_kwargs(l, n_chains, 'Y'))
+    if l < top:
+        log_f += cp * p_layers[l].log_prob(h[l], h[l + 1]) + cq * q_layers[l].log_prob(h[l + 1], h[l])
+    else:
+        log_f += cp * p_layers[top].log_prob(h[top])
+    return log_f
+
+
+def _accept(brick, h_old, h_new, log_a):
+    u = brick.theano_rng.uniform(size=(h_old.shape[0],))
+    accept = tensor.log(u) < log_a
+    return tensor.switch(accept.dimshuffle(0, 'x'), h_new, h_old)
+
+
+def _choose(brick, h_a, h_b):
+    """ Pick every row from h_a or h_b with probability 1/2 """
+    coin = brick.theano_rng.uniform(size=(h_a.shape[0],)) < 0.5
+    return tensor.switch(coin.dimshuffle(0, 'x'), h_a, h_b)
+
+
+def mh_layer(brick, h, l, cp, cq, n_chains=None):
+    """Metropolis-Hastings update of hidden layer l (l >= 1); returns the new h[l]
+
+    With *n_chains*, h[0] holds one row per example (the features shared by
+    its n_chains chains); it is broadcast instead of replicated.
+    """
+    p_layers = brick.p_layers
+    q_layers = brick.q_layers
+    top = len(p_layers) - 1
+
+    q_kwargs = _bottom_kwargs(l, n_chains, 'Y')
+    h_q, _ = q_layers[l - 1].sample(h[l - 1], **q_kwargs)
+    log_g_q = lambda y: q_layers[l - 1].log_prob(y, h[l - 1], **q_kwargs)
+    if l < top:
+        h_p, _ = p_layers[l].sample(h[l + 1])
+        log_g = lambda y: logplusexp(p_layers[l].log_prob(y, h[l + 1]), log_g_q(y))
+    else:
+        h_p, _ = p_layers[top].sample(h[l].shape[0])
+        log_g = lambda y: logplusexp(p_layers[top].log_prob(y), log_g_q(y))
+    h_new = _choose(brick, h_p, h_q)
+
+    h_prop = list(h)
+    h_prop[l] = h_new
+
+    log_a = _local_log_f(brick, h_prop, l, cp, cq, n_chains) - _local_log_f(brick, h, l, cp, cq, n_chains) \
+        + log_g(h[l]) - log_g(h_new)
+    return _accept(brick, h[l], h_new, log_a)
+
+
+def mh_data(brick, chains, coeffs):
+    """ Metropolis-Hastings update of the visible layer shared by several chains """
+    p0, q0 = brick.p_layers[0], brick.q_layers[0]
+    x = chains[0][0]
+
+    def log_f(x):
+        return sum(cp * p0.log_prob(x, h[1]) + cq * q0.log_prob(h[1], x)
+                   for h, (cp, cq) in zip(chains, coeffs))
+
+    def log_g(x):
+        return logplusexp(p0.log_prob(x, chains[0][1]), p0.log_prob(x, chains[1][1]))
+
+    x_new = _choose(brick, p0.sample(chains[0][1])[0], p0.sample(chains[1][1])[0])
+
+    log_a = log_f(x_new) - log_f(x) + log_g(x) - log_g(x_new)
+    return _accept(brick, x, x_new, log_a)
+
+#-----------------------------------------------------------------------------
+# log p(x): anneal from q(h | x) to p(x, h)
+
+
+def ais_nll_init(brick, features, n_chains):
+    """Initial states (q-samples) for *n_chains* chains per example.
+
+    samples[0] are the features with one row per example; pass *n_chains*
+    to ais_nll_step as well.
+    """
+    samples, _, _ = brick.sample_q(features, n_samples=n_chains)
+    return samples
+
+
+def ais_nll_step(brick, h, beta_prev, beta, n_chains=None):
+    """One AIS step for log f_beta = beta * log p(x, h) + (1 - beta) * log q(h | x).
+
+    Returns the new states and the log-weight increments
+    (beta - beta_prev) * (log p(x, h) - log q(h | x)) evaluated at the old states.
+    With *n_chains*, h[0] has one row per example (see ais_nll_init).
+    """
+    n_layers = len(brick.p_layers)
+
+    log_w = (beta - beta_prev) * (sum(brick.log_prob_p(h, n_chains)) - sum(brick.log_prob_q(h, n_chains)))
+
+    h = list(h)
+    for first in (1, 2):
+        layers = range(first, n_layers, 2)
+        updates = [mh_layer(brick, h, l, beta, 1. - beta, n_chains) for l in layers]
+        for l, h_l in zip(layers, updates):
+            h[l] = h_l
+    return h, log_w
+
+#-----------------------------------------------------------------------------
+# BiHM 2 log Z: anneal from p(x, h) q(h' | x) to sqrt(p(x, h) q(h | x) p(x, h') q(h' | x))
+
+
+def ais_z_init(brick, n_chains):
+    """ Initial states h ~ p(x, h) and h' ~ q(h' | x) (both with h[0] = h'[0] = x) """
+    h, _, _ = brick.sample_p(n_chains)
+    h2, _, _ = brick.sample_q(h[0])
+    return h, h2
+
+
+def ais_z_step(brick, h, h2, beta_prev, beta):
+    """One AIS step for the BiHM normalizer.
+
+    log f_beta = (1 - beta/2) log p(x, h)  + beta/2 log q(h | x)
+               + beta/2 log p(x, h')       + (1 - beta/2) log q(h' | x)
+
+    At beta=0 this is the normalized p(x, h) q(h' | x); at beta=1 it sums
+    to z^2 = sum_x p~(x).
+    """
+    n_layers = len(brick.p_layers)
+
+    log_p, log_q = sum(brick.log_prob_p(h)), sum(brick.log_prob_q(h))
+    log_p2, log_q2 = sum(brick.log_prob_p(h2)), sum(brick.log_prob_q(h2))
+    log_w = (beta - beta_prev) / 2 * (log_q - log_p + log_p2 - log_q2)
+
+    chains = [list(h), list(h2)]
+    coeffs = [(1. - beta / 2, beta / 2), (beta / 2, 1. - beta / 2)]
+    for first in (1, 2):
+        layers = range(first, n_layers, 2)
+        updates = [[mh_layer(brick, c, l, cp, cq) for l in layers]
+                   for c, (cp, cq) in zip(chains, coeffs)]
+        if first == 2:
+            x = mh_data(brick, chains, coeffs)
+        for c, c_updates in zip(chains, updates):
+            for l, h_l in zip(layers, c_updates):
+                c[l] = h_l
+        if first == 2:
+            chains[0][0] = chains[1][0] = x
+    return chains[0], chains[1], log_w
@@ -0,0 +1,201 @@
+
+from __future__ import division, print_function
+
+import os
+import re
+import json
+import time
+import socket
+import logging
+import platform
+
+import numpy
+import theano
+
+from blocks.select import Selector
+
+from . import datasets
+
+logger = logging.getLogger(__name__)
+floatX = theano.config.floatX
+
+#-----------------------------------------------------------------------------
+# Memory-budget-aware batch size selection
+#
+# The peak memory of a compiled sampling or training function is dominated
+# by the (batch_size * n_samples, width) activations of every layer. We
+# predict it from the parameter shapes of the model, probe the largest few
+# batch sizes that fit into the budget and keep the one with the highest
+# throughput. The result is cached per host, device and architecture.
+
+default_cache_file = os.path.join(os.path.expanduser("~"), ".cache", "helmholtz", "autotune.json")
+
+# Live (rows, width) tensors per layer and row: samples, pre-activations,
+# probabilities and log-probabilities; training keeps the forward pass
+# alive for the backward pass and adds the gradients.
+activation_factor = {False: 4, True: 8}
+
+# Copies of the parameters: the parameters themselves, or parameters,
+# gradients and two step rule accumulators (Adam).
+parameter_factor = {False: 1, True: 4}
+
+
+def parse_memory(value):
+    """ Parse a memory size like "512M", "2G" or "1.5GB" into bytes """
+    m = re.match(r"^\s*([0-9.]+)\s*([kKmMgGtT]?)[bB]?\s*$", str(value))
+    if m is None:
+        raise ValueError("Can not parse memory size '%s'" % value)
+    number, unit = m.groups()
+    return int(float(number) * 1024 ** " KMGT".index(unit.upper() or " "))
+
+
+def model_shapes(brick):
+    """Parameter shapes of *brick* and all its children.
+
+    Returns
+    -------
+    widths : list of int
+        Output width of every weight matrix (of every bias if there are none).
+    n_parameters : int
+        Total number of parameters.
+    """
+    parameters = Selector(brick).get_parameters().values()
+
+    shapes = [p.get_value(borrow=True).shape for p in parameters]
+    widths = [s[1] for s in shapes if len(s) == 2]
+    if not widths:
+        widths = [s[0] for s in shapes if len(s) == 1]
+    n_parameters = sum(int(numpy.prod(s)) for s in shapes)
+    return widths, n_parameters
+
+
+def predict_memory(widths, n_parameters, batch_size, n_samples, training=False, row_width=0):
+    """Predicted peak memory in bytes for *batch_size* examples with *n_samples* samples each
+
+    *row_width* counts additional live values per row that do not show up in
+    the parameter shapes, e.g. the (rows, 2**top_dim) matrices of a
+    Rao-Blackwellized top layer.
+    """
+    itemsize = numpy.dtype(floatX).itemsize
+    rows = batch_size * n_samples
+    activations = activation_factor[training] * rows * sum(widths) + rows * row_width
+    return itemsize * (activations + parameter_factor[training] * n_parameters)
+
+
+def cache_key(tag, widths, n_samples, mem_budget, training, row_width=0):
+    """ Key identifying host, device, architecture and problem size """
+    return "|".join([
+        socket.gethostname(), platform.machine(), theano.config.device, floatX,
+        tag, "train" if training else "eval",
+        "-".join(str(w) for w in widths), "K%d" % n_samples, "M%d" % mem_budget, "R%d" % row_width])
+
+
+def load_cache(cache_file):
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning("Ignoring corrupt autotune cache %s" % cache_file)
+        return {}
+
+
+def save_cache(cache_file, cache):
+    dirname = os.path.dirname(cache_file)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(cache_file, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def probe_features(data_name, n_examples=1024, sparse=False):
+    """ The first *n_examples* test set examples, preprocessed like the streams """
+    _, _, _, stream = datasets.get_streams(data_name, n_examples, sparse=sparse)
+    return next(stream.get_epoch_iterator(as_dict=True))['features']
+
+
+def time_call(run, batch_size, n_repeat=2):
+    """ Best wall clock time of *n_repeat* calls to run(batch_size) after one warm-up call """
+    run(batch_size)
+    best = numpy.inf
+    for _ in xrange(n_repeat):
+        t0 = time.time()
+        run(batch_size)
+        best = min(best, time.time() - t0)
+    return best
+
+
+def autotune_batch_size(run, brick, n_samples, mem_budget, tag, max_batch=None,
+                        training=False, row_width=0, n_probes=4, cache_file=default_cache_file):
+    """Choose the fastest batch size whose predicted memory fits into *mem_budget*.
+
+    Parameters
+    ----------
+    run : callable
+        run(batch_size) performs one call of the compiled function on
+        *batch_size* examples with *n_samples* samples each.
+    brick : Brick
+        Model; its parameter shapes determine the predicted memory.
+    n_samples : int
+        Samples (rows) per example.
+    mem_budget : int or str
+        Memory budget in bytes (or as accepted by `parse_memory`).
+    tag : str
+        Name of the probed function; part of the cache key.
+    max_batch : int
+        Largest batch size to consider (e.g. the size of the probe data).
+    training : bool
+        Predict the memory of a training step instead of a forward pass.
+    row_width : int
+        Additional live values per row (see `predict_memory`).
+    n_probes : int
+        Number of candidate batch sizes to time.
+    cache_file : str or None
+        JSON file caching previous choices; None disables caching.
+
+    Returns
+    -------
+    batch_size : int
+    """
+    mem_budget = parse_memory(mem_budget)
+    widths, n_parameters = model_shapes(brick)
+
+    key = cache_key(tag, widths, n_samples, mem_budget, training, row_width)
+    cache = load_cache(cache_file) if cache_file else {}
+    if key in cache and (max_batch is None or cache[key] <= max_batch):
+        logger.info("Using cached batch size %d for %s" % (cache[key], tag))
+        return cache[key]
+
+    def fits(batch_size):
+        return predict_memory(widths, n_parameters, batch_size, n_samples, training, row_width) <= mem_budget
+
+    if not fits(1):
+        logger.warning("A single example with %d samples is predicted to exceed the memory budget" % n_samples)
+        return 1
+
+    # Powers of two up to the largest batch size that fits
+    candidates = [1]
+    while fits(2 * candidates[-1]) and (max_batch is None or 2 * candidates[-1] <= max_batch):
+        candidates.append(2 * candidates[-1])
+    candidates = candidates[-n_probes:]
+
+    best_batch_size, best_throughput = candidates[0], 0.
+    for batch_size in reversed(candidates):
+        try:
+            t = time_call(run, batch_size)
+        except (MemoryError, RuntimeError) as e:
+            logger.info("Batch size %d failed: %s" % (batch_size, e))
+            continue
+        throughput = batch_size / max(t, 1e-9)
+        logger.info("Batch size %5d: %8.1f examples/s (%5.1f MB predicted)" %
+                    (batch_size, throughput,
+                     predict_memory(widths, n_parameters, batch_size, n_samples, training, row_width) / 2 ** 20))
+        if throughput > best_throughput:
+            best_batch_size, best_throughput = batch_size, throughput
+
+    logger.info("Chose batch size %d for %s" % (best_batch_size, tag))
+    if cache_file:
+        cache[key] = best_batch_size
+        save_cache(cache_file, cache)
+    return best_batch_size
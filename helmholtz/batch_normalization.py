@@ -2,17 +2,20 @@
 from __future__ import division, print_function 
 
 import logging
+import numpy
 
 from collections import OrderedDict
+from contextlib import contextmanager
 from picklable_itertools.extras import equizip
 from theano import tensor
+from theano.gof.graph import ancestors
 from toolz import interleave
 
-from blocks.bricks import Brick, Feedforward, Random, Initializable, Sequence, Linear
+from blocks.bricks import Brick, Feedforward, Random, Initializable, Sequence, Linear, MLP
 from blocks.bricks.base import application, lazy
-from blocks.initialization import IsotropicGaussian
+from blocks.initialization import IsotropicGaussian, Constant
 from blocks.roles import add_role, PARAMETER
-from blocks.utils import pack, shared_floatx_zeros
+from blocks.utils import pack, shared_floatx, shared_floatx_zeros
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +23,24 @@ logger = logging.getLogger(__name__)
 class BatchNormalization(Initializable, Random):
     """A batch normalization layer.
 
+    During training the inputs are normalized with the statistics of the
+    current minibatch. Running averages of these statistics are kept in
+    *population_mean* and *population_var* (see `population_updates`);
+    with *use_population* set (see `inference_mode`) they are used instead,
+    so the output of every row no longer depends on the rest of the batch.
+
     Parameters
     ----------
     dim : int
         Number of units to be batch normalized.
     """
+    # Defaults for models pickled before population statistics were tracked
+    use_population = False
+    population_mean = None
+    population_var = None
+
+    eps = 1e-5
+
     @lazy(allocation=['dim'])
     def __init__(self, dim, beta_init, gamma_init, **kwargs):
         """
@@ -35,6 +51,11 @@ class BatchNormalization(Initializable, Random):
         self.beta_init = beta_init
         self.gamma_init = gamma_init
 
+    def _allocate(self):
+        # Not parameters: updated by population_updates, not by the step rule
+        self.population_mean = shared_floatx_zeros((self.dim,), name='population_mean')
+        self.population_var = shared_floatx(numpy.ones((self.dim,)), name='population_var')
+
     def _initialize(self):
         self.beta  = shared_floatx_zeros( (self.dim,), name='beta')
         self.gamma = shared_floatx_zeros( (self.dim,), name='gamma')
@@ -47,16 +68,105 @@ class BatchNormalization(Initializable, Random):
         self.beta_init.initialize(self.beta, self.rng)
         self.gamma_init.initialize(self.gamma, self.rng)
 
+        # Reset in place: compiled graphs keep referring to the same variables
+        self.population_mean.set_value(numpy.zeros_like(self.population_mean.get_value()))
+        self.population_var.set_value(numpy.ones_like(self.population_var.get_value()))
+
     @application(inputs=['x'], outputs=['x_hat'])
     def apply(self, x):
-        eps = 1e-5
+        eps = self.eps
+
+        if self.use_population:
+            if self.population_mean is None:
+                raise ValueError("%s has no population statistics (model trained without them)" % self.name)
+            mu = self.population_mean
+            var = self.population_var
+        else:
+            mu = tensor.mean(x, axis=0)                  # shape: dim
+            var = tensor.mean( (x-mu)**2, axis=0)        # shape: dim
 
-        mu = tensor.mean(x, axis=0)                  # shape: dim
-        var = tensor.mean( (x-mu)**2, axis=0)        # shape: dim
+            # Found by population_updates
+            mu.tag.batch_normalization = (self, 'mean')
+            var.tag.batch_normalization = (self, 'var')
 
         x_hat = (x - mu) / tensor.sqrt(var + eps)
         return self.gamma*x_hat + self.beta
 
+
+def batch_normalizations(brick):
+    """ All BatchNormalization bricks in *brick* and its children (depth first) """
+    if isinstance(brick, BatchNormalization):
+        return [brick]
+    return [bn for child in brick.children for bn in batch_normalizations(child)]
+
+
+def add_population_statistics(brick):
+    """Create the missing population statistics of models pickled without them.
+
+    The statistics start at mean 0 and variance 1 and only become
+    meaningful after some training steps with `population_updates`.
+
+    Returns
+    -------
+    bns : list
+        The BatchNormalization bricks that had no statistics.
+    """
+    bns = [bn for bn in batch_normalizations(brick) if bn.population_mean is None]
+    for bn in bns:
+        bn._allocate()
+    return bns
+
+
+def population_updates(outputs, decay=0.99):
+    """Exponential moving average updates of the population statistics.
+
+    Finds the minibatch mean and variance of every BatchNormalization
+    brick in the graph of *outputs* (the first application if a brick is
+    applied several times) and returns the updates
+
+        population <- decay * population + (1 - decay) * batch statistic
+
+    e.g. for GradientDescent.add_updates. Bricks without population
+    statistics (see `add_population_statistics`) are skipped.
+    """
+    stats = OrderedDict()
+    for var in ancestors(outputs):
+        tag = getattr(var.tag, 'batch_normalization', None)
+        if tag is None or tag[0].population_mean is None:
+            continue
+        if tag not in stats:
+            stats[tag] = var
+
+    updates = []
+    for (bn, which), var in stats.items():
+        population = bn.population_mean if which == 'mean' else bn.population_var
+        updates.append((population, decay * population + (1. - decay) * var))
+    return updates
+
+
+@contextmanager
+def inference_mode(brick):
+    """Build graphs that normalize with the population statistics.
+
+    All BatchNormalization bricks below *brick* use their population mean
+    and variance for graphs constructed within the context, e.g.
+
+        with inference_mode(model):
+            log_px, _ = model.log_likelihood(x, n_samples)
+
+    Bricks without population statistics keep normalizing with the
+    minibatch statistics.
+    """
+    bns = [bn for bn in batch_normalizations(brick) if bn.population_mean is not None]
+    previous = [bn.use_population for bn in bns]
+    for bn in bns:
+        bn.use_population = True
+    try:
+        yield
+    finally:
+        for bn, use_population in zip(bns, previous):
+            bn.use_population = use_population
+
         
 class BatchNormalizedMLP(Sequence, Initializable, Feedforward):
     """A simple multi-layer perceptron.
@@ -140,3 +250,64 @@ class BatchNormalizedMLP(Sequence, Initializable, Feedforward):
                 equizip(self.dims[1:],
                         self.batch_normnalizations):
             bn.dim = output_dim
+
+#-----------------------------------------------------------------------------
+# Freezing for inference
+
+
+def fold_batch_normalization(mlp):
+    """Fold the population statistics of a BatchNormalizedMLP into its Linear layers.
+
+    With s = gamma / sqrt(population_var + eps) every
+
+        gamma * (x W + b - population_mean) / sqrt(population_var + eps) + beta
+
+    becomes the single affine transformation x (W s) + (b - population_mean) s + beta.
+
+    Returns
+    -------
+    mlp : MLP
+        A plain, initialized MLP with the same activations whose outputs
+        equal those of *mlp* in inference mode.
+    """
+    # Fresh activation bricks: a brick can not be the child of two MLPs
+    activations = [None if act is None else act.__class__(name=act.name) for act in mlp.activations]
+
+    folded = MLP(activations, list(mlp.dims), name=mlp.name,
+                 weights_init=Constant(0.), biases_init=Constant(0.))
+    folded.initialize()
+
+    for linear, bn, new_linear in zip(mlp.linear_transformations, mlp.batch_normnalizations,
+                                      folded.linear_transformations):
+        if bn.population_mean is None:
+            raise ValueError("%s has no population statistics (model trained without them)" % bn.name)
+
+        W = linear.W.get_value()
+        b = linear.b.get_value() if linear.use_bias else numpy.zeros(W.shape[1], dtype=W.dtype)
+
+        scale = bn.gamma.get_value() / numpy.sqrt(bn.population_var.get_value() + bn.eps)
+        new_linear.W.set_value((W * scale).astype(W.dtype))
+        new_linear.b.set_value(((b - bn.population_mean.get_value()) * scale + bn.beta.get_value()).astype(W.dtype))
+    return folded
+
+
+def freeze_batch_normalization(brick):
+    """Replace every BatchNormalizedMLP below *brick* with its folded MLP (in place).
+
+    Returns
+    -------
+    n_folded : int
+        Number of replaced MLPs.
+    """
+    n_folded = 0
+    for i, child in enumerate(list(brick.children)):
+        if isinstance(child, BatchNormalizedMLP):
+            folded = fold_batch_normalization(child)
+            for name, value in vars(brick).items():
+                if value is child:
+                    setattr(brick, name, folded)
+            brick.children[i] = folded
+            n_folded += 1
+        else:
+            n_folded += freeze_batch_normalization(child)
+    return n_folded
@@ -0,0 +1,114 @@
+
+from __future__ import division, print_function
+
+import logging
+
+import cPickle as pickle
+
+from blocks.main_loop import MainLoop
+from blocks.select import Selector
+
+from .batch_normalization import BatchNormalization, batch_normalizations
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------
+
+
+def load_brick(fname):
+    """ Unpickle a model or main loop and return its top-level brick """
+    with open(fname, "rb") as f:
+        m = pickle.load(f)
+
+    if isinstance(m, MainLoop):
+        m = m.model
+
+    brick = m.get_top_bricks()[0]
+    while len(brick.parents) > 0:
+        brick = brick.parents[0]
+    return brick
+
+
+# Settings of bricks that change the graph built from the same parameters
+GRAPH_ATTRIBUTES = ('sampling', 'psis', 'scan_layers', 'qbaseline', 'loo_baseline',
+                    'dedup', 'binary_input', 'use_bias', 'fixed_sigma', 'sigma', 'eps')
+
+
+def brick_settings(brick):
+    """ (class name, graph settings) of *brick* and all its children, depth first """
+    settings = []
+    for name in GRAPH_ATTRIBUTES:
+        value = getattr(brick, name, None)
+        if isinstance(value, (bool, int, long, float, str)):
+            settings.append((name, value))
+    if isinstance(brick, BatchNormalization):
+        settings.append(('population', brick.population_mean is not None))
+
+    return ((brick.__class__.__name__, tuple(settings)),) + tuple(
+        s for child in brick.children for s in brick_settings(child))
+
+
+def architecture_key(brick):
+    """Hashable description of the architecture of *brick*.
+
+    Two bricks with the same key have the same classes and graph settings
+    (activations, sampling mode, per-layer flags, ...) throughout their
+    hierarchy and the same parameter names and shapes, so a function
+    compiled for one of them can evaluate the other after `copy_parameters`.
+    """
+    parameters = Selector(brick).get_parameters()
+    return brick_settings(brick) + tuple(
+        (name, p.get_value(borrow=True).shape) for name, p in sorted(parameters.items()))
+
+
+def copy_parameters(target, source):
+    """ Assign the parameter values (and population statistics) of *source* to the shared variables of *target* """
+    target_params = Selector(target).get_parameters()
+    source_params = Selector(source).get_parameters()
+    if set(target_params) != set(source_params):
+        raise ValueError("Bricks have different parameters")
+
+    for target_bn, source_bn in zip(batch_normalizations(target), batch_normalizations(source)):
+        if (source_bn.population_mean is None) != (target_bn.population_mean is None):
+            raise ValueError("Only one of %s and %s has population statistics" % (target_bn.name, source_bn.name))
+
+    for name, p in target_params.items():
+        p.set_value(source_params[name].get_value(borrow=True))
+
+    for target_bn, source_bn in zip(batch_normalizations(target), batch_normalizations(source)):
+        if source_bn.population_mean is not None:
+            target_bn.population_mean.set_value(source_bn.population_mean.get_value())
+            target_bn.population_var.set_value(source_bn.population_var.get_value())
+
+
+class CompiledGroups(object):
+    """One compiled function per architecture.
+
+    The first brick of every architecture is compiled with *compile_fn*;
+    for all later bricks with the same architecture their parameters are
+    copied into the shared variables of that first brick and the existing
+    function is reused.
+
+    Parameters
+    ----------
+    compile_fn : callable
+        compile_fn(brick) returns a compiled function evaluating *brick*.
+    """
+    def __init__(self, compile_fn):
+        self.compile_fn = compile_fn
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def get(self, brick):
+        """ Return the compiled function, loaded with the parameters of *brick* """
+        key = architecture_key(brick)
+        if key not in self.groups:
+            logger.info("Compiling for new architecture (%s, group %d)" %
+                        (brick.__class__.__name__, len(self.groups)))
+            self.groups[key] = (brick, self.compile_fn(brick))
+        else:
+            target, _ = self.groups[key]
+            copy_parameters(target, brick)
+        return self.groups[key][1]
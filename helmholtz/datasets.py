@@ -1,17 +1,34 @@
 
 from __future__ import division
 
+import os
+import logging
+
 import numpy as np
+import scipy.sparse
+
+from collections import OrderedDict
 
+from fuel import config
+from fuel.datasets import IndexableDataset
 from fuel.schemes import ShuffledScheme, SequentialScheme
 from fuel.streams import DataStream
 from fuel.transformers import Flatten, SourcewiseTransformer
 
+logger = logging.getLogger(__name__)
+
 local_datasets = ["adult", "dna", "web", "nips", "mushrooms", "ocr_letters", "connect4", "rcv1"]
 supported_datasets = local_datasets + ['mnist', 'smnist', 'bmnist', 'bars', 'silhouettes']
 
+# Bag-of-words corpora that are mostly zeros (see get_streams(..., sparse=True))
+sparse_datasets = ["rcv1", "web", "nips"]
+
 # 'tfd' is missing but needs normalization
 
+# Directory for datasets exported to POSIX shared memory by serve-data.py
+shm_dir = os.environ.get("HELMHOLTZ_SHM_DIR", "/dev/shm")
+shm_sets = ['train', 'valid', 'test']
+
 
 class MapFeatures(SourcewiseTransformer):
 
@@ -29,6 +46,74 @@ class MapFeatures(SourcewiseTransformer):
         return self.fn(source_batch)
 
 
+class ToSparse(SourcewiseTransformer):
+    """ Convert flat feature batches into scipy.sparse CSR matrices """
+
+    def __init__(self, data_stream, **kwargs):
+        super(ToSparse, self).__init__(data_stream,
+                                       produces_examples=False, which_sources='features')
+
+    def transform_source_batch(self, source_batch, source_name):
+        return scipy.sparse.csr_matrix(np.asarray(source_batch, dtype=config.floatX))
+
+
+class SharedMemoryDataset(IndexableDataset):
+    """Read-only memory mapped view of a dataset split in shared memory.
+
+    Drop-in replacement for the fuel datasets returned by `get_data`; the
+    features are mapped from the file written by `export_shared_data` and
+    are therefore shared between all processes on the same host.
+    """
+    def __init__(self, data_name, which_set, **kwargs):
+        self.data_name = data_name
+        self.which_set = which_set
+
+        features = np.load(shared_fname(data_name, which_set), mmap_mode='r')
+        super(SharedMemoryDataset, self).__init__(
+            OrderedDict([('features', features)]), **kwargs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['indexables'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        features = np.load(shared_fname(self.data_name, self.which_set), mmap_mode='r')
+        self.indexables = [features[self.start:self.stop]]
+
+
+def shared_fname(data_name, which_set):
+    return os.path.join(shm_dir, "helmholtz-%s-%s.npy" % (data_name, which_set))
+
+
+def has_shared_data(data_name):
+    return all(os.path.exists(shared_fname(data_name, which_set)) for which_set in shm_sets)
+
+
+def export_shared_data(data_name):
+    """Load *data_name* once and write each split into shared memory.
+
+    Returns
+    -------
+    fnames : list
+        Names of the files created in the shared memory directory.
+    """
+    x_dim, data_train, data_valid, data_test = get_data(data_name, shared=False)
+
+    fnames = []
+    for which_set, data in zip(shm_sets, (data_train, data_valid, data_test)):
+        features = data.get_data(None, slice(0, data.num_examples))[0]
+
+        fname = shared_fname(data_name, which_set)
+        with open(fname + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(features))
+        os.rename(fname + ".tmp", fname)
+        fnames.append(fname)
+
+    return fnames
+
+
 def map_mnist(batch):
     return np.cast[np.float32](batch / 255. > 0.5)
 
@@ -41,7 +126,14 @@ def map_tfd(batch):
     return np.cast[np.float32](batch / 255.)
 
 
-def get_streams(data_name, batch_size, small_batch_size=None):
+def get_streams(data_name, batch_size, small_batch_size=None, sparse=False, shuffle=True):
+    """Shuffled train, valid and test streams of flat feature batches.
+
+    With *sparse=True* the feature batches are scipy.sparse CSR matrices;
+    models have to be fed through a theano.sparse.csr_matrix input then.
+    With *shuffle=False* the examples come in dataset order.
+    """
+    scheme = ShuffledScheme if shuffle else SequentialScheme
     if small_batch_size is None:
         small_batch_size = max(1, batch_size // 10)
 
@@ -61,7 +153,7 @@ def get_streams(data_name, batch_size, small_batch_size=None):
             MapFeatures(
                 DataStream(
                     data,
-                    iteration_scheme=ShuffledScheme(
+                    iteration_scheme=scheme(
                         data.num_examples, batch_size)
                 ),
                 fn=map_fn),
@@ -71,10 +163,32 @@ def get_streams(data_name, batch_size, small_batch_size=None):
                                  (data_test, small_batch_size))
     )
 
+    if sparse:
+        train_stream, valid_stream, test_stream = (
+            ToSparse(stream) for stream in (train_stream, valid_stream, test_stream))
+
     return x_dim, train_stream, valid_stream, test_stream
 
 
-def get_data(data_name):
+def get_data(data_name, shared=None):
+    """Load the train, valid and test splits of *data_name*.
+
+    If *shared* is None, the splits are mapped from shared memory when they
+    have been exported there by serve-data.py; *shared=True* requires and
+    *shared=False* ignores the shared memory copies.
+    """
+    if shared is None:
+        shared = has_shared_data(data_name)
+
+    if shared:
+        logger.info("Mapping dataset %s from shared memory" % data_name)
+
+        data_train, data_valid, data_test = (
+            SharedMemoryDataset(data_name, which_set, sources=['features'])
+            for which_set in shm_sets)
+        x_dim = int(np.prod(data_train.indexables[0].shape[1:]))
+        return x_dim, data_train, data_valid, data_test
+
     if data_name == 'bmnist':
         from fuel.datasets.binarized_mnist import BinarizedMNIST
 
@@ -34,7 +34,7 @@ class BernoulliOp(theano.Op):
     def __init__(self):
         super(BernoulliOp, self).__init__()
 
-    def make_node(self, prob, rng=None, nstreams=None):
+    def make_node(self, prob, rng=None, nstreams=None, noise=None):
         assert hasattr(self, '_props')
 
         if rng is None:
@@ -43,7 +43,10 @@ class BernoulliOp(theano.Op):
             nstreams = N_STREAMS
 
         prob = theano.tensor.as_tensor_variable(prob)
-        noise = rng.uniform(size=prob.shape, nstreams=nstreams)
+        if noise is None:
+            noise = rng.uniform(size=prob.shape, nstreams=nstreams)
+        else:
+            noise = theano.tensor.as_tensor_variable(noise)
 
         return theano.Apply(self, [prob, noise], [prob.type()])
 
@@ -70,6 +73,95 @@ class BernoulliOp(theano.Op):
 
 bernoulli = BernoulliOp()
 
+#-----------------------------------------------------------------------------
+# Structured uniform noise
+
+sampling_modes = ['iid', 'antithetic', 'stratified']
+
+
+def structured_uniform(batch_size, n_samples, dim, mode='iid', rng=None, nstreams=None):
+    """Uniform noise for *n_samples* correlated samples per example.
+
+    Returns a (batch_size * n_samples, dim) matrix with the rows ordered
+    like replicate_batch(). Every row is marginally U(0, 1), so importance
+    sampling estimates based on it remain unbiased; only the samples
+    belonging to the same example are correlated:
+
+    'iid'        -- independent uniforms
+    'antithetic' -- pairs (u, 1-u)
+    'stratified' -- Latin hypercube: in every dimension each of the
+                    n_samples equal-width strata receives exactly one sample
+    """
+    if rng is None:
+        rng = theano_rng
+    if nstreams is None:
+        nstreams = N_STREAMS
+
+    if mode == 'iid':
+        u = rng.uniform(size=(batch_size * n_samples, dim), nstreams=nstreams)
+    elif mode == 'antithetic':
+        u = rng.uniform(size=(batch_size, (n_samples + 1) // 2, dim), nstreams=nstreams)
+        u = tensor.concatenate([u, 1. - u], axis=1)[:, :n_samples, :]
+    elif mode == 'stratified':
+        u = rng.uniform(size=(batch_size, n_samples, dim), nstreams=nstreams)
+        strata = tensor.argsort(rng.uniform(size=(batch_size, n_samples, dim), nstreams=nstreams), axis=1)
+        u = (strata + u) / n_samples
+    else:
+        raise ValueError("Unknown sampling mode '%s'" % mode)
+
+    return u.reshape((batch_size * n_samples, dim)).astype(floatX)
+
+#-----------------------------------------------------------------------------
+# Counter-based uniform noise (common random numbers)
+#
+# Every uniform is a hash of (seed, example, layer, sample, unit), so two
+# models evaluated on the same examples see exactly the same noise,
+# independent of batch sizes, evaluation order and layer widths (units
+# beyond the width of the narrower model simply get fresh numbers).
+
+_golden = np.uint64(0x9E3779B97F4A7C15)
+_mul1 = np.uint64(0xBF58476D1CE4E5B9)
+_mul2 = np.uint64(0x94D049BB133111EB)
+
+
+def splitmix64(x):
+    """ SplitMix64 finalizer; a bijective hash of uint64 arrays """
+    with np.errstate(over='ignore'):
+        z = np.asarray(x, dtype=np.uint64) + _golden
+        z = (z ^ (z >> np.uint64(30))) * _mul1
+        z = (z ^ (z >> np.uint64(27))) * _mul2
+        return z ^ (z >> np.uint64(31))
+
+
+def counter_uniform(example_ids, layer, n_samples, dim, seed=0):
+    """Counter-based uniform noise for the q-layer *layer*.
+
+    Parameters
+    ----------
+    example_ids : ndarray
+        Global index of every example in the batch
+    layer : int
+    n_samples : int
+    dim : int
+    seed : int
+
+    Returns
+    -------
+    u : ndarray
+        (len(example_ids) * n_samples, dim) matrix of U(0, 1) variates with
+        the rows ordered like replicate_batch().
+    """
+    example_ids = np.asarray(example_ids, dtype=np.uint64)
+
+    with np.errstate(over='ignore'):
+        key = splitmix64(splitmix64(np.uint64(seed)) + np.uint64(layer))
+        key = splitmix64(key + example_ids[:, None, None])
+        key = splitmix64(key + np.arange(n_samples, dtype=np.uint64)[None, :, None])
+        bits = splitmix64(key + np.arange(dim, dtype=np.uint64)[None, None, :])
+
+    u = (bits >> np.uint64(11)).astype(np.float64) * 2. ** -53
+    return u.reshape((len(example_ids) * n_samples, dim)).astype(floatX)
+
 #-----------------------------------------------------------------------------
 # Optimization
 
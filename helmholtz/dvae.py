@@ -79,7 +79,6 @@ class DVAE(HelmholtzMachine, Random):
         z_prob = z_prob.clip(1e-10, 1-1e-10)
 
         z_prob   = replicate_batch(z_prob, n_samples)
-        features = replicate_batch(features, n_samples)
 
         rho = self.theano_rng.uniform(
                     size=z_prob.shape, 
@@ -98,7 +97,7 @@ class DVAE(HelmholtzMachine, Random):
         log_p = tensor.log(log_p).sum(axis=1)
 
         # + p(x|xi)
-        log_p += self.p.log_prob(features, xi)
+        log_p += self.p.log_prob(features, xi, n_samples=n_samples, per_example='X')
        
         log_pq = log_p-log_q
         log_pq = log_pq.reshape([batch_size, n_samples])
@@ -115,7 +114,6 @@ class DVAE(HelmholtzMachine, Random):
         z_prob = self.q.sample_expected(features)
 
         # Reconstruction...
-        features_r = replicate_batch(features, n_samples)
         z_prob_r   = replicate_batch(z_prob, n_samples)
 
         rho = self.theano_rng.uniform(
@@ -126,7 +124,7 @@ class DVAE(HelmholtzMachine, Random):
         xi = (rho-1)/z_prob_r + 1
         z_r = tensor.switch(xi > 0., xi, 0)
 
-        recons_term = self.p.log_prob(features_r, z_r)
+        recons_term = self.p.log_prob(features, z_r, n_samples=n_samples, per_example='X')
         recons_term = recons_term.reshape([batch_size, n_samples])
         recons_term = tensor.sum(recons_term, axis=1) / n_samples
         recons_term.name = 'recons_term'
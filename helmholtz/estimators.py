@@ -0,0 +1,219 @@
+
+from __future__ import division, print_function
+
+import logging
+
+import numpy
+import theano
+
+from theano import tensor
+
+from . import logsumexp, logsumexp_weights
+from .prob_layers import BernoulliTopLayer, BernoulliLayer
+
+logger = logging.getLogger(__name__)
+floatX = theano.config.floatX
+
+#-----------------------------------------------------------------------------
+
+
+def systematic_resample(log_w, u):
+    """Systematic resampling, independently for every example.
+
+    Parameters
+    ----------
+    log_w : T.matrix
+        Unnormalized log-weights with shape (batch_size, n_samples)
+    u : T.vector
+        One U(0, 1) variate per example
+
+    Returns
+    -------
+    idx : T.imatrix
+        Ancestor indices (within each example) with shape (batch_size, n_samples)
+    """
+    n_samples = log_w.shape[1]
+
+    _, w = logsumexp_weights(log_w, axis=1)
+    cdf = tensor.cumsum(w, axis=1)
+    positions = (tensor.arange(n_samples).dimshuffle('x', 0) + u.dimshuffle(0, 'x')) / n_samples
+
+    # Number of cdf entries below each position; O(n_samples^2) per example
+    idx = tensor.sum(cdf.dimshuffle(0, 'x', 1) < positions.dimshuffle(0, 1, 'x'), axis=2)
+    return tensor.minimum(idx, n_samples - 1).astype('int32')
+
+
+def smc_log_likelihood(brick, features, n_samples, ess_threshold=0.5):
+    """Sequential importance resampling estimate of log p(x).
+
+    The particles are propagated layer by layer through the q-layers. After
+    sampling h_l ~ q(h_l | h_{l-1}) each particle is reweighted with the
+    incremental weight p(h_{l-1} | h_l) / q(h_l | h_{l-1}) (and finally
+    with the top-layer prior p(h_L)). Whenever the effective sample size of
+    an example drops below *ess_threshold* * n_samples, its particles are
+    resampled and all weights are set to their mean.
+
+    The product of the intermediate weights equals the full-path weight
+    p(x, h) / q(h | x), so the returned p(x) estimate is unbiased.
+
+    Parameters
+    ----------
+    brick : ReweightedWakeSleep or BiHM
+    features : T.matrix
+    n_samples : T.iscalar
+        Number of particles per example
+    ess_threshold : float
+        Resample when ESS / n_samples falls below this value
+
+    Returns
+    -------
+    log_px : T.vector
+    n_resampled : T.vector
+        Number of resampling steps for every example
+    """
+    p_layers = brick.p_layers
+    q_layers = brick.q_layers
+    n_layers = len(p_layers)
+
+    batch_size = features.shape[0]
+
+    offsets = (tensor.arange(batch_size) * n_samples).dimshuffle(0, 'x')
+    no_resampling = tensor.arange(n_samples).dimshuffle('x', 0) + tensor.zeros((batch_size, 1), dtype='int32')
+
+    log_w = tensor.zeros((batch_size, n_samples))
+    n_resampled = tensor.zeros((batch_size,))
+    for l in xrange(n_layers - 1):
+        if l == 0:
+            # One row per example: the bottom q-layer is evaluated once per example
+            h_next, log_q = q_layers[0].sample(features, n_samples=n_samples)
+            log_p = p_layers[0].log_prob(features, h_next, n_samples=n_samples, per_example='X')
+        else:
+            h_next, log_q = q_layers[l].sample(h)
+            log_p = p_layers[l].log_prob(h, h_next)
+        log_w = log_w + (log_p - log_q).reshape((batch_size, n_samples))
+
+        if l == n_layers - 2:
+            log_w = log_w + p_layers[-1].log_prob(h_next).reshape((batch_size, n_samples))
+            break
+
+        # Resample examples with a degenerate particle set
+        _, w = logsumexp_weights(log_w, axis=1)
+        ess = 1. / tensor.sum(w ** 2, axis=1) / n_samples
+        resample = ess < ess_threshold
+
+        u = brick.theano_rng.uniform(size=(batch_size,))
+        idx = tensor.switch(resample.dimshuffle(0, 'x'), systematic_resample(log_w, u), no_resampling)
+        h = h_next[(idx + offsets).flatten()]
+
+        log_w_mean = logsumexp(log_w, axis=1) - tensor.log(n_samples)
+        log_w = tensor.switch(resample.dimshuffle(0, 'x'),
+                              log_w_mean.dimshuffle(0, 'x') + tensor.zeros_like(log_w), log_w)
+        n_resampled = n_resampled + resample
+
+    log_px = logsumexp(log_w, axis=1) - tensor.log(n_samples)
+    return log_px, n_resampled
+
+#-----------------------------------------------------------------------------
+
+
+def enumerate_configurations(dim):
+    """ All 2**dim binary vectors as a (2**dim, dim) array """
+    configs = numpy.arange(2 ** dim)[:, None] >> numpy.arange(dim)[None, :]
+    return (configs & 1).astype(floatX)
+
+
+def bernoulli_log_prob_matrix(X, prob):
+    """log P(X_n | prob_c) for all pairs of rows.
+
+    Parameters
+    ----------
+    X : T.matrix
+        Binary vectors with shape (N, dim)
+    prob : T.matrix
+        Bernoulli probabilities with shape (C, dim)
+
+    Returns
+    -------
+    log_prob : T.matrix with shape (N, C)
+    """
+    return tensor.dot(X, tensor.log(prob).T) + tensor.dot(1. - X, tensor.log(1. - prob).T)
+
+
+def rao_blackwellized_log_likelihood(brick, features, n_samples, max_width=10):
+    """Importance sampled log p(x) with the top layer summed out exactly.
+
+    All but the top layer are sampled from q as usual. For every sample,
+    p(h_{L-1}) = sum_{h_L} p(h_{L-1} | h_L) p(h_L) is computed by enumerating
+    all 2**dim configurations of the top layer; the importance weights
+    therefore use the marginal proposal q(h_1, ..., h_{L-1} | x) and have a
+    lower variance than the full-path weights.
+
+    For the BiHM p* estimate the top layer is summed out of
+    sqrt(p(x, h) q(h | x)) in the same way.
+
+    Parameters
+    ----------
+    brick : ReweightedWakeSleep or BiHM
+        With a BernoulliTopLayer and a BernoulliLayer directly below it.
+    features : T.matrix
+    n_samples : T.iscalar
+    max_width : int
+        Top layers wider than this are not enumerated; the plain importance
+        sampled estimate brick.log_likelihood is returned instead.
+
+    Returns
+    -------
+    log_px : T.vector
+    log_psx : T.vector
+    """
+    p_layers = brick.p_layers
+    q_layers = brick.q_layers
+    n_layers = len(p_layers)
+
+    assert isinstance(p_layers[-1], BernoulliTopLayer)
+    assert isinstance(p_layers[-2], BernoulliLayer)
+    assert isinstance(q_layers[-1], BernoulliLayer)
+
+    top_dim = p_layers[-1].dim_X
+    if top_dim > max_width:
+        logger.warning("Top layer too wide to enumerate (%d > %d units); sampling it instead" % (top_dim, max_width))
+        return brick.log_likelihood(features, n_samples)
+
+    batch_size = features.shape[0]
+
+    # Sample all but the top layer; the features are not replicated
+    samples = [features]
+    log_p = tensor.zeros((batch_size * n_samples,))
+    log_q = tensor.zeros((batch_size * n_samples,))
+    for l in xrange(n_layers - 2):
+        if l == 0:
+            h, log_q_l = q_layers[0].sample(features, n_samples=n_samples)
+            log_p_l = p_layers[0].log_prob(features, h, n_samples=n_samples, per_example='X')
+        else:
+            h, log_q_l = q_layers[l].sample(samples[l])
+            log_p_l = p_layers[l].log_prob(samples[l], h)
+        samples.append(h)
+        log_q = log_q + log_q_l
+        log_p = log_p + log_p_l
+    h = samples[-1]
+
+    # Enumerate the top layer: shape (rows of h, 2**top_dim)
+    configs = tensor.constant(enumerate_configurations(top_dim))
+    log_prior = p_layers[-1].log_prob(configs)
+    log_cond = bernoulli_log_prob_matrix(h, p_layers[-2].sample_expected(configs))
+    log_q_top = bernoulli_log_prob_matrix(configs, q_layers[-1].sample_expected(h)).T
+
+    log_p_top = log_cond + log_prior.dimshuffle('x', 0)
+    log_marginal = logsumexp(log_p_top, axis=1)
+    log_sqrt_marginal = logsumexp((log_p_top + log_q_top) / 2, axis=1)
+    if n_layers == 2:
+        # The top layer sits directly on the features: one row per example
+        log_marginal = log_marginal.repeat(n_samples, axis=0)
+        log_sqrt_marginal = log_sqrt_marginal.repeat(n_samples, axis=0)
+
+    log_w = (log_p + log_marginal - log_q).reshape((batch_size, n_samples))
+    log_sw = ((log_p - log_q) / 2 + log_sqrt_marginal).reshape((batch_size, n_samples))
+
+    log_px = logsumexp(log_w, axis=1) - tensor.log(n_samples)
+    log_psx = (logsumexp(log_sw, axis=1) - tensor.log(n_samples)) * 2.
+    return log_px, log_psx
@@ -0,0 +1,89 @@
+
+from __future__ import division, print_function
+
+import numpy
+
+#-----------------------------------------------------------------------------
+# NumPy reductions over per-sample log-probabilities.
+#
+# All functions expect log_p and log_q (or log_w) arrays with shape
+# (n_examples, n_samples) and reduce over the last axis.
+
+
+def logsumexp(a, axis=-1):
+    """Numerically stable log( sum( exp(a) ) ) """
+    a_max = numpy.max(a, axis=axis, keepdims=True)
+    a_max = numpy.where(numpy.isfinite(a_max), a_max, 0.)
+    b = numpy.log(numpy.sum(numpy.exp(a - a_max), axis=axis, keepdims=True)) + a_max
+    return numpy.squeeze(b, axis=axis)
+
+
+def log_mean_exp(a, axis=-1):
+    """Numerically stable log( mean( exp(a) ) ) """
+    return logsumexp(a, axis=axis) - numpy.log(a.shape[axis])
+
+
+def normalize_log_weights(log_w):
+    """ Return normalized (to sum 1 along the last axis) weights """
+    return numpy.exp(log_w - logsumexp(log_w)[..., None])
+
+
+def estimate_log_px(log_p, log_q):
+    """ Importance sampled log p(x) estimate """
+    return log_mean_exp(log_p - log_q)
+
+
+def estimate_log_psx(log_p, log_q):
+    """ Importance sampled (unnormalized) BiHM log p*(x) estimate """
+    return 2 * log_mean_exp((log_p - log_q) / 2)
+
+
+def estimate_kl(log_p, log_q):
+    """ Estimate KL(q(h|x) | p(h|x)) using E_q[log q - log p] + log p(x) """
+    return numpy.mean(log_q - log_p, axis=-1) + estimate_log_px(log_p, log_q)
+
+
+def effective_sample_size(log_w):
+    """ Effective sample size as a fraction of the number of samples """
+    w = normalize_log_weights(log_w)
+    return 1. / (w.shape[-1] * numpy.sum(w ** 2, axis=-1))
+
+
+def estimate_all(log_p_layers, log_q_layers):
+    """Compute all importance sampling estimates from the same samples.
+
+    Parameters
+    ----------
+    log_p_layers : list
+        Per-layer log p arrays with shape (n_examples, n_samples)
+    log_q_layers : list
+        Per-layer log q arrays with shape (n_examples, n_samples)
+
+    Returns
+    -------
+    results : dict
+        Per-example log_px, log_psx, kl, layer_kl (n_layers, n_examples),
+        ess_p and ess_ps.
+    """
+    log_p = sum(log_p_layers)
+    log_q = sum(log_q_layers)
+
+    return {
+        'log_px': estimate_log_px(log_p, log_q),
+        'log_psx': estimate_log_psx(log_p, log_q),
+        'kl': estimate_kl(log_p, log_q),
+        'layer_kl': numpy.asarray([numpy.mean(lq - lp, axis=-1)
+                                   for lp, lq in zip(log_p_layers, log_q_layers)]),
+        'ess_p': effective_sample_size(log_p - log_q),
+        'ess_ps': effective_sample_size((log_p - log_q) / 2),
+    }
+
+
+def log_px_standard_error(log_sum_w, log_sum_w2, n_samples):
+    """Delta-method standard error of the estimate log(sum(w) / n_samples).
+
+    Uses Var[log mean(w)] ~= Var[w] / (n E[w]^2) = (n sum(w^2) / sum(w)^2 - 1) / n
+    computed from the running sums log(sum(w)) and log(sum(w^2)).
+    """
+    ratio = numpy.exp(log_sum_w2 - 2 * log_sum_w + numpy.log(n_samples))
+    return numpy.sqrt(numpy.maximum(ratio - 1., 0.) / n_samples)
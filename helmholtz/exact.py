@@ -0,0 +1,180 @@
+
+from __future__ import division, print_function
+
+import logging
+
+import numpy
+
+from .evaluation import logsumexp
+from .prob_layers import BernoulliTopLayer, BernoulliLayer, sigmoid_frindge
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------
+# Exact enumeration for small, fully Bernoulli Helmholtz machines.
+#
+# All latent configurations are visited in Gray-code order: consecutive
+# configurations differ in a single bit, so the pre-activations of the
+# layer they feed into follow from their predecessor by adding or
+# subtracting one row of the weight matrix.
+
+# Pre-activations corresponding to the probability clipping in prob_layers
+logit_clip = numpy.log((1. - sigmoid_frindge) / sigmoid_frindge)
+
+
+def gray_code(start, stop, dim):
+    """ Bits of the Gray-code configurations start..stop-1 as a (stop-start, dim) array """
+    idx = numpy.arange(start, stop, dtype=numpy.int64)
+    code = idx ^ (idx >> 1)
+    return ((code[:, None] >> numpy.arange(dim)) & 1).astype(numpy.float64)
+
+
+def gray_code_preactivations(W, b, start, stop):
+    """Pre-activations gray_code(j).dot(W) + b for j = start..stop-1.
+
+    Only the first row is computed with a matrix product; every following
+    row adds or subtracts the single row of W whose bit flips.
+    """
+    dim = W.shape[0]
+
+    A = numpy.empty((stop - start, W.shape[1]))
+    A[0] = gray_code(start, start + 1, dim).dot(W) + b
+    if stop - start > 1:
+        j = numpy.arange(start + 1, stop, dtype=numpy.int64)
+        flip = numpy.round(numpy.log2(j & -j)).astype(numpy.int64)
+        sign = 2. * (((j ^ (j >> 1)) >> flip) & 1) - 1.
+        A[1:] = A[0] + numpy.cumsum(sign[:, None] * W[flip], axis=0)
+    return A
+
+
+def log_prob_table(X, A):
+    """log P(X_i | sigmoid(A_j)) for all pairs of rows.
+
+    Parameters
+    ----------
+    X : ndarray
+        Binary vectors with shape (N, dim)
+    A : ndarray
+        Pre-activations with shape (M, dim)
+
+    Returns
+    -------
+    log_prob : ndarray with shape (N, M)
+    """
+    A = numpy.clip(A, -logit_clip, logit_clip)
+    return X.dot(A.T) - numpy.logaddexp(0., A).sum(axis=1)[None, :]
+
+
+#-----------------------------------------------------------------------------
+
+
+def layer_parameters(layer):
+    """ Return (W, b) of a single Linear+Logistic BernoulliLayer (or b of a BernoulliTopLayer) """
+    if isinstance(layer, BernoulliTopLayer):
+        return layer.parameters[0].get_value().astype(numpy.float64)
+
+    if not isinstance(layer, BernoulliLayer) or len(layer.mlp.linear_transformations) != 1:
+        raise ValueError("Exact enumeration requires single Linear+Logistic Bernoulli layers (%s)" % layer.name)
+    linear = layer.mlp.linear_transformations[0]
+    return (linear.W.get_value().astype(numpy.float64),
+            linear.b.get_value().astype(numpy.float64))
+
+
+class ExactEnumeration(object):
+    """Exact log p(x), BiHM log p~(x) and 2 log Z by enumerating all latent states.
+
+    The chain structure of the model is exploited with a layer-wise
+    dynamic program: starting at the top, the messages
+
+        m_L(h_L)         = log p(h_L)
+        m_l(h_l)         = log sum_{h_{l+1}} f_{l+1}(h_l, h_{l+1}) exp(m_{l+1}(h_{l+1}))
+
+    are computed for every configuration of each layer, with
+    f = p(h_l | h_{l+1}) for log p(x), and f = sqrt(p(h_l | h_{l+1}) q(h_{l+1} | h_l))
+    (and m_L = 1/2 log p(h_L)) for the BiHM quantity
+    log p~(x) = 2 log sum_h sqrt(p(x, h) q(h | x)). The cost is therefore
+    sum_l 2**(d_l + d_{l+1}) instead of 2**(sum_l d_l).
+
+    Parameters
+    ----------
+    brick : ReweightedWakeSleep or BiHM
+    chunk_size : int
+        Number of configurations processed at once along each axis.
+    max_dim : int
+        Refuse to enumerate layers wider than this.
+    """
+    def __init__(self, brick, chunk_size=4096, max_dim=24):
+        self.chunk_size = chunk_size
+
+        self.p_params = [layer_parameters(l) for l in brick.p_layers]
+        self.q_params = [layer_parameters(l) for l in brick.q_layers]
+        self.dims = [layer.dim_X for layer in brick.p_layers]
+
+        for dim in self.dims[1:]:
+            if dim > max_dim:
+                raise ValueError("Hidden layer too wide to enumerate (%d > %d units)" % (dim, max_dim))
+
+        self._messages = {}
+
+    def _chunks(self, dim):
+        n_configs = 2 ** dim
+        for start in xrange(0, n_configs, self.chunk_size):
+            yield start, min(start + self.chunk_size, n_configs)
+
+    def _top_messages(self, sqrt):
+        b = self.p_params[-1]
+        dim = self.dims[-1]
+        m = numpy.empty(2 ** dim)
+        for start, stop in self._chunks(dim):
+            m[start:stop] = log_prob_table(gray_code(start, stop, dim), b[None, :])[:, 0]
+        return m / 2 if sqrt else m
+
+    def _reduce_layer(self, X, l, m_upper, sqrt):
+        """ m_l(X_i) = log sum_j f_{l+1}(X_i, h_j) exp(m_upper[j]) for the rows of X """
+        W_p, b_p = self.p_params[l]
+        W_q, b_q = self.q_params[l]
+        dim = self.dims[l + 1]
+
+        if sqrt:
+            A_q = numpy.clip(X.dot(W_q) + b_q, -logit_clip, logit_clip)
+            log_norm_q = numpy.logaddexp(0., A_q).sum(axis=1)
+
+        m = numpy.empty((X.shape[0], 0))
+        for start, stop in self._chunks(dim):
+            log_f = log_prob_table(X, gray_code_preactivations(W_p, b_p, start, stop))
+            if sqrt:
+                H = gray_code(start, stop, dim)
+                log_f = (log_f + A_q.dot(H.T) - log_norm_q[:, None]) / 2
+            log_f += m_upper[None, start:stop]
+            m = numpy.concatenate([m, logsumexp(log_f, axis=1)[:, None]], axis=1)
+        return logsumexp(m, axis=1)
+
+    def messages(self, sqrt=False):
+        """ Messages m_1(h_1) for all configurations of the first hidden layer """
+        if sqrt not in self._messages:
+            m = self._top_messages(sqrt)
+            for l in reversed(xrange(1, len(self.dims) - 1)):
+                dim = self.dims[l]
+                m_lower = numpy.empty(2 ** dim)
+                for start, stop in self._chunks(dim):
+                    m_lower[start:stop] = self._reduce_layer(gray_code(start, stop, dim), l, m, sqrt)
+                m = m_lower
+            self._messages[sqrt] = m
+        return self._messages[sqrt]
+
+    def log_px(self, X):
+        """ Exact log p(x) for every row of X """
+        X = numpy.asarray(X, dtype=numpy.float64)
+        return self._reduce_layer(X, 0, self.messages(), False)
+
+    def log_psx(self, X):
+        """ Exact (unnormalized) BiHM log p~(x) = 2 log sum_h sqrt(p(x, h) q(h | x)) """
+        X = numpy.asarray(X, dtype=numpy.float64)
+        return 2 * self._reduce_layer(X, 0, self.messages(sqrt=True), True)
+
+    def log_z2(self):
+        """ Exact 2 log Z = log sum_x p~(x); enumerates all 2**dim data vectors """
+        dim = self.dims[0]
+        log_psx = [logsumexp(self.log_psx(gray_code(start, stop, dim)))
+                   for start, stop in self._chunks(dim)]
+        return float(logsumexp(numpy.asarray(log_psx)))
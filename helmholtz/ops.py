@@ -0,0 +1,309 @@
+
+from __future__ import division, print_function
+
+import logging
+
+import numpy
+import scipy.sparse
+import theano
+import theano.sparse
+
+from theano import tensor
+from theano.gradient import DisconnectedType
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------
+
+
+class UniqueRows(theano.Op):
+    """Indices of the distinct rows of a matrix.
+
+    Returns (index, inverse) with X[index] the distinct rows of X and
+    X[index][inverse] == X. Binary matrices are bit-packed before the rows
+    are compared, so the sort runs over dim/8 bytes per row.
+    """
+    __props__ = ()
+
+    def make_node(self, X):
+        X = tensor.as_tensor_variable(X)
+        assert X.ndim == 2
+        return theano.Apply(self, [X], [tensor.lvector(), tensor.lvector()])
+
+    def perform(self, node, inputs, output_storage):
+        X = inputs[0]
+
+        if ((X == 0) | (X == 1)).all():
+            keys = numpy.packbits(X.astype(numpy.uint8), axis=1)
+        else:
+            keys = numpy.ascontiguousarray(X)
+        keys = keys.view(numpy.dtype((numpy.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+
+        _, index, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+        output_storage[0][0] = index.astype(numpy.int64)
+        output_storage[1][0] = inverse.astype(numpy.int64)
+
+    def connection_pattern(self, node):
+        return [[False, False]]
+
+    def grad(self, inputs, grads):
+        return [DisconnectedType()()]
+
+unique_rows = UniqueRows()
+
+#-----------------------------------------------------------------------------
+
+
+class BinaryDot(theano.Op):
+    """Matrix product H.dot(W) for a binary (0/1) left operand.
+
+    Every output row is the sum of the rows of W selected by the active
+    units of the corresponding row of H; H is converted to a CSR index
+    structure and the product costs O(nnz(H) * W.shape[1]) instead of a
+    dense GEMM. Worthwhile for sparse activity patterns only (see
+    bench-binary-dot.py).
+    """
+    __props__ = ()
+
+    def make_node(self, H, W):
+        H = tensor.as_tensor_variable(H)
+        W = tensor.as_tensor_variable(W)
+        assert H.ndim == 2 and W.ndim == 2
+        return theano.Apply(self, [H, W], [tensor.matrix(dtype=W.dtype)])
+
+    def perform(self, node, inputs, output_storage):
+        H, W = inputs
+        out = scipy.sparse.csr_matrix(H != 0, dtype=W.dtype).dot(W)
+        output_storage[0][0] = numpy.asarray(out, dtype=W.dtype)
+
+    def infer_shape(self, node, shapes):
+        return [(shapes[0][0], shapes[1][1])]
+
+    def grad(self, inputs, grads):
+        H, W = inputs
+        g, = grads
+        return [tensor.dot(g, W.T), binary_dot(H.T, g)]
+
+binary_dot = BinaryDot()
+
+#-----------------------------------------------------------------------------
+
+
+class LogSumExp(theano.Op):
+    """log(sum(exp(A), axis)) and optionally exp(A - log(sum(exp(A)))) in one op.
+
+    The max, exp, sum and log of the composed expression are fused into a
+    single sweep over each row (C implementation for vectors and matrices,
+    numpy otherwise), and with *normalize* the exponentials computed on the way
+    are returned as the normalized weights. Rows that are entirely -inf
+    yield -inf.
+    """
+    __props__ = ('axis', 'normalize')
+
+    def __init__(self, axis, normalize=False):
+        self.axis = axis
+        self.normalize = normalize
+
+    def make_node(self, A):
+        A = tensor.as_tensor_variable(A)
+        assert 0 <= self.axis < A.ndim
+        assert A.dtype in ('float32', 'float64')
+        broadcastable = A.broadcastable[:self.axis] + A.broadcastable[self.axis + 1:]
+        outputs = [tensor.TensorType(A.dtype, broadcastable)()]
+        if self.normalize:
+            outputs.append(A.type())
+        return theano.Apply(self, [A], outputs)
+
+    def perform(self, node, inputs, output_storage):
+        A, = inputs
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            A_max = A.max(axis=self.axis, keepdims=True)
+            A_max[~numpy.isfinite(A_max)] = 0.
+            E = numpy.exp(A - A_max)
+            S = E.sum(axis=self.axis, keepdims=True)
+            output_storage[0][0] = numpy.asarray(
+                (numpy.log(S) + A_max).squeeze(axis=self.axis), dtype=A.dtype)
+            if self.normalize:
+                output_storage[1][0] = numpy.asarray(E / S, dtype=A.dtype)
+
+    def infer_shape(self, node, shapes):
+        A_shape, = shapes
+        lse_shape = tuple(A_shape[:self.axis]) + tuple(A_shape[self.axis + 1:])
+        if self.normalize:
+            return [lse_shape, A_shape]
+        return [lse_shape]
+
+    def grad(self, inputs, output_grads):
+        A, = inputs
+        _, W = LogSumExp(self.axis, normalize=True)(A)
+
+        terms = []
+        if not isinstance(output_grads[0].type, DisconnectedType):
+            terms.append(tensor.shape_padaxis(output_grads[0], self.axis) * W)
+        if self.normalize and not isinstance(output_grads[1].type, DisconnectedType):
+            gW = output_grads[1]
+            terms.append(W * (gW - tensor.sum(gW * W, axis=self.axis, keepdims=True)))
+        if not terms:
+            return [tensor.zeros_like(A)]
+        return [sum(terms[1:], terms[0])]
+
+    def c_headers(self):
+        return ['<math.h>']
+
+    def c_code_cache_version(self):
+        return (3,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        ndim = node.inputs[0].ndim
+        if ndim not in (1, 2):
+            raise theano.gof.utils.MethodNotDefined()
+
+        A, = inputs
+        lse = outputs[0]
+        fail = sub['fail']
+        axis = self.axis
+
+        # A vector is a single row
+        if ndim == 1:
+            n_rows, A_row = "1", "0"
+        else:
+            n_rows = "PyArray_DIMS(%s)[%d]" % (A, 1 - axis)
+            A_row = "PyArray_STRIDES(%s)[%d]" % (A, 1 - axis)
+        lse_row = "0" if ndim == 1 else "PyArray_STRIDES(%s)[0]" % lse
+
+        alloc_W = "PyArrayObject* W = NULL; const npy_intp W_row = 0, W_col = 0;"
+        if self.normalize:
+            W = outputs[1]
+            W_row = "0" if ndim == 1 else "PyArray_STRIDES(W)[%d]" % (1 - axis)
+            alloc_W = """
+            if (%(W)s == NULL || !PyArray_SAMESHAPE(%(W)s, %(A)s)) {
+                Py_XDECREF(%(W)s);
+                %(W)s = (PyArrayObject*)PyArray_EMPTY(%(ndim)d, PyArray_DIMS(%(A)s), PyArray_TYPE(%(A)s), 0);
+                if (!%(W)s) {
+                    PyErr_SetString(PyExc_MemoryError, "LogSumExp: failed to allocate output");
+                    %(fail)s
+                }
+            }
+            PyArrayObject* W = %(W)s;
+            const npy_intp W_row = %(W_row)s;
+            const npy_intp W_col = PyArray_STRIDES(W)[%(axis)d];
+            """ % locals()
+
+        return """
+        {
+            const npy_intp n_rows = %(n_rows)s;
+            const npy_intp n_cols = PyArray_DIMS(%(A)s)[%(axis)d];
+            const npy_intp A_row = %(A_row)s;
+            const npy_intp A_col = PyArray_STRIDES(%(A)s)[%(axis)d];
+
+            if (%(lse)s == NULL || PyArray_NDIM(%(lse)s) != %(ndim)d - 1
+                    || (%(ndim)d == 2 && PyArray_DIMS(%(lse)s)[0] != n_rows)) {
+                Py_XDECREF(%(lse)s);
+                %(lse)s = (PyArrayObject*)PyArray_EMPTY(%(ndim)d - 1, (npy_intp*)&n_rows, PyArray_TYPE(%(A)s), 0);
+                if (!%(lse)s) {
+                    PyErr_SetString(PyExc_MemoryError, "LogSumExp: failed to allocate output");
+                    %(fail)s
+                }
+            }
+            const npy_intp lse_row = %(lse_row)s;
+
+            %(alloc_W)s
+
+            for (npy_intp i = 0; i < n_rows; ++i) {
+                const char* a = PyArray_BYTES(%(A)s) + i * A_row;
+
+                double a_max = -INFINITY;
+                for (npy_intp j = 0; j < n_cols; ++j) {
+                    double v = *(const dtype_%(A)s*)(a + j * A_col);
+                    if (v > a_max)
+                        a_max = v;
+                }
+                const double shift = (a_max > -INFINITY && a_max < INFINITY) ? a_max : 0.;
+
+                double sum = 0.;
+                if (W) {
+                    char* w = PyArray_BYTES(W) + i * W_row;
+                    for (npy_intp j = 0; j < n_cols; ++j) {
+                        double e = exp(*(const dtype_%(A)s*)(a + j * A_col) - shift);
+                        *(dtype_%(A)s*)(w + j * W_col) = e;
+                        sum += e;
+                    }
+                    const double scale = 1. / sum;
+                    for (npy_intp j = 0; j < n_cols; ++j)
+                        *(dtype_%(A)s*)(w + j * W_col) *= scale;
+                } else {
+                    for (npy_intp j = 0; j < n_cols; ++j)
+                        sum += exp(*(const dtype_%(A)s*)(a + j * A_col) - shift);
+                }
+
+                *(dtype_%(A)s*)(PyArray_BYTES(%(lse)s) + i * lse_row) = log(sum) + shift;
+            }
+        }
+        """ % locals()
+
+
+@tensor.opt.register_canonicalize
+@theano.gof.local_optimizer([LogSumExp])
+def local_merge_logsumexp(node):
+    """ Take log(sum(exp(A))) from a normalizing LogSumExp over the same A and axis """
+    if not isinstance(node.op, LogSumExp) or node.op.normalize:
+        return False
+    for client, _ in node.inputs[0].clients:
+        if client != 'output' and client.op == LogSumExp(node.op.axis, normalize=True):
+            return [client.outputs[0]]
+    return False
+
+
+def logsumexp_op(A, axis, normalize=False):
+    """ Apply LogSumExp along *axis* (negative values count from the end) """
+    A = tensor.as_tensor_variable(A)
+    if A.dtype not in ('float32', 'float64'):
+        A = tensor.cast(A, theano.config.floatX)
+    return LogSumExp(axis % A.ndim, normalize)(A)
+
+
+class LogAddExp(theano.scalar.BinaryScalarOp):
+    """ Elementwise log(exp(a) + exp(b)) without overflow """
+
+    def impl(self, a, b):
+        return numpy.logaddexp(a, b)
+
+    def grad(self, inputs, output_grads):
+        a, b = inputs
+        gz, = output_grads
+        z = self(a, b)
+        return [gz * theano.scalar.exp(a - z), gz * theano.scalar.exp(b - z)]
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        a, b = inputs
+        z, = outputs
+        if node.inputs[0].type not in theano.scalar.float_types:
+            raise theano.gof.utils.MethodNotDefined()
+        return """%(z)s = (%(a)s == %(b)s) ? %(a)s + 0.6931471805599453 :
+                     (%(a)s > %(b)s ? %(a)s + log1p(exp(%(b)s - %(a)s))
+                                    : %(b)s + log1p(exp(%(a)s - %(b)s)));""" % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
+scalar_logaddexp = LogAddExp(theano.scalar.upgrade_to_float, name='logaddexp')
+logaddexp = tensor.elemwise.Elemwise(scalar_logaddexp, name='logaddexp')
+
+#-----------------------------------------------------------------------------
+# Sparse (CSR) feature matrices
+
+
+def is_sparse(X):
+    """ True if *X* is a theano.sparse variable """
+    return isinstance(X.type, theano.sparse.SparseType)
+
+
+def sparse_replicate_rows(X, repeat):
+    """ Sparse matrix with every row of *X* repeated *repeat* times (example-major) """
+    index = tensor.arange(X.shape[0] * repeat) // repeat
+    return theano.sparse.basic.get_item_list(X, index)
+
+
+def sparse_rowwise_dot(X, D):
+    """ (X * D).sum(axis=1) for sparse X and dense D, touching only the non-zeros of X """
+    return theano.sparse.sp_sum(theano.sparse.mul_s_d(X, D), axis=1)
@@ -5,6 +5,7 @@ import logging
 
 import numpy
 import theano
+import theano.sparse
 
 from collections import OrderedDict
 from theano import tensor
@@ -16,6 +17,7 @@ from blocks.utils import pack, shared_floatx_zeros
 from blocks.select import Selector
 
 from .distributions import bernoulli
+from .ops import unique_rows, binary_dot, is_sparse, sparse_rowwise_dot, sparse_replicate_rows
 
 logger = logging.getLogger(__name__)
 floatX = theano.config.floatX
@@ -73,8 +75,8 @@ class ProbabilisticLayer(Random):
     def log_prob(self, X, Y):
         raise NotImplemented
 
-    def get_gradients(self, X, Y, weights=1.):
-        cost = -(weights * self.log_prob(X, Y)).sum()
+    def get_gradients(self, X, Y, weights=1., **kwargs):
+        cost = -(weights * self.log_prob(X, Y, **kwargs)).sum()
 
         params = Selector(self).get_parameters()
 
@@ -131,6 +133,11 @@ class BernoulliTopLayer(Initializable, ProbabilisticTopLayer):
 
 
 class BernoulliLayer(Initializable, ProbabilisticLayer):
+    # Evaluate the MLP only once for every distinct row of Y
+    dedup = False
+
+    # Y is binary: compute its first linear transformation with binary_dot
+    binary_input = False
 
     def __init__(self, mlp, **kwargs):
         super(BernoulliLayer, self).__init__(**kwargs)
@@ -144,17 +151,80 @@ class BernoulliLayer(Initializable, ProbabilisticLayer):
 
     @application(inputs=['Y'], outputs=['X_expected'])
     def sample_expected(self, Y):
-        return self.mlp.apply(Y).clip(sigmoid_frindge, 1. - sigmoid_frindge)
+        if is_sparse(Y):
+            return self._apply_first(Y, theano.sparse.dot).clip(sigmoid_frindge, 1. - sigmoid_frindge)
 
-    @application(inputs=['Y'], outputs=['X', 'log_prob'])
-    def sample(self, Y):
+        apply = self._apply_binary if self.binary_input else self.mlp.apply
+        if self.dedup:
+            index, inverse = unique_rows(Y)
+            prob_X = apply(Y[index])[inverse]
+        else:
+            prob_X = apply(Y)
+        return prob_X.clip(sigmoid_frindge, 1. - sigmoid_frindge)
+
+    def _apply_binary(self, Y):
+        """ self.mlp.apply(Y) with the first Linear computed as a sum of selected weight rows """
+        return self._apply_first(Y, binary_dot)
+
+    def _apply_first(self, Y, dot):
+        """ self.mlp.apply(Y) with the first Linear computed by dot(Y, W) """
+        H = Y
+        for i, (linear, activation) in enumerate(zip(self.mlp.linear_transformations, self.mlp.activations)):
+            if i == 0:
+                H = dot(H, linear.W)
+                if linear.use_bias:
+                    H = H + linear.b
+            else:
+                H = linear.apply(H)
+            if activation is not None:
+                H = activation.apply(H)
+        return H
+
+    def _replicated_expected(self, Y, n_samples):
+        """ sample_expected(Y) with every row repeated *n_samples* times (example-major) """
         prob_X = self.sample_expected(Y)
-        X = bernoulli(prob_X, rng=self.theano_rng, nstreams=N_STREAMS)
-        return X, self.log_prob(X, Y)
+        if n_samples is not None:
+            prob_X = prob_X.repeat(n_samples, axis=0)
+        return prob_X
+
+    @application(inputs=['Y'], outputs=['X', 'log_prob'])
+    def sample(self, Y, noise=None, n_samples=None):
+        """Sample X ~ P(X|Y).
+
+        With *n_samples*, n_samples rows are drawn for every row of Y (in the
+        order of replicate_batch) while the MLP is evaluated once per row of Y.
+        """
+        prob_X = self._replicated_expected(Y, n_samples)
+        X = bernoulli(prob_X, rng=self.theano_rng, nstreams=N_STREAMS, noise=noise)
+        return X, self._log_prob(X, prob_X)
 
     @application(inputs=['X', 'Y'], outputs=['log_prob'])
-    def log_prob(self, X, Y):
+    def log_prob(self, X, Y, n_samples=None, per_example='Y'):
+        """log P(X|Y).
+
+        With *n_samples*, the argument named by *per_example* ('X' or 'Y')
+        holds one row per example and the other one n_samples rows per
+        example; the result has n_samples rows per example. A per-example X
+        is broadcast against the probabilities instead of being replicated.
+        """
+        if n_samples is None or per_example == 'Y':
+            return self._log_prob(X, self._replicated_expected(Y, n_samples))
+
         prob_X = self.sample_expected(Y)
+        if is_sparse(X):
+            # Replicating a sparse X only copies its non-zeros
+            return self._log_prob(sparse_replicate_rows(X, n_samples), prob_X)
+
+        prob_X = prob_X.reshape((X.shape[0], n_samples, prob_X.shape[1]))
+        X = X.dimshuffle(0, 'x', 1)
+        log_prob = (X * tensor.log(prob_X) + (1. - X) * tensor.log(1 - prob_X)).sum(axis=2)
+        return log_prob.reshape((log_prob.shape[0] * n_samples,))
+
+    def _log_prob(self, X, prob_X):
+        if is_sparse(X):
+            # sum log(1-p) + sum_{X=1} log(p/(1-p)); the second sum only visits the non-zeros of X
+            log_1mp = tensor.log(1 - prob_X)
+            return log_1mp.sum(axis=1) + sparse_rowwise_dot(X, tensor.log(prob_X) - log_1mp)
         log_prob = X * tensor.log(prob_X) + (1. - X) * tensor.log(1 - prob_X)
         return log_prob.sum(axis=1)
 
@@ -332,8 +402,13 @@ class GaussianLayer(Initializable, ProbabilisticLayer):
         return mean, log_sigma
 
     @application(inputs=['Y'], outputs=['X', 'log_prob'])
-    def sample(self, Y):
-        mean, log_sigma = self.sample_expected(Y)
+    def sample(self, Y, n_samples=None):
+        """Sample X ~ P(X|Y).
+
+        With *n_samples*, n_samples rows are drawn for every row of Y (in the
+        order of replicate_batch) while the MLP is evaluated once per row of Y.
+        """
+        mean, log_sigma = self._replicated_expected(Y, n_samples)
 
         # Sample from mean-zeros std.-one Gaussian
         U = self.theano_rng.normal(
@@ -342,12 +417,23 @@ class GaussianLayer(Initializable, ProbabilisticLayer):
         # ... and scale/translate samples
         X = mean + tensor.exp(log_sigma) * U
 
-        return X, self.log_prob(X, Y)
+        return X, self._log_prob(X, mean, log_sigma)
 
     @application(inputs=['X', 'Y'], outputs=['log_prob'])
-    def log_prob(self, X, Y):
+    def log_prob(self, X, Y, n_samples=None):
+        """ log P(X|Y); with *n_samples*, Y holds one row per example and X n_samples rows per example """
+        mean, log_sigma = self._replicated_expected(Y, n_samples)
+        return self._log_prob(X, mean, log_sigma)
+
+    def _replicated_expected(self, Y, n_samples):
+        """ sample_expected(Y) with every row repeated *n_samples* times (example-major) """
         mean, log_sigma = self.sample_expected(Y)
+        if n_samples is not None:
+            mean = mean.repeat(n_samples, axis=0)
+            log_sigma = log_sigma.repeat(n_samples, axis=0)
+        return mean, log_sigma
 
+    def _log_prob(self, X, mean, log_sigma):
         # Calculate multivariate diagonal Gaussian
         log_prob = -0.5 * tensor.log(2 * numpy.pi) - log_sigma - \
             0.5 * (X - mean) ** 2 / tensor.exp(2 * log_sigma)
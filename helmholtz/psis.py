@@ -0,0 +1,152 @@
+
+from __future__ import division, print_function
+
+import logging
+
+import numpy
+import theano
+
+from theano import tensor
+from theano.gradient import grad_undefined
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------
+# Pareto smoothed importance sampling (PSIS)
+#
+# Vehtari, Gelman & Gabry: "Pareto smoothed importance sampling". The
+# largest importance weights of every example are replaced by the expected
+# order statistics of a generalized Pareto distribution fitted to them; the
+# fitted shape parameter k_hat diagnoses how heavy the weight tail is
+# (k_hat < 0.5: reliable, 0.5 - 0.7: slow convergence, > 0.7: unreliable).
+
+k_min = 1. / 3
+
+
+def gpd_fit(x):
+    """Fit a generalized Pareto distribution to the sorted exceedances *x*.
+
+    Uses the empirical Bayes estimate of Zhang & Stephens (2009) with the
+    weakly informative prior on k used for PSIS.
+
+    Returns
+    -------
+    k, sigma : float
+        Shape and scale parameter.
+    """
+    n = len(x)
+    m = 30 + int(numpy.sqrt(n))
+
+    bs = 1. - numpy.sqrt(m / (numpy.arange(1, m + 1) - 0.5))
+    bs /= 3. * x[int(n / 4 + 0.5) - 1]
+    bs += 1. / x[-1]
+
+    ks = numpy.mean(numpy.log1p(-bs[:, None] * x), axis=1)
+    L = n * (numpy.log(-bs / ks) - ks - 1.)
+    w = 1. / numpy.sum(numpy.exp(L[None, :] - L[:, None]), axis=1)
+
+    # Drop negligible weights
+    keep = w >= 10 * numpy.finfo(float).eps
+    w, bs = w[keep], bs[keep]
+    w /= w.sum()
+
+    b = numpy.sum(bs * w)
+    k = numpy.mean(numpy.log1p(-b * x))
+    sigma = -k / b
+
+    # Weakly informative prior for k
+    a = 10
+    k = k * n / (n + a) + a * 0.5 / (n + a)
+    return k, sigma
+
+
+def gpd_inverse(p, k, sigma):
+    """ Quantile function of the generalized Pareto distribution """
+    if numpy.abs(k) < numpy.finfo(float).eps:
+        return -sigma * numpy.log1p(-p)
+    return sigma * numpy.expm1(-k * numpy.log1p(-p)) / k
+
+
+def pareto_smooth_1d(log_w):
+    """Pareto smooth the log-weights of a single example.
+
+    Returns
+    -------
+    log_w : ndarray
+        Smoothed (unnormalized) log-weights
+    k_hat : float
+        Fitted tail shape; inf if the tail was too short for a fit.
+    """
+    n = len(log_w)
+    log_w_max = numpy.max(log_w)
+    x = numpy.asarray(log_w, dtype=numpy.float64) - log_w_max
+
+    tail_len = int(numpy.ceil(min(0.2 * n, 3 * numpy.sqrt(n))))
+    order = numpy.argsort(x)
+    cutoff = max(x[order[-tail_len - 1]], numpy.log(numpy.finfo(float).tiny)) if tail_len < n else -numpy.inf
+
+    tail = order[x[order] > cutoff]
+    if len(tail) <= 4:
+        return x + log_w_max, numpy.inf
+
+    exp_cutoff = numpy.exp(cutoff)
+    k, sigma = gpd_fit(numpy.exp(x[tail]) - exp_cutoff)
+
+    if k >= k_min and numpy.isfinite(k):
+        p = numpy.arange(0.5, len(tail)) / len(tail)
+        x[tail] = numpy.minimum(numpy.log(gpd_inverse(p, k, sigma) + exp_cutoff), 0.)
+
+    return x + log_w_max, k
+
+
+def pareto_smooth(log_w):
+    """Pareto smooth the log-weights of every example.
+
+    Parameters
+    ----------
+    log_w : ndarray
+        Unnormalized log importance weights with shape (n_examples, n_samples)
+
+    Returns
+    -------
+    log_w : ndarray
+        Smoothed log-weights with the same shape
+    k_hat : ndarray
+        Fitted tail shape for every example
+    """
+    log_w = numpy.asarray(log_w)
+
+    smoothed = numpy.empty_like(log_w)
+    k_hat = numpy.empty(log_w.shape[0], dtype=log_w.dtype)
+    for i, lw in enumerate(log_w):
+        smoothed[i], k_hat[i] = pareto_smooth_1d(lw)
+    return smoothed, k_hat
+
+#-----------------------------------------------------------------------------
+
+
+class ParetoSmoothOp(theano.Op):
+    """ Pareto smoothing of a (n_examples, n_samples) matrix of log-weights.
+
+    Outputs the smoothed log-weights and k_hat for every example. Like the
+    raw importance weights, the result has to be treated as a constant when
+    differentiating (consider_constant).
+    """
+    __props__ = ()
+
+    def make_node(self, log_w):
+        log_w = tensor.as_tensor_variable(log_w)
+        return theano.Apply(self, [log_w], [log_w.type(), tensor.vector(dtype=log_w.dtype)])
+
+    def perform(self, node, inputs, output_storage):
+        smoothed, k_hat = pareto_smooth(inputs[0])
+        output_storage[0][0] = smoothed
+        output_storage[1][0] = k_hat
+
+    def infer_shape(self, node, shapes):
+        return [shapes[0], shapes[0][:1]]
+
+    def grad(self, inputs, grads):
+        return [grad_undefined(self, 0, inputs[0])]
+
+pareto_smooth_op = ParetoSmoothOp()
@@ -16,7 +16,10 @@ from blocks.bricks.base import application, Brick, lazy
 from blocks.select import Selector
 
 from . import HelmholtzMachine
-from . import flatten_values, unflatten_values, merge_gradients, replicate_batch, logsumexp
+from . import flatten_values, unflatten_values, merge_gradients, replicate_batch, logsumexp, logsumexp_weights
+from . import leave_one_out_baseline, weight_statistics
+from .psis import pareto_smooth_op
+from . import scan_layers
 
 logger = logging.getLogger(__name__)
 floatX = theano.config.floatX
@@ -25,33 +28,51 @@ floatX = theano.config.floatX
 
 
 class ReweightedWakeSleep(HelmholtzMachine):
+    loo_baseline = False
+    psis = False
 
-    def __init__(self, p_layers, q_layers, qbaseline=True, **kwargs):
+    def __init__(self, p_layers, q_layers, qbaseline=True, loo_baseline=False, sampling='iid',
+                 psis=False, scan_layers=False, **kwargs):
         super(ReweightedWakeSleep, self).__init__(p_layers, q_layers, **kwargs)
 
+        # With correlated samples the leave-one-out baseline of sample k
+        # depends on sample k itself and the q-gradient would be biased
+        if loo_baseline and sampling != 'iid':
+            raise ValueError("Leave-one-out baselines require iid samples (sampling='%s')" % sampling)
+
         self.qbaseline = qbaseline
+        self.loo_baseline = loo_baseline
+        self.sampling = sampling
+        self.psis = psis
+        self.scan_layers = scan_layers
 
-    def log_prob_p(self, samples):
+    def log_prob_p(self, samples, n_samples=None):
         """Calculate p(h_l | h_{l+1}) for all layers. """
+        if self.scan_layers:
+            return scan_layers.log_prob_p(self, samples, n_samples)
+
         n_layers = len(self.p_layers)
-        n_samples = samples[0].shape[0]
 
         log_p = [None] * n_layers
         for l in xrange(n_layers - 1):
-            log_p[l] = self.p_layers[l].log_prob(samples[l], samples[l + 1])
+            kwargs = scan_layers.first_layer_kwargs('p', n_samples) if l == 0 else {}
+            log_p[l] = self.p_layers[l].log_prob(samples[l], samples[l + 1], **kwargs)
         log_p[n_layers - 1] = self.p_layers[n_layers - 1].log_prob(samples[n_layers - 1])
 
         return log_p
 
-    def log_prob_q(self, samples):
+    def log_prob_q(self, samples, n_samples=None):
         """Calculate q(h_{l+1} | h_l) for all layers *but the first one*. """
+        if self.scan_layers:
+            return scan_layers.log_prob_q(self, samples, n_samples)
+
         n_layers = len(self.p_layers)
-        n_samples = samples[0].shape[0]
 
         log_q = [None] * n_layers
-        log_q[0] = tensor.zeros([n_samples])
+        log_q[0] = tensor.zeros([samples[1].shape[0]])
         for l in xrange(n_layers - 1):
-            log_q[l + 1] = self.q_layers[l].log_prob(samples[l + 1], samples[l])
+            kwargs = scan_layers.first_layer_kwargs('q', n_samples) if l == 0 else {}
+            log_q[l + 1] = self.q_layers[l].log_prob(samples[l + 1], samples[l], **kwargs)
 
         return log_q
 
@@ -59,6 +80,9 @@ class ReweightedWakeSleep(HelmholtzMachine):
     def sample_p(self, n_samples):
         """Samples form the prior.
         """
+        if self.scan_layers:
+            return scan_layers.sample_p(self, n_samples)
+
         p_layers = self.p_layers
         q_layers = self.q_layers
         n_layers = len(p_layers)
@@ -76,12 +100,19 @@ class ReweightedWakeSleep(HelmholtzMachine):
         return samples, log_p, log_q
 
     @application(inputs=['features'], outputs=['samples', 'log_p', 'log_q'])
-    def sample_q(self, features):
+    def sample_q(self, features, noise=None, n_samples=None):
         """Sample from q(h|x).
 
         Parameters
         ----------
         features : Tensor
+        noise : list or None
+            Uniform noise for each q-layer (see proposal_noise)
+        n_samples : int or None
+            If given, draw n_samples samples for every row of *features*;
+            the bottom q-layer is then evaluated only once per example and
+            samples[0] is *features* itself, which is broadcast instead of
+            replicated when p_layers[0] scores it.
 
         Returns
         -------
@@ -89,26 +120,35 @@ class ReweightedWakeSleep(HelmholtzMachine):
         log_p : list
         log_q : list
         """
+        if self.scan_layers:
+            return scan_layers.sample_q(self, features, noise, n_samples)
+
         p_layers = self.p_layers
         q_layers = self.q_layers
         n_layers = len(p_layers)
 
-        batch_size = features.shape[0]
-
         samples = [None] * n_layers
         log_p = [None] * n_layers
         log_q = [None] * n_layers
 
         # Generate samples (feed-forward)
         samples[0] = features
-        log_q[0] = tensor.zeros([batch_size])
+        log_q[0] = tensor.zeros([features.shape[0] if n_samples is None else features.shape[0] * n_samples])
         for l in xrange(n_layers - 1):
-            samples[l + 1], log_q[l + 1] = q_layers[l].sample(samples[l])
+            kwargs = {} if noise is None else {'noise': noise[l]}
+            if l == 0 and n_samples is not None:
+                samples[1], log_q[1] = q_layers[0].sample(features, n_samples=n_samples, **kwargs)
+            else:
+                samples[l + 1], log_q[l + 1] = q_layers[l].sample(samples[l], **kwargs)
 
         # get log-probs from generative model
         log_p[n_layers - 1] = p_layers[n_layers - 1].log_prob(samples[n_layers - 1])
-        for l in reversed(range(1, n_layers)):
+        for l in reversed(range(2, n_layers)):
             log_p[l - 1] = p_layers[l - 1].log_prob(samples[l - 1], samples[l])
+        if n_samples is None:
+            log_p[0] = p_layers[0].log_prob(samples[0], samples[1])
+        else:
+            log_p[0] = p_layers[0].log_prob(features, samples[1], n_samples=n_samples, per_example='X')
 
         return samples, log_p, log_q
 
@@ -126,25 +166,25 @@ class ReweightedWakeSleep(HelmholtzMachine):
 
         # Calculate sampling weights
         log_pq = (log_p_all - log_q_all)
-        w_norm = logsumexp(log_pq, axis=1)
-        log_w = log_pq - tensor.shape_padright(w_norm)
-        w = tensor.exp(log_w)
+        if self.psis:
+            log_pq, self.psis_k = pareto_smooth_op(log_pq)
+        _, w = logsumexp_weights(log_pq, axis=1)
 
         return w
 
     @application(inputs=['features', 'n_samples'], outputs=['log_px', 'log_psx'])
-    def log_likelihood(self, features, n_samples):
+    def log_likelihood(self, features, n_samples, noise=None):
         p_layers = self.p_layers
         q_layers = self.q_layers
         n_layers = len(p_layers)
 
         batch_size = features.shape[0]
 
-        x = replicate_batch(features, n_samples)
-        samples, log_p, log_q = self.sample_q(x)
+        if noise is None:
+            noise = self.proposal_noise(batch_size, n_samples)
+        samples, log_p, log_q = self.sample_q(features, noise, n_samples)
 
         # Reshape and sum
-        samples = unflatten_values(samples, batch_size, n_samples)
         log_p = unflatten_values(log_p, batch_size, n_samples)
         log_q = unflatten_values(log_q, batch_size, n_samples)
 
@@ -172,13 +212,10 @@ class ReweightedWakeSleep(HelmholtzMachine):
 
         batch_size = features.shape[0]
 
-        x = replicate_batch(features, n_samples)
-
         # Get Q-samples
-        samples, log_p, log_q = self.sample_q(x)
+        samples, log_p, log_q = self.sample_q(features, self.proposal_noise(batch_size, n_samples), n_samples)
 
         # Reshape and sum
-        samples = unflatten_values(samples, batch_size, n_samples)
         log_p = unflatten_values(log_p, batch_size, n_samples)
         log_q = unflatten_values(log_q, batch_size, n_samples)
 
@@ -190,31 +227,42 @@ class ReweightedWakeSleep(HelmholtzMachine):
 
         # Approximate log p(x) and calculate IS weights
         w = self.importance_weights(log_p, log_q)
+        self.ess, self.max_weight, self.weight_entropy = weight_statistics(w)
 
         qbaseline = 0.
-        if self.qbaseline:
+        if self.loo_baseline:
+            qbaseline = leave_one_out_baseline(log_p_all - log_q_all)
+            qbaseline = qbaseline.reshape((batch_size * n_samples, ))
+        elif self.qbaseline:
             qbaseline = 1. / n_samples
 
-        samples = flatten_values(samples, batch_size * n_samples)
         wp = w.reshape((batch_size * n_samples, ))
         wq = w.reshape((batch_size * n_samples, )) - qbaseline
 
         gradients = OrderedDict()
-        for l in xrange(n_layers - 1):
-            gradients = merge_gradients(gradients, p_layers[l].get_gradients(samples[l], samples[l + 1], weights=wp))
-            gradients = merge_gradients(
-                gradients,
-                q_layers[l].get_gradients(
-                    samples[
-                        l + 1],
-                    samples[l],
-                    weights=wq),
-                0.5)
+        if self.scan_layers:
+            gradients = merge_gradients(gradients, scan_layers.conditional_gradients(self, 'p', samples, wp, n_samples))
+            gradients = merge_gradients(gradients, scan_layers.conditional_gradients(self, 'q', samples, wq, n_samples), 0.5)
+        else:
+            for l in xrange(n_layers - 1):
+                if l == 0:
+                    # samples[0] are the features, one row per example
+                    p_gradients = p_layers[0].get_gradients(samples[0], samples[1], weights=wp,
+                                                            n_samples=n_samples, per_example='X')
+                    q_gradients = q_layers[0].get_gradients(samples[1], samples[0], weights=wq, n_samples=n_samples)
+                else:
+                    p_gradients = p_layers[l].get_gradients(samples[l], samples[l + 1], weights=wp)
+                    q_gradients = q_layers[l].get_gradients(samples[l + 1], samples[l], weights=wq)
+                gradients = merge_gradients(gradients, p_gradients)
+                gradients = merge_gradients(gradients, q_gradients, 0.5)
         gradients = merge_gradients(gradients, p_layers[-1].get_gradients(samples[-1], weights=wp))
 
         # Now sleep phase..
         samples, log_p, log_q = self.sample_p(batch_size)
-        for l in xrange(n_layers - 1):
-            gradients = merge_gradients(gradients, q_layers[l].get_gradients(samples[l + 1], samples[l]), 0.5)
+        if self.scan_layers:
+            gradients = merge_gradients(gradients, scan_layers.conditional_gradients(self, 'q', samples), 0.5)
+        else:
+            for l in xrange(n_layers - 1):
+                gradients = merge_gradients(gradients, q_layers[l].get_gradients(samples[l + 1], samples[l]), 0.5)
 
         return log_px, log_px, gradients
@@ -0,0 +1,229 @@
+
+from __future__ import division, print_function
+
+import os
+import json
+import logging
+
+import numpy
+
+from numpy.lib.format import open_memmap
+
+from .evaluation import log_mean_exp, estimate_log_px, estimate_log_psx, effective_sample_size
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------
+
+
+class SampleStore(object):
+    """On-disk store of posterior samples and their log-probabilities.
+
+    A store is a directory with memory mapped .npy files:
+
+        meta.json     -- n_examples, n_samples, layer_dims, ...
+        log_p.npy     -- float32 (n_examples, n_samples, n_layers)
+        log_q.npy     -- float32 (n_examples, n_samples, n_layers)
+        samples%d.npy -- bit-packed uint8 (n_examples, n_samples, ceil(dim/8))
+                         for each hidden layer (optional)
+
+    The store is written chunk by chunk (see `write`) and all reductions
+    iterate over chunks of *chunk_size* examples, so neither writing nor
+    reading requires the whole store in memory.
+
+    Parameters
+    ----------
+    dirname : str
+        Directory containing the store.
+    mode : str
+        'r' to open read-only, 'r+' for writing into an existing store.
+    """
+    def __init__(self, dirname, mode='r'):
+        self.dirname = dirname
+
+        with open(os.path.join(dirname, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+
+        self.n_examples = self.meta['n_examples']
+        self.n_samples = self.meta['n_samples']
+        self.layer_dims = self.meta['layer_dims']
+        self.n_layers = len(self.layer_dims)
+        self.chunk_size = self.meta['chunk_size']
+
+        self.log_p = open_memmap(os.path.join(dirname, "log_p.npy"), mode=mode)
+        self.log_q = open_memmap(os.path.join(dirname, "log_q.npy"), mode=mode)
+
+        self.packed_samples = None
+        if self.meta['store_samples']:
+            self.packed_samples = [
+                open_memmap(os.path.join(dirname, "samples%d.npy" % l), mode=mode)
+                for l in xrange(1, self.n_layers)]
+
+    @classmethod
+    def create(cls, dirname, n_examples, n_samples, layer_dims,
+               store_samples=False, chunk_size=100, **meta):
+        """Create a new, empty store.
+
+        Parameters
+        ----------
+        layer_dims : list
+            Dimensionality of every layer; layer_dims[0] is the data dimension.
+        store_samples : bool
+            Also store the bit-packed hidden layer samples.
+        meta :
+            Additional entries for meta.json (e.g. the model file name).
+        """
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        n_layers = len(layer_dims)
+        meta.update({
+            'n_examples': n_examples,
+            'n_samples': n_samples,
+            'layer_dims': list(layer_dims),
+            'store_samples': store_samples,
+            'chunk_size': chunk_size,
+        })
+        with open(os.path.join(dirname, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        shape = (n_examples, n_samples, n_layers)
+        for name in ("log_p", "log_q"):
+            open_memmap(os.path.join(dirname, name + ".npy"), mode='w+',
+                        dtype=numpy.float32, shape=shape)
+
+        if store_samples:
+            for l in xrange(1, n_layers):
+                n_bytes = (layer_dims[l] + 7) // 8
+                open_memmap(os.path.join(dirname, "samples%d.npy" % l), mode='w+',
+                            dtype=numpy.uint8, shape=(n_examples, n_samples, n_bytes))
+
+        return cls(dirname, mode='r+')
+
+    def write(self, start, log_p, log_q, samples=None):
+        """Write the results for examples start, start+1, ...
+
+        Parameters
+        ----------
+        start : int
+            Index of the first example in this chunk.
+        log_p, log_q : list
+            Per-layer arrays with shape (batch_size, n_samples)
+        samples : list or None
+            Per-layer samples with shape (batch_size, n_samples, dim);
+            samples[0] (the data) is not stored.
+        """
+        stop = start + log_p[0].shape[0]
+
+        self.log_p[start:stop] = numpy.dstack(log_p)
+        self.log_q[start:stop] = numpy.dstack(log_q)
+
+        if self.packed_samples is not None and samples is not None:
+            for packed, s in zip(self.packed_samples, samples[1:]):
+                packed[start:stop] = numpy.packbits(s.astype(numpy.uint8), axis=-1)
+
+    def save_meta(self):
+        """ Rewrite meta.json after changing entries in *self.meta* """
+        with open(os.path.join(self.dirname, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def flush(self):
+        self.log_p.flush()
+        self.log_q.flush()
+        if self.packed_samples is not None:
+            for packed in self.packed_samples:
+                packed.flush()
+
+    #-------------------------------------------------------------------------
+    # Access
+
+    def chunks(self, n_samples=None):
+        """Iterate over (log_p, log_q) chunks summed over all layers.
+
+        Each yielded array has shape (chunk_size, n_samples).
+        """
+        if n_samples is None:
+            n_samples = self.n_samples
+        assert n_samples <= self.n_samples
+
+        for start in xrange(0, self.n_examples, self.chunk_size):
+            stop = min(start + self.chunk_size, self.n_examples)
+            log_p = numpy.asarray(self.log_p[start:stop, :n_samples], dtype=numpy.float64)
+            log_q = numpy.asarray(self.log_q[start:stop, :n_samples], dtype=numpy.float64)
+            yield log_p.sum(axis=-1), log_q.sum(axis=-1)
+
+    def layer_chunks(self):
+        """ Iterate over per-layer (log_p, log_q) chunks with shape (chunk_size, n_samples, n_layers) """
+        for start in xrange(0, self.n_examples, self.chunk_size):
+            stop = min(start + self.chunk_size, self.n_examples)
+            yield (numpy.asarray(self.log_p[start:stop], dtype=numpy.float64),
+                   numpy.asarray(self.log_q[start:stop], dtype=numpy.float64))
+
+    def samples(self, layer, start=0, stop=None):
+        """ Unpack the stored samples of hidden *layer* for examples start..stop """
+        if self.packed_samples is None:
+            raise ValueError("Store %s does not contain samples" % self.dirname)
+        packed = self.packed_samples[layer - 1][start:stop]
+        return numpy.unpackbits(packed, axis=-1)[..., :self.layer_dims[layer]]
+
+    #-------------------------------------------------------------------------
+    # Reductions
+
+    def log_px(self, n_samples=None):
+        """Per-example log p(x) estimates using *n_samples* samples each.
+
+        With n_samples < K_max, the estimate is averaged over the
+        K_max // n_samples disjoint groups of samples.
+        """
+        return self._grouped(estimate_log_px, n_samples)
+
+    def log_psx(self, n_samples=None):
+        """ Per-example (unnormalized) BiHM log p*(x) estimates """
+        return self._grouped(estimate_log_psx, n_samples)
+
+    def _grouped(self, estimator, n_samples):
+        if n_samples is None:
+            n_samples = self.n_samples
+        n_groups = self.n_samples // n_samples
+
+        results = []
+        for log_p, log_q in self.chunks(n_groups * n_samples):
+            shape = (log_p.shape[0], n_groups, n_samples)
+            est = estimator(log_p.reshape(shape), log_q.reshape(shape))
+            results.append(est.mean(axis=-1))
+        return numpy.concatenate(results)
+
+    def kl(self):
+        """ Per-example KL(q|p) estimates """
+        results = []
+        for log_p, log_q in self.chunks():
+            results.append(numpy.mean(log_q - log_p, axis=-1) + estimate_log_px(log_p, log_q))
+        return numpy.concatenate(results)
+
+    def layer_kl(self):
+        """ Per-layer, per-example KL terms; shape (n_layers, n_examples) """
+        results = []
+        for log_p, log_q in self.layer_chunks():
+            results.append(numpy.mean(log_q - log_p, axis=1).T)
+        return numpy.concatenate(results, axis=1)
+
+    def ess(self, sqrt_weights=False):
+        """Per-example effective sample size (as a fraction of n_samples).
+
+        With *sqrt_weights* the ESS of the BiHM p* weights is returned.
+        """
+        scale = 0.5 if sqrt_weights else 1.
+        results = []
+        for log_p, log_q in self.chunks():
+            results.append(effective_sample_size(scale * (log_p - log_q)))
+        return numpy.concatenate(results)
+
+    def weight_histogram(self, bins=100, range=(-20, 0)):
+        """ Histogram of the normalized log importance weights log(w_k) """
+        counts = numpy.zeros(bins)
+        for log_p, log_q in self.chunks():
+            log_w = log_p - log_q
+            log_w = log_w - log_mean_exp(log_w)[:, None] - numpy.log(log_w.shape[-1])
+            c, edges = numpy.histogram(log_w, bins=bins, range=range)
+            counts += c
+        return counts, edges
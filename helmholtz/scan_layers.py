@@ -0,0 +1,307 @@
+
+from __future__ import division, print_function
+
+import logging
+
+import theano
+
+from collections import OrderedDict
+from theano import tensor
+
+from blocks.bricks import Logistic, MLP
+
+from .prob_layers import BernoulliLayer, sigmoid_frindge, N_STREAMS
+
+logger = logging.getLogger(__name__)
+floatX = theano.config.floatX
+
+#-----------------------------------------------------------------------------
+# Scan over homogeneous stretches of the layer stack
+#
+# Layer l connects h_l and h_{l+1} through p_layers[l] and q_layers[l]. A
+# stretch is a run of at least two consecutive connections between layers
+# of equal width where all p- and q-layers are single Linear+Logistic
+# BernoulliLayers. The weights of such a stretch are stacked into
+# (n, width, width) tensors and processed by one theano.scan, so the size of
+# the graph (and of its gradient) no longer grows with the depth of the
+# stretch. All other layers are processed one by one as usual.
+
+
+def is_scannable(layer):
+    """ Single Linear+Logistic BernoulliLayer with equal input and output width """
+    return (isinstance(layer, BernoulliLayer) and not layer.dedup and not layer.binary_input
+            and type(layer.mlp) is MLP
+            and layer.dim_X == layer.dim_Y
+            and len(layer.mlp.linear_transformations) == 1
+            and isinstance(layer.mlp.activations[0], Logistic))
+
+
+def homogeneous_stretches(brick, min_length=2):
+    """ List of (start, stop) ranges of connections that can be scanned """
+    n_connections = len(brick.p_layers) - 1
+    scannable = [is_scannable(brick.p_layers[l]) and is_scannable(brick.q_layers[l])
+                 for l in xrange(n_connections)]
+
+    stretches = []
+    l = 0
+    while l < n_connections:
+        stop = l
+        while stop < n_connections and scannable[stop]:
+            stop += 1
+        if stop - l >= min_length:
+            stretches.append((l, stop))
+        l = max(stop, l + 1)
+    return stretches
+
+
+def stack_parameters(layers):
+    """ Stacked weights (n, dim_Y, dim_X) and biases (n, dim_X) of single Linear layers """
+    linears = [layer.mlp.linear_transformations[0] for layer in layers]
+    return tensor.stack([lin.W for lin in linears]), tensor.stack([lin.b for lin in linears])
+
+
+def _prob(W, b, Y):
+    return tensor.nnet.sigmoid(tensor.dot(Y, W) + b).clip(sigmoid_frindge, 1. - sigmoid_frindge)
+
+
+def _log_prob(X, prob):
+    return (X * tensor.log(prob) + (1. - X) * tensor.log(1. - prob)).sum(axis=1)
+
+
+def scan_sample(layers, Y, noise):
+    """Sample through a chain of layers, each conditioned on the previous sample.
+
+    Parameters
+    ----------
+    layers : list
+        Scannable layers in the order of application
+    Y : T.matrix
+        Input of the first layer
+    noise : T.tensor3
+        Uniform noise with shape (len(layers), n_rows, width)
+
+    Returns
+    -------
+    X : T.tensor3
+        Samples of all layers (len(layers), n_rows, width)
+    log_prob : T.matrix
+        (len(layers), n_rows)
+    """
+    W, b = stack_parameters(layers)
+
+    def step(W, b, u, Y):
+        prob = _prob(W, b, Y)
+        X = tensor.cast(u < prob, floatX)
+        return X, _log_prob(X, prob)
+
+    (X, log_prob), _ = theano.scan(step, sequences=[W, b, noise], outputs_info=[Y, None])
+    return X, log_prob
+
+
+def scan_log_prob(layers, X, Y):
+    """ log P_l(X_l | Y_l) for all layers of a stretch; X and Y are (len(layers), n_rows, width) """
+    W, b = stack_parameters(layers)
+
+    def step(W, b, X, Y):
+        return _log_prob(X, _prob(W, b, Y))
+
+    log_prob, _ = theano.scan(step, sequences=[W, b, X, Y])
+    return log_prob
+
+
+def stretch_noise(brick, noise, layers, n_rows):
+    if noise is not None:
+        return tensor.stack(noise)
+    width = layers[0].dim_X
+    return brick.theano_rng.uniform(size=(len(layers), n_rows, width), nstreams=N_STREAMS).astype(floatX)
+
+#-----------------------------------------------------------------------------
+# Drop-in replacements for the layer loops of ReweightedWakeSleep and BiHM
+
+
+def stretch_starts(brick, n_samples=None):
+    """{start: stop} of the stretches to scan.
+
+    With *n_samples*, samples[0] has one row per example and the bottom
+    connection is left to the per-example layer code instead of being
+    scanned with replicated features.
+    """
+    starts = {}
+    for start, stop in homogeneous_stretches(brick):
+        if start == 0 and n_samples is not None:
+            start = 1
+        if stop - start >= 2:
+            starts[start] = stop
+    return starts
+
+
+def first_layer_kwargs(which, n_samples):
+    """ Arguments for the p- or q-layer touching a per-example samples[0] """
+    if n_samples is None:
+        return {}
+    if which == 'p':
+        return {'n_samples': n_samples, 'per_example': 'X'}
+    return {'n_samples': n_samples}
+
+
+def log_prob_p(brick, samples, n_samples=None):
+    """log p(h_l | h_{l+1}) for all layers (see ReweightedWakeSleep.log_prob_p)
+
+    With *n_samples*, samples[0] has one row per example (see
+    ReweightedWakeSleep.sample_q).
+    """
+    p_layers = brick.p_layers
+    n_layers = len(p_layers)
+    starts = stretch_starts(brick, n_samples)
+
+    log_p = [None] * n_layers
+    l = 0
+    while l < n_layers - 1:
+        if l in starts:
+            stop = starts[l]
+            lp = scan_log_prob(p_layers[l:stop], tensor.stack(samples[l:stop]),
+                               tensor.stack(samples[l + 1:stop + 1]))
+            for i in xrange(stop - l):
+                log_p[l + i] = lp[i]
+            l = stop
+        else:
+            kwargs = first_layer_kwargs('p', n_samples) if l == 0 else {}
+            log_p[l] = p_layers[l].log_prob(samples[l], samples[l + 1], **kwargs)
+            l += 1
+    log_p[n_layers - 1] = p_layers[n_layers - 1].log_prob(samples[n_layers - 1])
+    return log_p
+
+
+def log_prob_q(brick, samples, n_samples=None):
+    """ log q(h_{l+1} | h_l) for all layers but the first (see ReweightedWakeSleep.log_prob_q) """
+    q_layers = brick.q_layers
+    n_layers = len(brick.p_layers)
+    starts = stretch_starts(brick, n_samples)
+
+    log_q = [None] * n_layers
+    log_q[0] = tensor.zeros([samples[1].shape[0]])
+    l = 0
+    while l < n_layers - 1:
+        if l in starts:
+            stop = starts[l]
+            lq = scan_log_prob(q_layers[l:stop], tensor.stack(samples[l + 1:stop + 1]),
+                               tensor.stack(samples[l:stop]))
+            for i in xrange(stop - l):
+                log_q[l + 1 + i] = lq[i]
+            l = stop
+        else:
+            kwargs = first_layer_kwargs('q', n_samples) if l == 0 else {}
+            log_q[l + 1] = q_layers[l].log_prob(samples[l + 1], samples[l], **kwargs)
+            l += 1
+    return log_q
+
+
+def sample_q(brick, features, noise=None, n_samples=None):
+    """ Sample from q(h|x) (see ReweightedWakeSleep.sample_q) """
+    q_layers = brick.q_layers
+    n_layers = len(brick.p_layers)
+    starts = stretch_starts(brick, n_samples)
+
+    samples = [None] * n_layers
+    log_q = [None] * n_layers
+
+    samples[0] = features
+    n_rows = features.shape[0] if n_samples is None else features.shape[0] * n_samples
+    log_q[0] = tensor.zeros([n_rows])
+    l = 0
+    while l < n_layers - 1:
+        if l in starts:
+            stop = starts[l]
+            u = stretch_noise(brick, None if noise is None else noise[l:stop],
+                              q_layers[l:stop], n_rows)
+            h, lq = scan_sample(q_layers[l:stop], samples[l], u)
+            for i in xrange(stop - l):
+                samples[l + 1 + i], log_q[l + 1 + i] = h[i], lq[i]
+            l = stop
+        else:
+            kwargs = {} if noise is None else {'noise': noise[l]}
+            if l == 0 and n_samples is not None:
+                samples[1], log_q[1] = q_layers[0].sample(features, n_samples=n_samples, **kwargs)
+            else:
+                samples[l + 1], log_q[l + 1] = q_layers[l].sample(samples[l], **kwargs)
+            l += 1
+
+    log_p = log_prob_p(brick, samples, n_samples)
+    return samples, log_p, log_q
+
+
+def sample_p(brick, n_samples):
+    """ Sample from the generative model (see ReweightedWakeSleep.sample_p) """
+    p_layers = brick.p_layers
+    n_layers = len(p_layers)
+    lasts = dict((stop - 1, start) for start, stop in homogeneous_stretches(brick))
+
+    samples = [None] * n_layers
+    log_p = [None] * n_layers
+
+    samples[n_layers - 1], log_p[n_layers - 1] = p_layers[n_layers - 1].sample(n_samples)
+    l = n_layers - 2
+    while l >= 0:
+        if l in lasts:
+            start = lasts[l]
+            layers = p_layers[start:l + 1][::-1]
+            u = stretch_noise(brick, None, layers, n_samples)
+            h, lp = scan_sample(layers, samples[l + 1], u)
+            for i in xrange(l + 1 - start):
+                samples[l - i], log_p[l - i] = h[i], lp[i]
+            l = start - 1
+        else:
+            samples[l], log_p[l] = p_layers[l].sample(samples[l + 1])
+            l -= 1
+
+    log_q = log_prob_q(brick, samples)
+    return samples, log_p, log_q
+
+
+def conditional_gradients(brick, which, samples, weights=1., n_samples=None):
+    """Gradients of -sum(weights * log P(.|.)) for all p- or q-layers but the top layer.
+
+    Every stretch contributes a single scan to the gradient graph; the
+    samples and weights are treated as constants.
+
+    Parameters
+    ----------
+    which : 'p' or 'q'
+    samples : list
+        Flattened samples of all layers
+    weights : T.vector or float
+    n_samples : int or None
+        Samples per example if samples[0] has one row per example
+    """
+    n_layers = len(brick.p_layers)
+    layers = brick.p_layers if which == 'p' else brick.q_layers
+    starts = stretch_starts(brick, n_samples)
+
+    def lower_upper(l, stop):
+        if which == 'p':
+            return samples[l:stop], samples[l + 1:stop + 1]
+        return samples[l + 1:stop + 1], samples[l:stop]
+
+    gradients = OrderedDict()
+    l = 0
+    while l < n_layers - 1:
+        if l in starts:
+            stop = starts[l]
+            X, Y = lower_upper(l, stop)
+            log_prob = scan_log_prob(layers[l:stop], tensor.stack(X), tensor.stack(Y))
+            cost = -(weights * log_prob).sum()
+
+            consider_constant = X + Y
+            if not isinstance(weights, float):
+                consider_constant.append(weights)
+
+            params = [p for layer in layers[l:stop] for p in layer.mlp.linear_transformations[0].parameters]
+            grads = tensor.grad(cost, params, consider_constant=consider_constant)
+            gradients.update(zip(params, grads))
+            l = stop
+        else:
+            X, Y = lower_upper(l, l + 1)
+            kwargs = first_layer_kwargs(which, n_samples) if l == 0 else {}
+            gradients.update(layers[l].get_gradients(X[0], Y[0], weights=weights, **kwargs))
+            l += 1
+    return gradients
@@ -16,7 +16,7 @@ from blocks.initialization import Uniform, IsotropicGaussian, Constant, Sparse,
 from blocks.roles import has_roles, WEIGHT, PARAMETER
 from blocks.select import Selector
 
-from . import HelmholtzMachine, replicate_batch, logsumexp
+from . import HelmholtzMachine, replicate_batch, logsumexp, logsumexp_weights
 from .batch_normalization import BatchNormalizedMLP
 from .prob_layers import GaussianLayer, BernoulliLayer
 from .initialization import RWSInitialization
@@ -78,10 +78,14 @@ class VAE(HelmholtzMachine, Random):
         return [x, z]
 
     @application(inputs=['features'], outputs=['samples', 'log_p', 'log_q'])
-    def sample_q(self, features):
-        """ Sample from the approx inference network Q """
-        z, log_q = self.q.sample(features)
-        log_p = self.p.log_prob(features, z)     # p(x|z)
+    def sample_q(self, features, n_samples=None):
+        """Sample from the approx inference network Q
+
+        With *n_samples*, n_samples latent samples are drawn for every
+        example; the features are broadcast against them, not replicated.
+        """
+        z, log_q = self.q.sample(features, n_samples=n_samples)
+        log_p = self.p.log_prob(features, z, n_samples=n_samples, per_example='X')     # p(x|z)
         log_p += tensor.sum(                     # p(z) prior
             -0.5 * tensor.log(2 * numpy.pi)
             - self.prior_log_sigma
@@ -99,9 +103,7 @@ class VAE(HelmholtzMachine, Random):
 
         # Calculate sampling weights
         log_pq = (log_p_all - log_q_all)
-        w_norm = logsumexp(log_pq, axis=1)
-        log_w = log_pq - tensor.shape_padright(w_norm)
-        w = tensor.exp(log_w)
+        _, w = logsumexp_weights(log_pq, axis=1)
 
         return w
 
@@ -109,8 +111,7 @@ class VAE(HelmholtzMachine, Random):
     def log_likelihood(self, features, n_samples):
         batch_size = features.shape[0]
 
-        x = replicate_batch(features, n_samples)
-        samples, log_p, log_q = self.sample_q(x)
+        samples, log_p, log_q = self.sample_q(features, n_samples)
         z = samples[0]
         log_p = log_p[0]
         log_q = log_q[0]
@@ -129,14 +130,13 @@ class VAE(HelmholtzMachine, Random):
         z_mu, z_log_sigma = self.q.sample_expected(features)
 
         # Recosntruction...
-        features_r = replicate_batch(features, n_samples)
         z_mu_r = replicate_batch(z_mu, n_samples)
         z_log_sigma_r = replicate_batch(z_log_sigma, n_samples)
 
         epsilon = self.theano_rng.normal(size=z_mu_r.shape, dtype=z_mu_r.dtype)
         z_r = z_mu_r + epsilon * tensor.exp(z_log_sigma_r)
 
-        recons_term = self.p.log_prob(features_r, z_r)
+        recons_term = self.p.log_prob(features, z_r, n_samples=n_samples, per_example='X')
         recons_term = recons_term.reshape([batch_size, n_samples])
         recons_term = tensor.sum(recons_term, axis=1) / n_samples
 
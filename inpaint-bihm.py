@@ -26,7 +26,7 @@ from progressbar import ProgressBar
 
 from blocks.main_loop import MainLoop
 
-from helmholtz import replicate_batch, logsumexp
+from helmholtz import replicate_batch, logsumexp_weights, logplusexp
 from helmholtz.bihm import BiHM
 from helmholtz.rws import ReweightedWakeSleep
 
@@ -42,12 +42,6 @@ theano_rng = RandomStreams(seed=234)
 
 #-----------------------------------------------------------------------------
 
-def logsumexp2(a, b):
-    """ Compute a numerically stable log(exp(a)+exp(b)) """
-    m = tensor.maximum(a, b)
-    return tensor.log(tensor.exp(a-m) + tensor.exp(b-m)) + m
-
-
 def subsample(weights, n_samples):
     """ Choose *nsamples* subsamples proportionally to *weights* """
     pvals = weights.dimshuffle('x', 0).repeat(n_samples, axis=0)
@@ -71,7 +65,7 @@ def sample_conditional(h_upper, h_lower, p_upper, p_lower, q_upper, q_lower, ove
     log_1ql = q_lower.log_prob(h1, h_lower)
 
     log_1ps = (log_1pu + log_1pl + log_1ql + log_1qu) / 2
-    log_1 = logsumexp2(log_1pu, log_1ql)
+    log_1 = logplusexp(log_1pu, log_1ql)
 
     h2, log_2ql = q_lower.sample(h_lower)
     log_2qu = q_upper.log_prob(h_upper, h2)
@@ -79,7 +73,7 @@ def sample_conditional(h_upper, h_lower, p_upper, p_lower, q_upper, q_lower, ove
     log_2pu = p_upper.log_prob(h2, h_upper)
 
     log_2ps = (log_2pu + log_2pl + log_2ql + log_2qu) / 2
-    log_2 = logsumexp2(log_2pu, log_2ql)
+    log_2 = logplusexp(log_2pu, log_2ql)
 
     h_proposals = tensor.concatenate([h1, h2], axis=0)
     log_proposals = tensor.concatenate([log_1, log_2], axis=0)  # - np.log(2.)
@@ -87,9 +81,7 @@ def sample_conditional(h_upper, h_lower, p_upper, p_lower, q_upper, q_lower, ove
 
     # Calculate weights
     log_w = log_ps - log_proposals
-    w_norm = logsumexp(log_w, axis=0)
-    log_w = log_w-w_norm
-    w = tensor.exp(log_w)
+    _, w = logsumexp_weights(log_w, axis=0)
 
     idx = subsample(w, nsamples)
 
@@ -106,13 +98,13 @@ def sample_top_conditional(h_lower, p_top, q_lower, oversample):
     log_1q = q_lower.log_prob(h1, h_lower)
 
     log_1ps = (log_1p + log_1q) / 2
-    log_1 = logsumexp2(log_1p, log_1q)
+    log_1 = logplusexp(log_1p, log_1q)
 
     h2, log_2q = q_lower.sample(h_lower)
     log_2p = p_top.log_prob(h2)
 
     log_2ps = (log_2p + log_2q) / 2
-    log_2 = logsumexp2(log_2p, log_2q)
+    log_2 = logplusexp(log_2p, log_2q)
 
     h_proposals = tensor.concatenate([h1, h2], axis=0)
     log_proposals = tensor.concatenate([log_1, log_2], axis=0)  # - np.log(2.)
@@ -120,9 +112,7 @@ def sample_top_conditional(h_lower, p_top, q_lower, oversample):
 
     # Calculate weights
     log_w = log_ps - log_proposals
-    w_norm = logsumexp(log_w, axis=0)
-    log_w = log_w-w_norm
-    w = tensor.exp(log_w)
+    _, w = logsumexp_weights(log_w, axis=0)
 
     idx = subsample(w, nsamples)
 
@@ -150,9 +140,7 @@ def sample_bottom_conditional(h_upper, p_upper, ll_function, q_upper, oversample
 
     # Calculate weights
     log_w = (log_ql + log_qu - log_p) / 2
-    w_norm = logsumexp(log_w, axis=0)
-    log_w = log_w-w_norm
-    w = tensor.exp(log_w)
+    _, w = logsumexp_weights(log_w, axis=0)
 
     idx = subsample(w, nsamples)
 
@@ -177,9 +165,7 @@ def inpaint_bottom_conditional(h_upper, p_upper, ll_function, q_upper, x, mask,
 
     # Calculate weights
     log_w = (log_ql + log_qu - log_p) / 2
-    w_norm = logsumexp(log_w, axis=0)
-    log_w = log_w-w_norm
-    w = tensor.exp(log_w)
+    _, w = logsumexp_weights(log_w, axis=0)
 
     idx = subsample(w, nsamples)
 
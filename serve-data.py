@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, division
+
+import sys
+sys.path.append("..")
+
+import os
+import time
+import signal
+import logging
+
+from argparse import ArgumentParser
+
+import helmholtz.datasets as datasets
+
+logger = logging.getLogger("serve-data.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Load datasets once into shared memory for concurrent runs")
+    parser.add_argument("--keep", action="store_true", default=False,
+            help="Exit immediately and leave the datasets in shared memory")
+    parser.add_argument("data", nargs="+", choices=datasets.supported_datasets,
+            help="Datasets to serve")
+    args = parser.parse_args()
+
+    fnames = []
+    for data_name in args.data:
+        logger.info("Exporting %s to %s..." % (data_name, datasets.shm_dir))
+        fnames += datasets.export_shared_data(data_name)
+
+    for fname in fnames:
+        logger.info("  %s (%5.1f MB)" % (fname, os.path.getsize(fname) / 2.**20))
+
+    if args.keep:
+        sys.exit(0)
+
+    def remove_and_exit(signum, frame):
+        logger.info("Removing datasets from shared memory...")
+        for fname in fnames:
+            os.remove(fname)
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, remove_and_exit)
+    signal.signal(signal.SIGTERM, remove_and_exit)
+
+    logger.info("Serving; train.py and est-*.py will now map these datasets. Press Ctrl-C to stop.")
+    while True:
+        time.sleep(3600)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""Successive-halving hyperparameter sweep over train.py configurations.
+
+Every line in the configuration file contains the command line arguments
+for one train.py run (without --max-epochs), e.g.:
+
+    --lr 1e-3 --step-rule adam rws --nsamples 10 200,200,200
+    --lr 3e-4 --step-rule rmsprop bihm-rws --nsamples 5 200,200,200
+
+All configurations are first trained for --min-epochs epochs. At every rung
+boundary the runs are ranked by their last validation cost, the bottom
+fraction is pruned and the survivors are continued (via 'train.py continue')
+for eta times as many epochs. Runs whose monitored channels become NaN or
+infinite are killed immediately.
+"""
+
+from __future__ import print_function, division
+
+import sys
+import os
+import glob
+import json
+import math
+import shlex
+import logging
+import subprocess
+import multiprocessing
+
+from argparse import ArgumentParser
+
+logger = logging.getLogger("sweep.py")
+
+FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
+DATEFMT = "%H:%M:%S"
+logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+
+methods = ['continue', 'vae', 'dvae', 'rws', 'bihm-rws']
+
+train_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+
+#-----------------------------------------------------------------------------
+
+
+def read_configs(fname):
+    """ Read one train.py argument list per (non-empty, non-comment) line """
+    configs = []
+    with open(fname, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            configs.append(shlex.split(line))
+    return configs
+
+
+def split_arguments(argv):
+    """Split a train.py argument list into global and method arguments.
+
+    Returns
+    -------
+    global_args : list
+    method : str
+    method_args : list
+    """
+    for i, arg in enumerate(argv):
+        if arg in methods:
+            return argv[:i], arg, argv[i + 1:]
+    raise ValueError("No training method in '%s'" % " ".join(argv))
+
+
+def get_option(argv, names, default=None):
+    """ Return the value following any of the option *names* in *argv* """
+    for i, arg in enumerate(argv[:-1]):
+        if arg in names:
+            return argv[i + 1]
+    return default
+
+
+def strip_option(argv, names):
+    """ Remove the options *names* and their values from *argv* """
+    argv = list(argv)
+    for i in reversed(range(len(argv) - 1)):
+        if argv[i] in names:
+            del argv[i:i + 2]
+    return argv
+
+
+def parse_channels(line):
+    """Parse a 'channel: value' line as printed by blocks' Printing extension.
+
+    Returns None for lines that do not contain a train_* or valid_* channel.
+    """
+    name, sep, value = line.strip().partition(":")
+    if not sep or not name.startswith(("train_", "valid_")):
+        return None
+    try:
+        value = float(value.strip().strip("[]"))
+    except ValueError:
+        return None
+    return name, value
+
+
+def is_finite(value):
+    return not (math.isnan(value) or math.isinf(value))
+
+
+def select_survivors(runs, metric, eta):
+    """ Keep the best 1/eta fraction (lowest *metric*) of all alive runs """
+    alive = [r for r in runs if r['status'] == 'alive']
+    alive = sorted(alive, key=lambda r: r['channels'][metric])
+
+    n_keep = max(1, int(math.ceil(len(alive) / eta)))
+    for run in alive[n_keep:]:
+        run['status'] = 'pruned'
+    return alive[:n_keep]
+
+#-----------------------------------------------------------------------------
+# Worker processes
+
+
+def init_worker(cpu_queue, threads):
+    """ Pin this pool worker to its own set of CPUs and BLAS/OpenMP threads """
+    cpus = cpu_queue.get()
+
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[var] = str(threads)
+    os.environ["SWEEP_CPUS"] = ",".join(str(c) for c in cpus)
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def run_train(job):
+    """ Run a single train.py invocation and monitor its printed channels """
+    run_id, tag, argv = job
+
+    cmd = [sys.executable, train_script] + argv
+    if not hasattr(os, "sched_setaffinity") and "SWEEP_CPUS" in os.environ:
+        cmd = ["taskset", "-c", os.environ["SWEEP_CPUS"]] + cmd
+
+    channels = {}
+    status = 'alive'
+    with open(tag + ".log", "a") as log:
+        log.write("$ %s\n" % " ".join(cmd))
+        log.flush()
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log,
+                                universal_newlines=True)
+        for line in iter(proc.stdout.readline, ''):
+            log.write(line)
+
+            channel = parse_channels(line)
+            if channel is None:
+                continue
+            name, value = channel
+            channels[name] = value
+            if not is_finite(value):
+                status = 'nan'
+                proc.kill()
+                break
+        proc.stdout.close()
+        proc.wait()
+
+    if status == 'alive' and proc.returncode != 0:
+        status = 'failed'
+
+    model_files = sorted(glob.glob("*-%s-*_model.pkl" % tag), key=os.path.getmtime)
+    model_file = model_files[-1] if model_files else None
+    if status == 'alive' and model_file is None:
+        status = 'failed'
+
+    return run_id, status, channels, model_file
+
+#-----------------------------------------------------------------------------
+
+
+def main(args):
+    configs = read_configs(args.configs)
+    logger.info("Read %d configurations from %s" % (len(configs), args.configs))
+
+    runs = []
+    for i, argv in enumerate(configs):
+        global_args, method, method_args = split_arguments(argv)
+        runs.append({
+            'id': i,
+            'argv': argv,
+            'global_args': strip_option(global_args, ["--name", "--max-epochs", "--epochs"]),
+            'n_samples': get_option(method_args, ["--nsamples", "-s"]),
+            'name': get_option(global_args, ["--name"], ""),
+            'method_args': [method] + method_args,
+            'model_file': None,
+            'epochs': 0,
+            'channels': {},
+            'status': 'alive',
+        })
+
+    # Split the available CPUs between the workers
+    n_cpus = multiprocessing.cpu_count()
+    threads = max(1, n_cpus // args.workers)
+    cpu_queue = multiprocessing.Queue()
+    for w in range(args.workers):
+        cpu_queue.put([(w * threads + t) % n_cpus for t in range(threads)])
+
+    pool = multiprocessing.Pool(args.workers, initializer=init_worker,
+                                initargs=(cpu_queue, threads))
+
+    rung = 0
+    alive = runs
+    while True:
+        target_epochs = min(args.max_epochs, int(args.min_epochs * args.eta ** rung))
+
+        jobs = []
+        for run in alive:
+            tag = "%ssweep%03dr%d" % (run['name'] + "-" if run['name'] else "", run['id'], rung)
+            epochs = ["--max-epochs", str(target_epochs - run['epochs'])]
+            if run['model_file'] is None:
+                argv = run['global_args'] + ["--name", tag] + epochs + run['method_args']
+            else:
+                argv = run['global_args'] + ["--name", tag] + epochs + \
+                    ["continue", run['model_file']]
+                if run['n_samples'] is not None:
+                    argv += ["--nsamples", run['n_samples']]
+            jobs.append((run['id'], tag, argv))
+
+        logger.info("Rung %d: training %d runs up to %d epochs" % (rung, len(jobs), target_epochs))
+        for run_id, status, channels, model_file in pool.imap_unordered(run_train, jobs):
+            run = runs[run_id]
+            run['status'] = status
+            run['channels'].update(channels)
+            run['model_file'] = model_file
+            run['epochs'] = target_epochs
+            if args.metric not in run['channels'] and status == 'alive':
+                run['status'] = 'failed'
+            logger.info("Run %03d finished (%s): %s=%s" %
+                        (run_id, run['status'], args.metric, run['channels'].get(args.metric)))
+
+        alive = [r for r in runs if r['status'] == 'alive']
+        if target_epochs >= args.max_epochs or len(alive) <= 1:
+            break
+
+        alive = select_survivors(runs, args.metric, args.eta)
+        rung += 1
+
+        with open(args.output, "w") as f:
+            json.dump(runs, f, indent=2)
+
+    pool.close()
+    pool.join()
+
+    with open(args.output, "w") as f:
+        json.dump(runs, f, indent=2)
+
+    print()
+    print("%-4s %-8s %-7s %12s  %s" % ("id", "status", "epochs", args.metric, "arguments"))
+    ranked = sorted(runs, key=lambda r: (r['status'] != 'alive', r['channels'].get(args.metric, float('inf'))))
+    for run in ranked:
+        print("%03d  %-8s %7d %12.4f  %s" %
+              (run['id'], run['status'], run['epochs'],
+               run['channels'].get(args.metric, float('nan')), " ".join(run['argv'])))
+
+#=============================================================================
+
+if __name__ == "__main__":
+    parser = ArgumentParser("Successive-halving sweep over train.py configurations")
+    parser.add_argument("--workers", "-j", type=int,
+            default=4, help="Number of concurrent training runs (default: 4)")
+    parser.add_argument("--min-epochs", type=int,
+            default=10, help="Epochs trained before the first rung (default: 10)")
+    parser.add_argument("--max-epochs", type=int,
+            default=1000, help="Maximum number of epochs for any run (default: 1000)")
+    parser.add_argument("--eta", type=float,
+            default=2., help="Keep the best 1/eta runs at each rung (default: 2)")
+    parser.add_argument("--metric", type=str,
+            default="valid_log_p", help="Validation channel to rank runs by (default: valid_log_p)")
+    parser.add_argument("--output", "-o", type=str,
+            default="sweep.json", help="Save the sweep state to this file")
+    parser.add_argument("configs", help="File with one train.py argument list per line")
+    args = parser.parse_args()
+
+    main(args)
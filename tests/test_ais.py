@@ -0,0 +1,74 @@
+
+import unittest
+
+import numpy
+import theano
+
+from theano import tensor
+
+from helmholtz import create_layers
+from helmholtz.bihm import BiHM
+from helmholtz.evaluation import logsumexp
+from helmholtz.exact import ExactEnumeration
+from helmholtz.ais import *
+
+
+def setup_bihm():
+    p_layers, q_layers = create_layers("3,2", 4)
+    brick = BiHM(p_layers, q_layers)
+    brick.initialize()
+    return brick
+
+
+def test_schedules():
+    for betas in [sigmoid_schedule(10), linear_schedule(10)]:
+        assert len(betas) == 11
+        assert numpy.allclose(betas[[0, -1]], [0., 1.])
+        assert (numpy.diff(betas) > 0).all()
+
+
+def test_ais_nll():
+    brick = setup_bihm()
+    n_layers = len(brick.p_layers)
+
+    features = tensor.matrix('features')
+    n_chains = tensor.iscalar('n_chains')
+    do_init = theano.function([features, n_chains], ais_nll_init(brick, features, n_chains),
+                              allow_input_downcast=True)
+
+    h = [tensor.matrix() for _ in xrange(n_layers)]
+    beta_prev, beta = tensor.scalar(), tensor.scalar()
+    h_new, log_w = ais_nll_step(brick, h, beta_prev, beta, n_chains)
+    do_step = theano.function([beta_prev, beta, n_chains] + h, h_new + [log_w], allow_input_downcast=True)
+
+    # The features stay at one row per example
+    x = numpy.asarray([[0, 1, 1, 0], [1, 1, 1, 1]])
+    states = do_init(x, 100)
+    assert states[0].shape == x.shape
+    log_w, _ = run_ais(lambda *args: do_step(args[0], args[1], 100, *args[2:]), states, sigmoid_schedule(200))
+    log_px = logsumexp(log_w.reshape((2, 100))) - numpy.log(100)
+
+    assert numpy.allclose(log_px, ExactEnumeration(brick).log_px(x), atol=0.05)
+
+
+def test_ais_z():
+    brick = setup_bihm()
+    n_layers = len(brick.p_layers)
+
+    n_chains = tensor.iscalar('n_chains')
+    do_init = theano.function([n_chains], sum(ais_z_init(brick, n_chains), []),
+                              allow_input_downcast=True)
+
+    h = [tensor.matrix() for _ in xrange(n_layers)]
+    h2 = [tensor.matrix() for _ in xrange(n_layers)]
+    beta_prev, beta = tensor.scalar(), tensor.scalar()
+    h_new, h2_new, log_w = ais_z_step(brick, h, h2, beta_prev, beta)
+    do_step = theano.function([beta_prev, beta] + h + h2, h_new + h2_new + [log_w],
+                              allow_input_downcast=True)
+
+    log_w, states = run_ais(do_step, do_init(500), sigmoid_schedule(200))
+    log_z2 = logsumexp(log_w) - numpy.log(500)
+
+    assert len(states) == 2 * n_layers
+    assert (states[0] == states[n_layers]).all()
+    assert numpy.allclose(log_z2, ExactEnumeration(brick).log_z2(), atol=0.05)
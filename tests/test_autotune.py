@@ -0,0 +1,50 @@
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from helmholtz import create_layers
+from helmholtz.rws import ReweightedWakeSleep
+from helmholtz.autotune import *
+
+
+def test_parse_memory():
+    assert parse_memory("512") == 512
+    assert parse_memory("2k") == 2048
+    assert parse_memory("1.5G") == 3 * 2 ** 29
+    assert parse_memory("2GB") == 2 * 2 ** 30
+
+
+def test_autotune_batch_size():
+    p_layers, q_layers = create_layers("10,5", 20)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    widths, n_parameters = model_shapes(brick)
+    assert sum(widths) == (20 + 10) + (10 + 5)
+    assert predict_memory(widths, n_parameters, 2, 10) < predict_memory(widths, n_parameters, 4, 10)
+
+    calls = []
+    budget = predict_memory(widths, n_parameters, 40, 10)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache_file = os.path.join(tmpdir, "autotune.json")
+        bs = autotune_batch_size(calls.append, brick, 10, budget, "test", cache_file=cache_file)
+        assert bs in (4, 8, 16, 32)
+        assert max(calls) == 32
+
+        # Second call is answered from the cache
+        del calls[:]
+        assert autotune_batch_size(calls.append, brick, 10, budget, "test", cache_file=cache_file) == bs
+        assert calls == []
+
+        # Extra per-row memory (e.g. an enumerated top layer) is tuned separately and smaller
+        bs_rb = autotune_batch_size(calls.append, brick, 10, budget, "test", row_width=2 ** 10,
+                                    cache_file=cache_file)
+        assert calls != [] and max(calls) < 32
+        assert bs_rb <= bs
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,88 @@
+
+import unittest
+
+import numpy
+import theano
+
+from theano import tensor
+
+from blocks.initialization import Constant
+
+from helmholtz.batch_normalization import *
+
+
+def test_population_statistics():
+    bn = BatchNormalization(dim=3, beta_init=Constant(0.), gamma_init=Constant(1.))
+    bn.initialize()
+
+    x = tensor.matrix('x')
+    y = bn.apply(x)
+    updates = population_updates([y], decay=0.)
+    assert len(updates) == 2
+
+    do_train = theano.function([x], y, updates=updates, allow_input_downcast=True)
+
+    x_train = numpy.random.normal(loc=2., size=(50, 3))
+    do_train(x_train)
+    assert numpy.allclose(bn.population_mean.get_value(), x_train.mean(axis=0), atol=1e-5)
+    assert numpy.allclose(bn.population_var.get_value(), x_train.var(axis=0), atol=1e-5)
+
+    # Inference mode: every row is normalized independently of the batch
+    with inference_mode(bn):
+        y = bn.apply(x)
+    assert not bn.use_population
+    do_infer = theano.function([x], y, allow_input_downcast=True)
+
+    expected = (x_train - x_train.mean(axis=0)) / numpy.sqrt(x_train.var(axis=0) + 1e-5)
+    assert numpy.allclose(do_infer(x_train[:1]), expected[:1], atol=1e-4)
+    assert numpy.allclose(do_infer(x_train), expected, atol=1e-4)
+
+
+def test_fold_batch_normalization():
+    from blocks.bricks import Tanh, Logistic, MLP
+    from blocks.initialization import IsotropicGaussian
+
+    from helmholtz.prob_layers import BernoulliLayer
+
+    mlp = BatchNormalizedMLP([Tanh(), Logistic()], [4, 5, 3],
+                             weights_init=IsotropicGaussian(1.), biases_init=Constant(0.1))
+    layer = BernoulliLayer(mlp, name="layer")
+    layer.initialize()
+    for bn in mlp.batch_normnalizations:
+        bn.population_mean.set_value(numpy.random.normal(size=bn.dim).astype(theano.config.floatX))
+        bn.population_var.set_value(numpy.random.uniform(0.5, 2., size=bn.dim).astype(theano.config.floatX))
+
+    y = tensor.matrix('y')
+    with inference_mode(layer):
+        expected = theano.function([y], layer.sample_expected(y), allow_input_downcast=True)
+
+    assert freeze_batch_normalization(layer) == 1
+    assert isinstance(layer.mlp, MLP) and not isinstance(layer.mlp, BatchNormalizedMLP)
+    folded = theano.function([y], layer.sample_expected(y), allow_input_downcast=True)
+
+    y = numpy.random.normal(size=(7, 4))
+    assert numpy.allclose(folded(y), expected(y), atol=1e-5)
+
+
+def test_old_pickle_without_statistics():
+    bn = BatchNormalization(dim=3, beta_init=Constant(0.), gamma_init=Constant(1.))
+    bn.initialize()
+    population_mean = bn.population_mean
+
+    # Re-initializing keeps the shared variables of compiled graphs
+    bn.initialize()
+    assert bn.population_mean is population_mean
+
+    # As unpickled from before population statistics were tracked
+    del bn.population_mean, bn.population_var
+    assert bn.population_mean is None
+
+    x = tensor.matrix('x')
+    with inference_mode(bn):
+        y = bn.apply(x)
+    assert population_updates([y]) == []
+
+    assert add_population_statistics(bn) == [bn]
+    assert add_population_statistics(bn) == []
+    assert numpy.allclose(bn.population_var.get_value(), 1.)
+    assert len(population_updates([bn.apply(x)])) == 2
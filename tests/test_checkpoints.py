@@ -0,0 +1,65 @@
+
+import unittest
+
+import numpy
+import theano
+
+from theano import tensor
+
+from helmholtz import create_layers
+from helmholtz.rws import ReweightedWakeSleep
+from helmholtz.checkpoints import *
+
+
+def make_brick(layer_spec):
+    p_layers, q_layers = create_layers(layer_spec, 16)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+    for p in Selector(brick).get_parameters().values():
+        value = p.get_value()
+        p.set_value(numpy.random.normal(size=value.shape).astype(value.dtype))
+    return brick
+
+
+def compile_log_prob(brick):
+    samples = [tensor.matrix() for _ in brick.p_layers]
+    return theano.function(samples, sum(brick.log_prob_p(samples)), allow_input_downcast=True)
+
+
+def test_compiled_groups():
+    bricks = [make_brick("8,4"), make_brick("8,4"), make_brick("8,3")]
+
+    assert architecture_key(bricks[0]) == architecture_key(bricks[1])
+    assert architecture_key(bricks[0]) != architecture_key(bricks[2])
+
+    samples = [numpy.random.uniform(size=(5, d)) > 0.5 for d in (16, 8, 4)]
+    expected = compile_log_prob(bricks[1])(*samples)
+    assert not numpy.allclose(compile_log_prob(bricks[0])(*samples), expected)
+
+    groups = CompiledGroups(compile_log_prob)
+    groups.get(bricks[0])
+    log_prob = groups.get(bricks[1])(*samples)
+    groups.get(bricks[2])
+
+    assert len(groups) == 2
+    assert numpy.allclose(log_prob, expected)
+
+
+def test_architecture_key_settings():
+    from blocks.bricks import MLP, Tanh, Logistic
+    from helmholtz.prob_layers import BernoulliLayer
+
+    key = architecture_key(make_brick("8,4"))
+
+    # Graph settings of the model and of single layers
+    brick = make_brick("8,4")
+    brick.scan_layers = True
+    assert architecture_key(brick) != key
+
+    brick = make_brick("8,4")
+    brick.p_layers[0].binary_input = True
+    assert architecture_key(brick) != key
+
+    # Same parameters, different activation
+    layers = [BernoulliLayer(MLP([act, Logistic()], [4, 5, 3]), name="layer") for act in (Tanh(), Logistic())]
+    assert architecture_key(layers[0]) != architecture_key(layers[1])
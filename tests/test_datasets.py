@@ -40,3 +40,45 @@ def test_range():
 
     for name in datasets.supported_datasets:
         yield check_dataset, name
+
+
+def test_shared_data():
+    import shutil
+    import tempfile
+    import cPickle as pickle
+
+    shm_dir = datasets.shm_dir
+    datasets.shm_dir = tempfile.mkdtemp()
+    try:
+        assert not datasets.has_shared_data('bars')
+        datasets.export_shared_data('bars')
+        assert datasets.has_shared_data('bars')
+
+        x_dim, data_train, data_valid, data_test = datasets.get_data('bars')
+        assert isinstance(data_train, datasets.SharedMemoryDataset)
+
+        features, = data_train.get_data(None, [0, 2, 4])
+        assert features.shape == (3, x_dim)
+
+        data_train = pickle.loads(pickle.dumps(data_train))
+        features2, = data_train.get_data(None, [0, 2, 4])
+        assert (features == features2).all()
+    finally:
+        shutil.rmtree(datasets.shm_dir)
+        datasets.shm_dir = shm_dir
+
+
+
+def test_unshuffled():
+    def check_dataset(name):
+        try:
+            _, _, _, stream = datasets.get_streams(name, batch_size=10, small_batch_size=10, shuffle=False)
+        except IOError as e:
+            raise SkipTest
+
+        # Every epoch starts with the same examples
+        first, = next(stream.get_epoch_iterator())
+        second, = next(stream.get_epoch_iterator())
+        assert (first == second).all()
+
+    yield check_dataset, 'bars'
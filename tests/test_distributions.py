@@ -53,3 +53,52 @@ def test_benoulli():
     print(grads)
 
     assert numpy.allclose(numpy.mean(samples, axis=0), prob, atol=0.1, rtol=0.1)
+
+
+def test_structured_uniform():
+    batch_size = tensor.iscalar("batch_size")
+    n_samples = tensor.iscalar("n_samples")
+
+    for mode in dist.sampling_modes:
+        u = dist.structured_uniform(batch_size, n_samples, 3, mode)
+        do_u = theano.function([batch_size, n_samples], u, name="do_u")
+
+        u = do_u(1000, 4)
+        assert u.shape == (4000, 3)
+        assert numpy.all((u >= 0.) & (u <= 1.))
+        assert numpy.allclose(numpy.mean(u, axis=0), 0.5, atol=0.05)
+
+        u = u.reshape((1000, 4, 3))
+        if mode == 'antithetic':
+            assert numpy.allclose(u[:, :2], 1. - u[:, 2:], atol=1e-6)
+        elif mode == 'stratified':
+            strata = numpy.sort(numpy.floor(u * 4), axis=1)
+            assert numpy.all(strata == numpy.arange(4)[None, :, None])
+
+
+def test_bernoulli_noise():
+    prob = tensor.matrix('prob')
+    noise = tensor.matrix('noise')
+
+    do_sample = theano.function([prob, noise], dist.bernoulli(prob, noise=noise),
+                                allow_input_downcast=True, name="do_sample")
+
+    prob = numpy.asarray([[0.2, 0.5, 0.8]])
+    assert numpy.all(do_sample(prob, [[0.1, 0.6, 0.7]]) == [[1., 0., 1.]])
+
+
+def test_counter_uniform():
+    u = dist.counter_uniform(numpy.arange(10), 1, 20, 30, seed=5)
+    assert u.shape == (200, 30)
+    assert (u >= 0).all() and (u < 1).all()
+    assert abs(u.mean() - 0.5) < 0.05
+
+    # Independent of the batching
+    u_part = dist.counter_uniform(numpy.arange(4, 6), 1, 20, 30, seed=5)
+    assert numpy.array_equal(u_part, u[80:120])
+
+    # Common prefix for wider layers; different layers and seeds differ
+    u_wide = dist.counter_uniform(numpy.arange(10), 1, 20, 40, seed=5)
+    assert numpy.array_equal(u_wide[:, :30], u)
+    assert not numpy.allclose(dist.counter_uniform(numpy.arange(10), 2, 20, 30, seed=5), u)
+    assert not numpy.allclose(dist.counter_uniform(numpy.arange(10), 1, 20, 30, seed=6), u)
@@ -0,0 +1,120 @@
+
+import unittest
+
+import numpy
+import theano
+
+from theano import tensor
+
+from helmholtz import create_layers
+from helmholtz.rws import ReweightedWakeSleep
+from helmholtz.estimators import *
+
+
+def test_systematic_resample():
+    log_w = tensor.matrix('log_w')
+    u = tensor.vector('u')
+
+    do_resample = theano.function([log_w, u], systematic_resample(log_w, u),
+                                  allow_input_downcast=True)
+
+    w = numpy.asarray([[0.7, 0.1, 0.1, 0.1],
+                       [0.25, 0.25, 0.25, 0.25],
+                       [0.0, 0.0, 0.0, 1.0]])
+    idx = do_resample(numpy.log(w + 1e-20), [0.5, 0.5, 0.99])
+
+    assert (idx[0] == [0, 0, 0, 2]).all()
+    assert (idx[1] == [0, 1, 2, 3]).all()
+    assert (idx[2] == [3, 3, 3, 3]).all()
+
+
+def test_smc_log_likelihood():
+    p_layers, q_layers = create_layers("10,5", 20)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    features = tensor.matrix('features')
+    n_samples = tensor.iscalar('n_samples')
+    log_px, n_resampled = smc_log_likelihood(brick, features, n_samples, ess_threshold=1.)
+
+    do_smc = theano.function([features, n_samples], [log_px, n_resampled],
+                             allow_input_downcast=True)
+
+    x = numpy.random.uniform(size=(7, 20)) > 0.5
+    log_px, n_resampled = do_smc(x, 10)
+
+    assert log_px.shape == (7,)
+    assert numpy.isfinite(log_px).all()
+    assert (log_px <= 0.).all()
+    assert (n_resampled <= 1).all()
+
+
+def test_rao_blackwellized_log_likelihood():
+    # With a single hidden layer the estimate is exact for any n_samples
+    p_layers, q_layers = create_layers("5", 20)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    features = tensor.matrix('features')
+    n_samples = tensor.iscalar('n_samples')
+    log_px, log_psx = rao_blackwellized_log_likelihood(brick, features, n_samples)
+
+    do_rb = theano.function([features, n_samples], [log_px, log_psx],
+                            allow_input_downcast=True)
+
+    x = numpy.random.uniform(size=(7, 20)) > 0.5
+    log_px1, _ = do_rb(x, 1)
+    log_px10, _ = do_rb(x, 10)
+
+    assert log_px1.shape == (7,)
+    assert numpy.allclose(log_px1, log_px10, atol=1e-4)
+
+
+def test_rao_blackwellized_two_layers():
+    from helmholtz.exact import ExactEnumeration
+
+    p_layers, q_layers = create_layers("3,2", 4)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    features = tensor.matrix('features')
+    n_samples = tensor.iscalar('n_samples')
+    log_px, _ = rao_blackwellized_log_likelihood(brick, features, n_samples)
+    do_rb = theano.function([features, n_samples], log_px, allow_input_downcast=True)
+
+    x = numpy.asarray([[0, 1, 1, 0], [1, 1, 1, 1]])
+    assert numpy.allclose(do_rb(x, 5000), ExactEnumeration(brick).log_px(x), atol=0.05)
+
+
+def test_rao_blackwellized_too_wide():
+    # Wider top layers fall back to the plain importance sampled estimate
+    p_layers, q_layers = create_layers("8,4", 16)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    features = tensor.matrix('features')
+    n_samples = tensor.iscalar('n_samples')
+    log_px, _ = rao_blackwellized_log_likelihood(brick, features, n_samples, max_width=3)
+    do_rb = theano.function([features, n_samples], log_px, allow_input_downcast=True)
+
+    x = numpy.random.uniform(size=(5, 16)) > 0.5
+    log_px = do_rb(x, 10)
+    assert log_px.shape == (5,)
+    assert numpy.isfinite(log_px).all()
+    assert (log_px <= 0.).all()
+
+
+def test_smc_matches_exact():
+    from helmholtz.exact import ExactEnumeration
+
+    p_layers, q_layers = create_layers("3,2", 4)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    features = tensor.matrix('features')
+    n_samples = tensor.iscalar('n_samples')
+    log_px, _ = smc_log_likelihood(brick, features, n_samples)
+    do_smc = theano.function([features, n_samples], log_px, allow_input_downcast=True)
+
+    x = numpy.asarray([[0, 1, 1, 0], [1, 1, 1, 1]])
+    assert numpy.allclose(do_smc(x, 5000), ExactEnumeration(brick).log_px(x), atol=0.05)
@@ -0,0 +1,52 @@
+
+from __future__ import division, print_function
+
+import unittest
+
+import numpy
+
+from numpy.testing import assert_allclose
+
+from helmholtz.evaluation import *
+
+
+def test_log_mean_exp():
+    a = numpy.random.normal(size=(10, 20))
+
+    assert_allclose(log_mean_exp(a), numpy.log(numpy.mean(numpy.exp(a), axis=-1)))
+    assert_allclose(log_mean_exp(a + 1000.), log_mean_exp(a) + 1000.)
+
+
+def test_effective_sample_size():
+    assert_allclose(effective_sample_size(numpy.zeros((3, 10))), 1.)
+
+    log_w = numpy.zeros((1, 10))
+    log_w[0, 0] = 1000.
+    assert_allclose(effective_sample_size(log_w), 1. / 10)
+
+
+def test_estimate_all():
+    n_layers, n_examples, n_samples = 3, 5, 100
+    log_p = [numpy.random.normal(size=(n_examples, n_samples)) for _ in xrange(n_layers)]
+    log_q = [numpy.random.normal(size=(n_examples, n_samples)) for _ in xrange(n_layers)]
+
+    results = estimate_all(log_p, log_q)
+
+    assert results['log_px'].shape == (n_examples,)
+    assert results['layer_kl'].shape == (n_layers, n_examples)
+    assert (results['kl'] >= 0.).all()
+    assert ((results['ess_p'] > 0.) & (results['ess_p'] <= 1.)).all()
+
+
+def test_log_px_standard_error():
+    log_w = numpy.random.normal(size=(2000, 50))
+    w = numpy.exp(log_w)
+
+    se = log_px_standard_error(logsumexp(log_w), logsumexp(2 * log_w), 50)
+    expected = numpy.std(w, axis=-1) / numpy.mean(w, axis=-1) / numpy.sqrt(50)
+    assert_allclose(se, expected)
+
+    # The delta-method estimate should match the spread of the estimator
+    assert_allclose(numpy.mean(se), numpy.std(log_mean_exp(log_w)), rtol=0.2)
+
+    assert_allclose(log_px_standard_error(numpy.log(10.), numpy.log(10.), 10), 0.)
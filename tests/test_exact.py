@@ -0,0 +1,53 @@
+
+import unittest
+
+import itertools
+import numpy
+import theano
+
+from theano import tensor
+
+from helmholtz import create_layers
+from helmholtz.bihm import BiHM
+from helmholtz.evaluation import logsumexp
+from helmholtz.exact import *
+
+
+def test_gray_code_preactivations():
+    W = numpy.random.normal(size=(5, 3))
+    b = numpy.random.normal(size=(3,))
+
+    A = gray_code_preactivations(W, b, 3, 29)
+    assert numpy.allclose(A, gray_code(3, 29, 5).dot(W) + b)
+
+    # Consecutive configurations differ in exactly one bit
+    H = gray_code(0, 32, 5)
+    assert (numpy.abs(numpy.diff(H, axis=0)).sum(axis=1) == 1).all()
+
+
+def test_exact_enumeration():
+    x_dim = 3
+    p_layers, q_layers = create_layers("3,2", x_dim)
+    brick = BiHM(p_layers, q_layers)
+    brick.initialize()
+
+    # Brute force over all (x, h1, h2)
+    samples = [tensor.matrix() for _ in xrange(3)]
+    do_log_prob = theano.function(samples,
+                                  [sum(brick.log_prob_p(samples)), sum(brick.log_prob_q(samples))],
+                                  allow_input_downcast=True)
+
+    X = numpy.asarray(list(itertools.product([0, 1], repeat=x_dim)), dtype=numpy.float64)
+    H = numpy.asarray(list(itertools.product([0, 1], repeat=5)), dtype=numpy.float64)
+
+    log_px, log_psx = [], []
+    for x in X:
+        log_p, log_q = do_log_prob(numpy.tile(x, (32, 1)), H[:, :3], H[:, 3:])
+        log_px.append(logsumexp(log_p))
+        log_psx.append(2 * logsumexp((log_p + log_q) / 2))
+
+    exact = ExactEnumeration(brick, chunk_size=3)
+    assert numpy.allclose(exact.log_px(X), log_px, atol=1e-4)
+    assert numpy.allclose(exact.log_psx(X), log_psx, atol=1e-4)
+    assert numpy.allclose(exact.log_z2(), logsumexp(numpy.asarray(log_psx)), atol=1e-4)
+    assert numpy.allclose(logsumexp(exact.log_px(X)), 0., atol=1e-4)
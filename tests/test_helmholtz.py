@@ -24,3 +24,67 @@ def test_flatten_values():
 def test_unflatten_values():
     pass
 
+
+def test_leave_one_out_baseline():
+    import numpy
+    import theano
+    from theano import tensor
+
+    log_w = tensor.matrix('log_w')
+    do_baseline = theano.function([log_w], leave_one_out_baseline(log_w),
+                                  allow_input_downcast=True)
+
+    # Equal weights: baseline equals the 1/n_samples baseline
+    baseline = do_baseline(numpy.zeros((3, 10)))
+    assert numpy.allclose(baseline, 1. / 10)
+
+    # Baseline of sample k does not depend on the weight of sample k
+    log_w = numpy.random.normal(size=(2, 5))
+    log_w2 = log_w.copy()
+    log_w2[:, 0] += 3.
+    assert numpy.allclose(do_baseline(log_w)[:, 0], do_baseline(log_w2)[:, 0])
+
+
+def test_weight_statistics():
+    import numpy
+    import theano
+    from theano import tensor
+
+    w = tensor.matrix('w')
+    do_stats = theano.function([w], weight_statistics(w), allow_input_downcast=True)
+
+    # Uniform weights
+    ess, max_weight, entropy = do_stats(numpy.ones((2, 4)) / 4)
+    assert numpy.allclose(ess, 1.)
+    assert numpy.allclose(max_weight, 0.25)
+    assert numpy.allclose(entropy, numpy.log(4))
+
+    # Fully degenerate weights
+    ess, max_weight, entropy = do_stats(numpy.eye(4)[:2])
+    assert numpy.allclose(ess, 0.25)
+    assert numpy.allclose(max_weight, 1.)
+    assert numpy.allclose(entropy, 0.)
+
+
+def test_logsumexp_tensor3():
+    import numpy
+    import theano
+    from theano import tensor
+    from helmholtz.ops import LogSumExp
+
+    A = tensor.tensor3('A')
+    for axis in (0, 1, 2):
+        lse, w = logsumexp_weights(A, axis=axis)
+        do_lse = theano.function([A], [logsumexp(A, axis=axis), lse, w], allow_input_downcast=True)
+
+        # Reduced to matrices, which have a C implementation
+        for node in do_lse.maker.fgraph.toposort():
+            if isinstance(node.op, LogSumExp):
+                assert node.inputs[0].ndim == 2
+
+        a = numpy.random.normal(size=(3, 4, 5))
+        expected = numpy.log(numpy.exp(a).sum(axis=axis))
+        lse, lse_w, w = do_lse(a)
+        assert numpy.allclose(lse, expected)
+        assert numpy.allclose(lse_w, expected)
+        assert numpy.allclose(w, numpy.exp(a - numpy.expand_dims(expected, axis)))
@@ -0,0 +1,88 @@
+
+import unittest
+
+import numpy
+import theano
+
+from theano import tensor
+
+from helmholtz.ops import *
+
+
+def test_unique_rows():
+    X = tensor.matrix('X')
+    index, inverse = unique_rows(X)
+    do_unique = theano.function([X], [X[index], inverse], allow_input_downcast=True)
+
+    # Binary rows (bit-packed)
+    x = (numpy.random.uniform(size=(100, 11)) > 0.8)
+    unique, inverse = do_unique(x)
+    assert len(unique) == len(set(tuple(row) for row in x))
+    assert (unique[inverse] == x).all()
+
+    # Non-binary rows
+    x = numpy.asarray([[0.5, 1.], [0.2, 0.], [0.5, 1.]])
+    unique, inverse = do_unique(x)
+    assert len(unique) == 2
+    assert numpy.allclose(unique[inverse], x)
+
+
+def test_binary_dot():
+    H = tensor.matrix('H')
+    W = tensor.matrix('W')
+    g = tensor.matrix('g')
+
+    cost = (binary_dot(H, W) * g).sum()
+    dense_cost = (tensor.dot(H, W) * g).sum()
+    do_dot = theano.function([H, W, g], [binary_dot(H, W), tensor.dot(H, W)] +
+                             tensor.grad(cost, [H, W]) + tensor.grad(dense_cost, [H, W]),
+                             allow_input_downcast=True)
+
+    h = numpy.random.uniform(size=(20, 10)) > 0.9
+    w = numpy.random.normal(size=(10, 7))
+    out, expected, dH, dW, dH_expected, dW_expected = do_dot(h, w, numpy.random.normal(size=(20, 7)))
+    assert numpy.allclose(out, expected, atol=1e-5)
+    assert numpy.allclose(dH, dH_expected, atol=1e-5)
+    assert numpy.allclose(dW, dW_expected, atol=1e-5)
+
+
+def test_logsumexp():
+    A = tensor.matrix('A')
+    g = tensor.matrix('g')
+
+    for axis in (0, 1):
+        lse, w = logsumexp_op(A, axis, normalize=True)
+        A_max = A.max(axis=axis, keepdims=True)
+        ref_lse = tensor.log(tensor.exp(A - A_max).sum(axis=axis)) + A_max.sum(axis=axis)
+        ref_w = tensor.exp(A - tensor.shape_padaxis(ref_lse, axis))
+
+        cost = lse.sum() + (w * g).sum()
+        ref_cost = ref_lse.sum() + (ref_w * g).sum()
+        do_lse = theano.function([A, g], [lse, w, tensor.grad(cost, A),
+                                          ref_lse, ref_w, tensor.grad(ref_cost, A)],
+                                 allow_input_downcast=True)
+
+        a = 20 * numpy.random.normal(size=(7, 5))
+        ret = do_lse(a, numpy.random.normal(size=(7, 5)))
+        for x, y in zip(ret[:3], ret[3:]):
+            assert numpy.allclose(x, y)
+
+    # Rows of -inf do not produce NaNs in the log-sum-exp
+    do_lse = theano.function([A], logsumexp_op(A, 1), allow_input_downcast=True)
+    lse = do_lse(numpy.asarray([[-numpy.inf, -numpy.inf], [0., -numpy.inf]]))
+    assert numpy.isneginf(lse[0]) and numpy.allclose(lse[1], 0.)
+
+
+def test_logaddexp():
+    a = tensor.vector('a')
+    b = tensor.vector('b')
+
+    do_add = theano.function([a, b], [logaddexp(a, b)] + tensor.grad(logaddexp(a, b).sum(), [a, b]),
+                             allow_input_downcast=True)
+
+    x = numpy.asarray([0., 3., -1000., 800.])
+    y = numpy.asarray([0., -2., -1000., 1.])
+    z, ga, gb = do_add(x, y)
+    assert numpy.allclose(z, numpy.logaddexp(x, y))
+    assert numpy.allclose(ga, numpy.exp(x - z))
+    assert numpy.allclose(gb, numpy.exp(y - z))
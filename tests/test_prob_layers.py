@@ -3,7 +3,7 @@ import numpy
 import theano
 import unittest
 
-from blocks.bricks import MLP, Logistic
+from blocks.bricks import MLP, Logistic, Tanh
 from blocks.initialization import IsotropicGaussian, Constant
 
 from helmholtz.prob_layers import *
@@ -66,3 +66,139 @@ def test_benoulli_layer():
     assert x_expected.shape == (50, dim_x)
     assert x.shape == (50, dim_x)
     assert x_log_prob.shape == (50,)
+
+
+def test_benoulli_layer_dedup():
+    dim_y, dim_x = 8, 20
+
+    l = BernoulliLayer(MLP([Logistic()], [dim_y, dim_x], **inits), name="layer")
+    l.initialize()
+
+    y = tensor.matrix('y')
+    x = tensor.matrix('x')
+    log_prob = l.log_prob(x, y)
+    gradients = l.get_gradients(x, y).values()
+
+    do = theano.function([x, y], [log_prob] + gradients, allow_input_downcast=True)
+
+    # Few distinct rows in Y
+    y = numpy.random.uniform(size=(4, dim_y)) > 0.5
+    y = y[numpy.random.randint(4, size=100)]
+    x = numpy.random.uniform(size=(100, dim_x)) > 0.5
+
+    expected = do(x, y)
+
+    l.dedup = True
+    y_ = tensor.matrix('y')
+    x_ = tensor.matrix('x')
+    do_dedup = theano.function([x_, y_], [l.log_prob(x_, y_)] + l.get_gradients(x_, y_).values(),
+                               allow_input_downcast=True)
+
+    for a, b in zip(expected, do_dedup(x, y)):
+        assert numpy.allclose(a, b, atol=1e-5)
+
+
+def test_benoulli_layer_binary_input():
+    dim_y, dim_x = 12, 6
+
+    l = BernoulliLayer(MLP([Tanh(), Logistic()], [dim_y, 10, dim_x], **inits), name="layer")
+    l.initialize()
+
+    y = tensor.matrix('y')
+    x = tensor.matrix('x')
+    outputs = [l.log_prob(x, y)] + l.get_gradients(x, y).values()
+    l.binary_input = True
+    outputs += [l.log_prob(x, y)] + l.get_gradients(x, y).values()
+
+    do = theano.function([x, y], outputs, allow_input_downcast=True)
+
+    y = numpy.random.uniform(size=(30, dim_y)) > 0.8
+    x = numpy.random.uniform(size=(30, dim_x)) > 0.5
+    ret = do(x, y)
+    n = len(ret) // 2
+    for a, b in zip(ret[:n], ret[n:]):
+        assert numpy.allclose(a, b, atol=1e-5)
+
+
+def test_benoulli_layer_sparse():
+    import scipy.sparse
+    import theano.sparse
+
+    dim_y, dim_x = 12, 6
+
+    l = BernoulliLayer(MLP([Tanh(), Logistic()], [dim_y, 10, dim_x], **inits), name="layer")
+    l.initialize()
+
+    # Sparse input (q-layer) and sparse output (p-layer) against the dense computation
+    y, x = tensor.matrix('y'), tensor.matrix('x')
+    y_sp, x_sp = theano.sparse.csr_matrix('y_sp'), theano.sparse.csr_matrix('x_sp')
+    dense = [l.log_prob(x, y)] + l.get_gradients(x, y).values()
+    sparse = [l.log_prob(x_sp, y_sp)] + l.get_gradients(x_sp, y_sp).values()
+
+    do_dense = theano.function([x, y], dense, allow_input_downcast=True)
+    do_sparse = theano.function([x_sp, y_sp], sparse)
+
+    y = numpy.asarray(numpy.random.uniform(size=(30, dim_y)) > 0.8, dtype=floatX)
+    x = numpy.asarray(numpy.random.uniform(size=(30, dim_x)) > 0.5, dtype=floatX)
+    for a, b in zip(do_dense(x, y), do_sparse(scipy.sparse.csr_matrix(x), scipy.sparse.csr_matrix(y))):
+        assert numpy.allclose(a, b, atol=1e-5)
+
+
+def test_benoulli_layer_n_samples():
+    dim_y, dim_x, n_samples = 12, 6, 5
+
+    l = BernoulliLayer(MLP([Tanh(), Logistic()], [dim_y, 10, dim_x], **inits), name="layer")
+    l.initialize()
+
+    # Y with one row per example against Y with n_samples copies of every row
+    x, y, y_rep = tensor.matrix('x'), tensor.matrix('y'), tensor.matrix('y_rep')
+    outputs = [l.log_prob(x, y_rep)] + l.get_gradients(x, y_rep).values()
+    outputs += [l.log_prob(x, y, n_samples=n_samples)] + l.get_gradients(x, y, n_samples=n_samples).values()
+
+    do = theano.function([x, y, y_rep], outputs, allow_input_downcast=True)
+
+    y = numpy.random.uniform(size=(4, dim_y)) > 0.5
+    x = numpy.random.uniform(size=(4 * n_samples, dim_x)) > 0.5
+    ret = do(x, y, y.repeat(n_samples, axis=0))
+    n = len(ret) // 2
+    for a, b in zip(ret[:n], ret[n:]):
+        assert numpy.allclose(a, b, atol=1e-5)
+
+
+def test_benoulli_layer_per_example_X():
+    dim_y, dim_x, n_samples = 12, 6, 5
+
+    l = BernoulliLayer(MLP([Tanh(), Logistic()], [dim_y, 10, dim_x], **inits), name="layer")
+    l.initialize()
+
+    # X with one row per example is broadcast against n_samples rows of Y
+    x, x_rep, y = tensor.matrix('x'), tensor.matrix('x_rep'), tensor.matrix('y')
+    outputs = [l.log_prob(x_rep, y)] + l.get_gradients(x_rep, y).values()
+    outputs += [l.log_prob(x, y, n_samples=n_samples, per_example='X')]
+    outputs += l.get_gradients(x, y, n_samples=n_samples, per_example='X').values()
+
+    do = theano.function([x, x_rep, y], outputs, allow_input_downcast=True)
+
+    x = numpy.random.uniform(size=(4, dim_x)) > 0.5
+    y = numpy.random.uniform(size=(4 * n_samples, dim_y)) > 0.5
+    ret = do(x, x.repeat(n_samples, axis=0), y)
+    n = len(ret) // 2
+    for a, b in zip(ret[:n], ret[n:]):
+        assert numpy.allclose(a, b, atol=1e-5)
+
+
+def test_gaussian_layer_n_samples():
+    dim_y, dim_x, n_samples = 12, 6, 5
+
+    l = GaussianLayer(dim_x, MLP([Tanh()], [dim_y, 10], **inits), name="layer", **inits)
+    l.initialize()
+
+    # Y with one row per example against Y with n_samples copies of every row
+    x, y, y_rep = tensor.matrix('x'), tensor.matrix('y'), tensor.matrix('y_rep')
+    do = theano.function([x, y, y_rep], [l.log_prob(x, y_rep), l.log_prob(x, y, n_samples=n_samples)],
+                         allow_input_downcast=True)
+
+    y = numpy.random.normal(size=(4, dim_y))
+    x = numpy.random.normal(size=(4 * n_samples, dim_x))
+    expected, log_prob = do(x, y, y.repeat(n_samples, axis=0))
+    assert numpy.allclose(expected, log_prob)
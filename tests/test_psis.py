@@ -0,0 +1,44 @@
+
+from __future__ import division, print_function
+
+import unittest
+
+import numpy
+import theano
+
+from theano import tensor
+
+from helmholtz.psis import *
+
+
+def test_pareto_smooth():
+    rng = numpy.random.RandomState(1234)
+
+    # Weights w = u^(-k) have a generalized Pareto tail with shape k
+    for k in [0.2, 0.8]:
+        log_w = -k * numpy.log(rng.uniform(size=(10, 5000)))
+        smoothed, k_hat = pareto_smooth(log_w)
+
+        assert smoothed.shape == log_w.shape
+        assert numpy.abs(numpy.mean(k_hat) - k) < 0.1
+        assert (smoothed.max(axis=1) <= log_w.max(axis=1) + 1e-10).all()
+
+    # Too few samples: weights are left unchanged
+    log_w = rng.normal(size=(2, 10))
+    smoothed, k_hat = pareto_smooth(log_w)
+    assert numpy.allclose(smoothed, log_w)
+    assert numpy.isinf(k_hat).all()
+
+
+def test_pareto_smooth_op():
+    log_w = tensor.matrix('log_w')
+    smoothed, k_hat = pareto_smooth_op(log_w)
+
+    do_smooth = theano.function([log_w], [smoothed, k_hat], allow_input_downcast=True)
+
+    log_w = numpy.random.normal(size=(3, 100)).astype(theano.config.floatX)
+    smoothed, k_hat = do_smooth(log_w)
+    expected, expected_k = pareto_smooth(log_w)
+
+    assert numpy.allclose(smoothed, expected)
+    assert numpy.allclose(k_hat, expected_k)
@@ -2,3 +2,103 @@
 import unittest 
 
 from helmholtz.rws import *
+
+
+def test_log_likelihood_noise():
+    import numpy
+    import theano
+
+    from helmholtz import create_layers
+    from helmholtz.distributions import counter_uniform
+
+    p_layers, q_layers = create_layers("8,4", 16)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    x = tensor.matrix('features')
+    noise = [tensor.matrix() for _ in q_layers]
+    log_px, _ = brick.log_likelihood(x, 10, noise)
+    do_nll = theano.function([x] + noise, log_px, allow_input_downcast=True)
+
+    features = numpy.random.uniform(size=(5, 16)) > 0.5
+    u = [counter_uniform(numpy.arange(5), l, 10, layer.dim_X) for l, layer in enumerate(q_layers)]
+
+    # Common random numbers make the estimate deterministic
+    assert numpy.allclose(do_nll(features, *u), do_nll(features, *u))
+
+
+def test_log_likelihood_sparse():
+    import numpy
+    import scipy.sparse
+    import theano
+    import theano.sparse
+
+    from helmholtz import create_layers
+    from helmholtz.distributions import counter_uniform
+
+    p_layers, q_layers = create_layers("8,4", 16)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    x = tensor.matrix('features')
+    x_sp = theano.sparse.csr_matrix('features')
+    noise = [tensor.matrix() for _ in q_layers]
+    log_px, _ = brick.log_likelihood(x, 10, noise)
+    log_px_sp, _ = brick.log_likelihood(x_sp, 10, noise)
+    do_nll = theano.function([x] + noise, log_px, allow_input_downcast=True)
+    do_nll_sp = theano.function([x_sp] + noise, log_px_sp, allow_input_downcast=True)
+
+    features = numpy.asarray(numpy.random.uniform(size=(5, 16)) > 0.8, dtype=theano.config.floatX)
+    u = [counter_uniform(numpy.arange(5), l, 10, layer.dim_X) for l, layer in enumerate(q_layers)]
+
+    assert numpy.allclose(do_nll(features, *u), do_nll_sp(scipy.sparse.csr_matrix(features), *u), atol=1e-5)
+
+    # Training graph
+    _, _, gradients = brick.get_gradients(x_sp, 10)
+    do_grad = theano.function([x_sp], gradients.values())
+    do_grad(scipy.sparse.csr_matrix(features))
+
+
+def test_sample_q_n_samples():
+    import numpy
+    import theano
+
+    from helmholtz import create_layers, replicate_batch
+    from helmholtz.distributions import counter_uniform
+
+    p_layers, q_layers = create_layers("8,4", 16)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+
+    # Evaluating q_layers[0] once per example and broadcasting the features
+    # (samples[0]) must not change the samples
+    x = tensor.matrix('features')
+    noise = [tensor.matrix() for _ in q_layers]
+    outputs = []
+    for features, n_samples in ((replicate_batch(x, 10), None), (x, 10)):
+        samples, log_p, log_q = brick.sample_q(features, noise, n_samples)
+        outputs += samples[1:] + log_p + log_q
+        outputs += brick.log_prob_p(samples, n_samples) + brick.log_prob_q(samples, n_samples)
+    do = theano.function([x] + noise, outputs, allow_input_downcast=True)
+
+    features = numpy.random.uniform(size=(5, 16)) > 0.5
+    u = [counter_uniform(numpy.arange(5), l, 10, layer.dim_X) for l, layer in enumerate(q_layers)]
+    ret = do(features, *u)
+    n = len(ret) // 2
+    for a, b in zip(ret[:n], ret[n:]):
+        assert numpy.allclose(a, b, atol=1e-5)
+
+
+def test_loo_baseline_requires_iid():
+    from helmholtz import create_layers
+
+    p_layers, q_layers = create_layers("8,4", 16)
+    ReweightedWakeSleep(p_layers, q_layers, loo_baseline=True)
+
+    p_layers, q_layers = create_layers("8,4", 16)
+    try:
+        ReweightedWakeSleep(p_layers, q_layers, loo_baseline=True, sampling='antithetic')
+    except ValueError:
+        pass
+    else:
+        assert False, "loo_baseline accepted correlated samples"
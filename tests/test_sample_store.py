@@ -0,0 +1,73 @@
+
+from __future__ import division, print_function
+
+import unittest
+import shutil
+import tempfile
+
+import numpy
+
+from numpy.testing import assert_allclose
+
+from helmholtz.evaluation import estimate_all
+from helmholtz.sample_store import *
+
+
+def make_store(dirname, n_examples=25, n_samples=20, layer_dims=[13, 10, 3]):
+    store = SampleStore.create(dirname, n_examples, n_samples, layer_dims,
+                               store_samples=True, chunk_size=7)
+
+    log_p, log_q, samples = [], [], []
+    for start in xrange(0, n_examples, 10):
+        n = min(10, n_examples - start)
+        lp = [numpy.random.normal(size=(n, n_samples)).astype(numpy.float32) for _ in layer_dims]
+        lq = [numpy.random.normal(size=(n, n_samples)).astype(numpy.float32) for _ in layer_dims]
+        s = [numpy.random.uniform(size=(n, n_samples, d)) > 0.5 for d in layer_dims]
+        store.write(start, lp, lq, s)
+        log_p.append(lp)
+        log_q.append(lq)
+        samples.append(s)
+    store.flush()
+
+    log_p = [numpy.concatenate(l) for l in zip(*log_p)]
+    log_q = [numpy.concatenate(l) for l in zip(*log_q)]
+    samples = [numpy.concatenate(l) for l in zip(*samples)]
+    return store, log_p, log_q, samples
+
+
+def test_sample_store():
+    dirname = tempfile.mkdtemp()
+    try:
+        _, log_p, log_q, samples = make_store(dirname)
+
+        store = SampleStore(dirname)
+        expected = estimate_all(log_p, log_q)
+
+        assert_allclose(store.log_px(), expected['log_px'], rtol=1e-5, atol=1e-5)
+        assert_allclose(store.log_psx(), expected['log_psx'], rtol=1e-5, atol=1e-5)
+        assert_allclose(store.kl(), expected['kl'], rtol=1e-5, atol=1e-5)
+        assert_allclose(store.layer_kl(), expected['layer_kl'], rtol=1e-5, atol=1e-5)
+        assert_allclose(store.ess(), expected['ess_p'], rtol=1e-5, atol=1e-5)
+        assert_allclose(store.ess(sqrt_weights=True), expected['ess_ps'], rtol=1e-5, atol=1e-5)
+
+        for l in xrange(1, 3):
+            assert (store.samples(l) == samples[l]).all()
+        assert store.samples(2, 3, 5).shape == (2, 20, 3)
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_sample_store_subsampled():
+    dirname = tempfile.mkdtemp()
+    try:
+        store, log_p, log_q, _ = make_store(dirname)
+
+        # K=5 estimates are averaged over the 4 disjoint groups of 5 samples
+        log_w = (sum(log_p) - sum(log_q)).reshape((25, 4, 5))
+        expected = numpy.log(numpy.mean(numpy.exp(log_w), axis=-1)).mean(axis=-1)
+        assert_allclose(store.log_px(5), expected, rtol=1e-5, atol=1e-5)
+
+        counts, edges = store.weight_histogram(bins=10, range=(-20, 0))
+        assert counts.sum() <= 25 * 20
+    finally:
+        shutil.rmtree(dirname)
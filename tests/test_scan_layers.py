@@ -0,0 +1,150 @@
+
+import unittest
+
+import numpy
+import theano
+
+from collections import OrderedDict
+from theano import tensor
+
+from helmholtz import create_layers, merge_gradients, hidden_input_layers
+from helmholtz.rws import ReweightedWakeSleep
+from helmholtz.scan_layers import homogeneous_stretches, stretch_starts, conditional_gradients, is_scannable
+
+
+def make_brick():
+    p_layers, q_layers = create_layers("8,8,8,4", 8)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+    return brick
+
+
+def test_homogeneous_stretches():
+    brick = make_brick()
+    assert homogeneous_stretches(brick) == [(0, 3)]
+    assert homogeneous_stretches(brick, min_length=4) == []
+
+
+def test_scan_log_prob():
+    brick = make_brick()
+    samples = [tensor.matrix() for _ in xrange(5)]
+
+    outputs = []
+    for scan in (False, True):
+        brick.scan_layers = scan
+        outputs += brick.log_prob_p(samples) + brick.log_prob_q(samples)[1:]
+
+    # Gradients of the conditional layers
+    weights = tensor.vector()
+    for which in ('p', 'q'):
+        brick.scan_layers = False
+        expected = OrderedDict()
+        for l in xrange(4):
+            if which == 'p':
+                g = brick.p_layers[l].get_gradients(samples[l], samples[l + 1], weights=weights)
+            else:
+                g = brick.q_layers[l].get_gradients(samples[l + 1], samples[l], weights=weights)
+            expected = merge_gradients(expected, g)
+        gradients = conditional_gradients(brick, which, samples, weights)
+        assert set(gradients.keys()) == set(expected.keys())
+        outputs += [gradients[p] for p in expected] + expected.values()
+
+    do_all = theano.function(samples + [weights], outputs, allow_input_downcast=True,
+                             on_unused_input='ignore')
+
+    values = [numpy.random.uniform(size=(6, d)) > 0.5 for d in (8, 8, 8, 8, 4)]
+    results = do_all(*(values + [numpy.random.uniform(size=6)]))
+
+    log_probs, grads = results[:18], results[18:]
+    for a, b in zip(log_probs[:9], log_probs[9:]):
+        assert numpy.allclose(a, b, atol=1e-5)
+    for which in (0, 1):
+        g = grads[16 * which:16 * (which + 1)]
+        for a, b in zip(g[:8], g[8:]):
+            assert numpy.allclose(a, b, atol=1e-5)
+
+
+def test_scan_sample():
+    brick = make_brick()
+    brick.scan_layers = True
+
+    x = tensor.matrix('features')
+    samples, log_p, log_q = brick.sample_q(x)
+    samples_p, log_p_p, log_q_p = brick.sample_p(7)
+
+    # Log-probs of the drawn samples agree with the scored samples
+    outputs = [sum(log_p) - sum(brick.log_prob_p(samples)),
+               sum(log_q) - sum(brick.log_prob_q(samples)),
+               sum(log_p_p) - sum(brick.log_prob_p(samples_p))] + samples_p
+    do_sample = theano.function([x], outputs, allow_input_downcast=True)
+
+    ret = do_sample(numpy.random.uniform(size=(5, 8)) > 0.5)
+    for diff in ret[:3]:
+        assert numpy.allclose(diff, 0., atol=1e-4)
+    assert [s.shape for s in ret[3:]] == [(7, 8), (7, 8), (7, 8), (7, 8), (7, 4)]
+
+
+def test_scan_n_samples():
+    from helmholtz import replicate_batch
+    from helmholtz.distributions import counter_uniform
+
+    brick = make_brick()
+
+    # Per-example features (stretch starting at the bottom layer) against
+    # the unrolled layers with replicated features
+    x = tensor.matrix('features')
+    noise = [tensor.matrix() for _ in brick.q_layers]
+    weights = tensor.vector()
+    outputs = []
+    for scan, features, n_samples in ((False, replicate_batch(x, 3), None), (True, x, 3)):
+        brick.scan_layers = scan
+        samples, log_p, log_q = brick.sample_q(features, noise, n_samples)
+        outputs += samples[1:] + log_p + log_q
+        gradients = conditional_gradients(brick, 'p', samples, weights, n_samples)
+        outputs += [gradients[p] for p in sorted(gradients, key=lambda p: p.name + str(id(p)))]
+
+    do_all = theano.function([x, weights] + noise, outputs, allow_input_downcast=True)
+
+    u = [counter_uniform(numpy.arange(4), l, 3, layer.dim_X) for l, layer in enumerate(brick.q_layers)]
+    ret = do_all(numpy.random.uniform(size=(4, 8)) > 0.5, numpy.random.uniform(size=12), *u)
+    n = len(ret) // 2
+    for a, b in zip(ret[:n], ret[n:]):
+        assert numpy.allclose(a, b, atol=1e-4)
+
+
+def test_hidden_input_layers_scanned():
+    brick = make_brick()
+    assert len(hidden_input_layers(brick)) == 7
+
+    # Layers of scanned stretches keep the dense product; the bottom
+    # connection is evaluated per example and not scanned
+    brick.scan_layers = True
+    layers = hidden_input_layers(brick)
+    assert layers == [brick.p_layers[0], brick.p_layers[3], brick.q_layers[3]]
+    for layer in layers:
+        layer.binary_input = True
+    assert stretch_starts(brick, n_samples=10) == {1: 3}
+
+
+def test_hidden_input_layers_short_stretch():
+    p_layers, q_layers = create_layers("8,8,4", 8)
+    brick = ReweightedWakeSleep(p_layers, q_layers)
+    brick.initialize()
+    assert homogeneous_stretches(brick) == [(0, 2)]
+
+    # Trimmed to a single connection the stretch is not scanned
+    brick.scan_layers = True
+    assert hidden_input_layers(brick) == brick.p_layers[:-1] + brick.q_layers[1:]
+
+
+def test_is_scannable_batch_normalized():
+    from blocks.bricks import Logistic
+    from helmholtz.batch_normalization import BatchNormalizedMLP
+    from helmholtz.prob_layers import BernoulliLayer
+
+    brick = make_brick()
+    assert is_scannable(brick.p_layers[0])
+
+    # The scan would drop the normalization
+    layer = BernoulliLayer(BatchNormalizedMLP([Logistic()], [8, 8]), name="layer")
+    assert not is_scannable(layer)
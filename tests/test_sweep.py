@@ -0,0 +1,35 @@
+
+import unittest
+
+import sweep
+
+
+def test_split_arguments():
+    argv = "--lr 1e-3 --name foo rws --nsamples 5 200,100".split()
+    global_args, method, method_args = sweep.split_arguments(argv)
+
+    assert global_args == ["--lr", "1e-3", "--name", "foo"]
+    assert method == "rws"
+    assert method_args == ["--nsamples", "5", "200,100"]
+
+    assert sweep.get_option(method_args, ["--nsamples", "-s"]) == "5"
+    assert sweep.strip_option(global_args, ["--name"]) == ["--lr", "1e-3"]
+
+
+def test_parse_channels():
+    assert sweep.parse_channels("\t valid_log_p: 95.5\n") == ("valid_log_p", 95.5)
+    assert sweep.parse_channels("\t iterations_done: 100\n") is None
+
+    name, value = sweep.parse_channels("\t train_log_p: nan\n")
+    assert not sweep.is_finite(value)
+
+
+def test_select_survivors():
+    runs = [{'status': 'alive', 'channels': {'valid_log_p': v}} for v in [4., 2., 3., 1.]]
+    runs[0]['status'] = 'nan'
+
+    survivors = sweep.select_survivors(runs, 'valid_log_p', 2.)
+
+    assert [r['channels']['valid_log_p'] for r in survivors] == [1., 2.]
+    assert runs[2]['status'] == 'pruned'
+    assert runs[0]['status'] == 'nan'
@@ -1,4 +1,33 @@
 
 import unittest 
 
+import numpy
+import theano
+
+from theano import tensor
+
+from helmholtz import replicate_batch
 from helmholtz.vae import *
+
+
+def test_sample_q_n_samples():
+    from blocks.bricks import Tanh
+
+    brick = VAE(x_dim=16, hidden_layers=[10], hidden_act=Tanh(), z_dim=4)
+    brick.initialize()
+
+    # Broadcast features against the log-probs of replicated features
+    x = tensor.matrix('features')
+    samples, log_p, log_q = brick.sample_q(x, n_samples=3)
+    z, = samples
+    x_rep = replicate_batch(x, 3)
+    expected_p = brick.p.log_prob(x_rep, z) + \
+        tensor.sum(-0.5 * tensor.log(2 * numpy.pi) - 0.5 * z ** 2, axis=1)
+    expected_q = brick.q.log_prob(z, x_rep)
+
+    do = theano.function([x], [log_p[0], expected_p, log_q[0], expected_q], allow_input_downcast=True)
+
+    log_p, expected_p, log_q, expected_q = do(numpy.random.uniform(size=(5, 16)) > 0.5)
+    assert log_p.shape == (15,)
+    assert numpy.allclose(log_p, expected_p, atol=1e-5)
+    assert numpy.allclose(log_q, expected_q, atol=1e-5)
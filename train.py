@@ -11,10 +11,12 @@ import logging
 FORMAT = '[%(asctime)s] %(name)-15s %(message)s'
 DATEFMT = "%H:%M:%S"
 logging.basicConfig(format=FORMAT, datefmt=DATEFMT, level=logging.INFO)
+logger = logging.getLogger("train.py")
 
 import ipdb
 import fuel
 import theano
+import theano.sparse
 import numpy as np
 
 import blocks.extras
@@ -50,8 +52,11 @@ from blocks_extras.extensions.display import ImageDataStreamDisplay, WeightDispl
 
 import helmholtz.datasets as datasets
 
-from helmholtz import create_layers
+from helmholtz import create_layers, hidden_input_layers
+from helmholtz.autotune import autotune_batch_size, probe_features
+from helmholtz.batch_normalization import population_updates, inference_mode, add_population_statistics
 from helmholtz.bihm import BiHM
+from helmholtz.distributions import sampling_modes
 from helmholtz.dvae import DVAE
 from helmholtz.rws import ReweightedWakeSleep
 from helmholtz.vae import VAE
@@ -89,7 +94,8 @@ def main(args):
     """Run experiment. """
     lr_tag = float_tag(args.learning_rate)
 
-    x_dim, train_stream, valid_stream, test_stream = datasets.get_streams(args.data, args.batch_size)
+    sparse = getattr(args, 'sparse', False)
+    x_dim, train_stream, valid_stream, test_stream = datasets.get_streams(args.data, args.batch_size, sparse=sparse)
 
     #------------------------------------------------------------
     # Setup model
@@ -139,6 +145,12 @@ def main(args):
     elif args.method == 'rws':
         sizes_tag = args.layer_spec.replace(",", "-")
         qbase = "" if not args.no_qbaseline else "noqb-"
+        if args.loo_baseline:
+            qbase = "loo-"
+        if args.sampling != 'iid':
+            qbase += args.sampling + "-"
+        if args.psis:
+            qbase += "psis-"
 
         name = "%s-%s-%s-%slr%s-dl%d-spl%d-%s" % \
             (args.data, args.method, args.name, qbase, lr_tag, args.deterministic_layers, args.n_samples, sizes_tag)
@@ -152,12 +164,22 @@ def main(args):
                 p_layers,
                 q_layers,
                 qbaseline=(not args.no_qbaseline),
+                loo_baseline=args.loo_baseline,
+                sampling=args.sampling,
+                psis=args.psis,
+                scan_layers=args.scan_layers,
             )
         model.initialize()
     elif args.method == 'bihm-rws':
         sizes_tag = args.layer_spec.replace(",", "-")
-        name = "%s-%s-%s-lr%s-dl%d-spl%d-%s" % \
-            (args.data, args.method, args.name, lr_tag, args.deterministic_layers, args.n_samples, sizes_tag)
+        qbase = "" if not args.loo_baseline else "loo-"
+        if args.sampling != 'iid':
+            qbase += args.sampling + "-"
+        if args.psis:
+            qbase += "psis-"
+
+        name = "%s-%s-%s-%slr%s-dl%d-spl%d-%s" % \
+            (args.data, args.method, args.name, qbase, lr_tag, args.deterministic_layers, args.n_samples, sizes_tag)
 
         p_layers, q_layers = create_layers(
                                 args.layer_spec, x_dim,
@@ -169,6 +191,10 @@ def main(args):
                 q_layers,
                 l1reg=args.l1reg,
                 l2reg=args.l2reg,
+                loo_baseline=args.loo_baseline,
+                sampling=args.sampling,
+                psis=args.psis,
+                scan_layers=args.scan_layers,
             )
         model.initialize()
     elif args.method == 'continue':
@@ -188,14 +214,26 @@ def main(args):
 
         assert isinstance(model, (BiHM, ReweightedWakeSleep, VAE))
 
+        added = add_population_statistics(model)
+        if added:
+            logger.warning("%d batch normalizations had no population statistics; "
+                           "starting them at mean 0, variance 1" % len(added))
+
         mname, _, _ = basename(args.model_file).rpartition("_model.pkl")
         name = "%s-cont-%s-lr%s-spl%s" % (mname, args.name, lr_tag, args.n_samples)
     else:
         raise ValueError("Unknown training method '%s'" % args.method)
 
+    if getattr(args, 'binary_dot', False):
+        for layer in hidden_input_layers(model):
+            layer.binary_input = True
+
     #------------------------------------------------------------
 
-    x = tensor.matrix('features')
+    if sparse:
+        x = theano.sparse.csr_matrix('features')
+    else:
+        x = tensor.matrix('features')
 
     #------------------------------------------------------------
     # Testset monitoring
@@ -204,7 +242,9 @@ def main(args):
     valid_monitors = []
     test_monitors = []
     for s in [1, 10, 100, 1000]:
-        log_p, log_ph = model.log_likelihood(x, s)
+        # Batch normalized models are tested with their population statistics
+        with inference_mode(model):
+            log_p, log_ph = model.log_likelihood(x, s)
         log_p  = -log_p.mean()
         log_ph = -log_ph.mean()
         log_p.name  = "log_p_%d" % s
@@ -247,6 +287,17 @@ def main(args):
         train_monitors += [log_p, log_ph]
         valid_monitors += [log_p, log_ph]
 
+        # Sampler health from the importance weights of the gradient estimate
+        train_monitors += [named(model.ess.mean(), 'ess'),
+                           named(model.max_weight.mean(), 'max_weight'),
+                           named(model.weight_entropy.mean(), 'weight_entropy')]
+
+        if model.psis:
+            # Mean tail shape over the examples with a fitted tail
+            fitted = 1 - tensor.isinf(model.psis_k)
+            psis_k = tensor.switch(fitted, model.psis_k, 0.).sum() / tensor.maximum(fitted.sum(), 1)
+            train_monitors += [named(psis_k, 'psis_k')]
+
     #------------------------------------------------------------
     # Detailed monitoring
     """
@@ -287,6 +338,18 @@ def main(args):
         s.name = "samples_h%d" % i
         s.tag.aggregation_scheme = aggregation.TakeLast(s)
     """
+    #------------------------------------------------------------
+    # Batch size autotuning
+
+    if args.mem_budget is not None:
+        do_grad = theano.function([x], gradients.values(), name="do_grad", allow_input_downcast=True)
+        probe = probe_features(args.data, sparse=sparse)
+
+        batch_size = autotune_batch_size(lambda bs: do_grad(probe[:bs]), model, args.n_samples,
+                                         args.mem_budget, "train-%s" % args.method,
+                                         max_batch=probe.shape[0], training=True)
+        x_dim, train_stream, valid_stream, test_stream = datasets.get_streams(args.data, batch_size, sparse=sparse)
+
     cg = ComputationGraph([cost])
 
     #------------------------------------------------------------
@@ -314,6 +377,11 @@ def main(args):
         ])
     )
 
+    # Running averages of the batch normalization statistics
+    bn_updates = population_updates([cost])
+    if bn_updates:
+        algorithm.add_updates(bn_updates)
+
     #------------------------------------------------------------
 
     train_monitors += [aggregation.mean(algorithm.total_gradient_norm),
@@ -392,6 +460,8 @@ if __name__ == "__main__":
                 help="Enable live plotting to a Bokkeh server")
     parser.add_argument("--bs", "--batch-size", type=int, dest="batch_size",
                 default=100, help="Size of each mini-batch (default: 100)")
+    parser.add_argument("--mem-budget", type=str, dest="mem_budget",
+                default=None, help="Autotune the batch size for this memory budget (e.g. 2G) instead of using --bs")
     parser.add_argument("--step-rule", choices=['momentum', 'adam', 'rmsprop'], dest="step_rule",
                 default="adam", help="Chose SGD alrogithm (default: adam)"),
     parser.add_argument("--lr", "--learning-rate", type=float, dest="learning_rate",
@@ -441,6 +511,18 @@ if __name__ == "__main__":
                 default=10, help="Number of IS samples")
     subparser.add_argument("--no-qbaseline", "--nobase", action="store_true",
                 default=False, help="Deactivate 1/n_samples baseline for Q gradients")
+    subparser.add_argument("--loo-baseline", "--loo", action="store_true",
+                default=False, help="Use per-sample leave-one-out baselines for Q gradients")
+    subparser.add_argument("--sampling", choices=sampling_modes,
+                default='iid', help="How to draw the proposal samples per example (default: iid)")
+    subparser.add_argument("--psis", action="store_true",
+                default=False, help="Pareto smooth the importance weights (smooths from 21 samples up)")
+    subparser.add_argument("--scan-layers", action="store_true", dest="scan_layers",
+                default=False, help="Process equal-width stretches of layers with theano.scan")
+    subparser.add_argument("--binary-dot", action="store_true", dest="binary_dot",
+                default=False, help="Multiply binary hidden samples as sums of selected weight rows")
+    subparser.add_argument("--sparse", action="store_true", dest="sparse",
+                default=False, help="Feed the features as sparse CSR batches (rcv1, web, nips)")
     subparser.add_argument("--deterministic-layers", type=int, dest="deterministic_layers",
                 default=0, help="Deterministic hidden layers per stochastic layer")
     subparser.add_argument("layer_spec", type=str,
@@ -455,6 +537,18 @@ if __name__ == "__main__":
                 default=0.0, help="L1 regularization for weight matrices")
     subparser.add_argument("--l2reg", type=float, dest="l2reg",
                 default=0.0, help="L2 regularization for weight matrices")
+    subparser.add_argument("--loo-baseline", "--loo", action="store_true",
+                default=False, help="Use per-sample leave-one-out baselines for Q gradients")
+    subparser.add_argument("--sampling", choices=sampling_modes,
+                default='iid', help="How to draw the proposal samples per example (default: iid)")
+    subparser.add_argument("--psis", action="store_true",
+                default=False, help="Pareto smooth the importance weights (smooths from 21 samples up)")
+    subparser.add_argument("--scan-layers", action="store_true", dest="scan_layers",
+                default=False, help="Process equal-width stretches of layers with theano.scan")
+    subparser.add_argument("--binary-dot", action="store_true", dest="binary_dot",
+                default=False, help="Multiply binary hidden samples as sums of selected weight rows")
+    subparser.add_argument("--sparse", action="store_true", dest="sparse",
+                default=False, help="Feed the features as sparse CSR batches (rcv1, web, nips)")
     subparser.add_argument("--deterministic-layers", type=int, dest="deterministic_layers",
                 default=0, help="Deterministic hidden layers per stochastic layer")
     subparser.add_argument("layer_spec", type=str,
@@ -462,4 +556,8 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if getattr(args, 'loo_baseline', False) and args.sampling != 'iid':
+        parser.error("--loo-baseline requires --sampling iid: with correlated samples "
+                     "the baseline of a sample depends on the sample itself")
+
     main(args)